@@ -0,0 +1,141 @@
+"""Synthetic campusonline note_ajax.php pages for the benchmarks."""
+
+from __future__ import annotations
+
+import random
+
+GRADE_TYPES = ("CC", "DE", "TP", "Projet")
+
+
+def generate_years(
+    years: int = 1,
+    modules: int = 8,
+    courses: int = 4,
+    grade_types: int = 3,
+    seed: int = 0,
+) -> list[dict]:
+    """
+    Generate grades in the nested years structure of the snapshots.
+
+    @param years: Number of school years.
+    @param modules: Modules per semester.
+    @param courses: Courses per module.
+    @param grade_types: Grade types per course.
+    @param seed: Seed of the random values, the same seed gives the same page.
+    @return: The grades as a list of years.
+    """
+    rng = random.Random(seed)
+    result = []
+
+    for year in range(years):
+        semesters = []
+        for semester in (1, 2):
+            semester_modules = []
+            for module in range(modules):
+                module_courses = []
+                for course in range(courses):
+                    course_grades_type = []
+                    for grade_type in range(grade_types):
+                        count = rng.randint(0, 3)
+                        grades = [
+                            {
+                                "grade": f"{rng.randint(0, 40) / 2:g}",
+                                "coef": str(100 // count) if count > 1 else "100.0",
+                            }
+                            for _ in range(count)
+                        ]
+                        course_grades_type.append(
+                            {
+                                "grade_type": GRADE_TYPES[grade_type % len(GRADE_TYPES)],
+                                "coefficient": float(rng.choice((20, 40, 50, 60))),
+                                "grades": grades,
+                            }
+                        )
+                    module_courses.append(
+                        {
+                            "course_name": f"Course {year}.{semester}.{module}.{course} / Cours",
+                            "course_ponderation": float(rng.randint(1, 6)),
+                            "course_grades_type": course_grades_type,
+                        }
+                    )
+                semester_modules.append(
+                    {"module_name": f"Module {module}", "module_courses": module_courses}
+                )
+            semesters.append(
+                {"semester_name": f"semestre {semester}", "semester_modules": semester_modules}
+            )
+        result.append({"year_name": f"Year {year + 1}", "semesters": semesters})
+
+    return result
+
+
+def _row(libelle: str, ponderation: str = "", coefficient: str = "", note: str = "", classes: str = "") -> str:
+    class_attr = f' class="{classes}"' if classes else ""
+    return (
+        f"<tr{class_attr}><td>&nbsp;{libelle} </td><td>{ponderation}</td>"
+        f"<td> {coefficient}</td><td><span>{note}</span></td></tr>"
+    )
+
+
+def render_portal(years: list[dict]) -> str:
+    """Render grades in the nested years structure as a note_ajax.php page."""
+    rows = []
+    for year in years:
+        rows.append(_row(year["year_name"], classes="master"))
+        for semester in year["semesters"]:
+            rows.append(_row(f"{semester['semester_name'].title()} / Semester", classes="slave"))
+            for module in semester["semester_modules"]:
+                rows.append(_row(module["module_name"], classes="slave odd"))
+                for course in module["module_courses"]:
+                    ponderation = f"{course['course_ponderation']:.2f}".replace(".", ",")
+                    rows.append(_row(course["course_name"], ponderation=ponderation))
+                    for grade_type in course["course_grades_type"]:
+                        grades = grade_type["grades"]
+                        if not grades:
+                            note = "- (%)"
+                        elif len(grades) == 1 and grades[0]["coef"] == "100.0":
+                            note = grades[0]["grade"].replace(".", ",")
+                        else:
+                            note = " - ".join(
+                                f"{g['grade'].replace('.', ',')} ({g['coef']}%)" for g in grades
+                            )
+                        rows.append(
+                            _row(
+                                grade_type["grade_type"],
+                                coefficient=f"{grade_type['coefficient']:g}%",
+                                note=note,
+                            )
+                        )
+
+    return (
+        "<html><head><meta charset='utf-8'><title>Notes</title></head><body>"
+        "<table><thead><tr><th>Libellé</th></tr></thead><tbody>"
+        + "\n".join(rows)
+        + "</tbody></table></body></html>"
+    )
+
+
+def drop_grades(years: list[dict], every: int = 10) -> list[dict]:
+    """Copy of the grades with one grade out of `every` removed, as an older snapshot."""
+    seen = 0
+    result = []
+    for year in years:
+        semesters = []
+        for semester in year["semesters"]:
+            modules = []
+            for module in semester["semester_modules"]:
+                courses = []
+                for course in module["module_courses"]:
+                    grade_types = []
+                    for grade_type in course["course_grades_type"]:
+                        grades = []
+                        for grade in grade_type["grades"]:
+                            seen += 1
+                            if seen % every:
+                                grades.append(grade)
+                        grade_types.append({**grade_type, "grades": grades})
+                    courses.append({**course, "course_grades_type": grade_types})
+                modules.append({**module, "module_courses": courses})
+            semesters.append({**semester, "semester_modules": modules})
+        result.append({**year, "semesters": semesters})
+    return result
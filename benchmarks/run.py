@@ -0,0 +1,233 @@
+"""
+Benchmark the fetch-less part of a polling cycle on synthetic portal pages.
+
+Each stage (extract_rows, parse_rows, compare_grades, save_json, load_json,
+flatten_grades, notify, ...) is timed separately and its memory peak is
+recorded with tracemalloc. The results are compared to a stored baseline and
+the run fails when a stage got slower or bigger than the tolerance allows:
+
+    python -m benchmarks.run                      # compare to the baseline
+    python -m benchmarks.run --update-baseline    # record a new baseline
+"""
+
+from __future__ import annotations
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+SRC_DIR = ROOT_DIR / "src"
+for path in (ROOT_DIR, SRC_DIR):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+from benchmarks.portal import drop_grades, generate_years, render_portal  # noqa: E402
+from benchmarks.stub_ntfy import StubNtfyServer  # noqa: E402
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+DEFAULT_SIZES = (1, 5, 10)
+DEFAULT_REPEAT = 5
+# Timings are noisy across runs and machines, memory peaks much less so
+DEFAULT_TIME_TOLERANCE = 0.5
+DEFAULT_MEMORY_TOLERANCE = 0.2
+
+
+def measure(fn: Callable[..., Any], setup: Callable[[], tuple] = tuple, repeat: int = DEFAULT_REPEAT) -> dict[str, float]:
+    """
+    Time a stage and record its memory peak.
+
+    @param fn: The stage, called with the arguments returned by `setup`.
+    @param setup: Builds the arguments of one call, outside of the timing.
+    @param repeat: Number of timed calls, the fastest one is kept.
+    @return: {"seconds": best time, "peak_kb": tracemalloc peak of one call}.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+
+    args = setup()
+    tracemalloc.start()
+    try:
+        fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"seconds": best, "peak_kb": peak / 1024}
+
+
+def _notify(ntfy_url: str, outbox_dir: Path, messages: list[dict]) -> Callable[[], tuple]:
+    from notifier import Dispatcher, Outbox
+
+    counter = iter(range(sys.maxsize))
+
+    def setup() -> tuple:
+        outbox = Outbox(str(outbox_dir / f"outbox-{next(counter)}.json"))
+        # Spread the grades over a few topics so several requests are sent
+        for topic in range(4):
+            outbox.enqueue(f"bench-{topic}", messages[topic::4], None)
+        return (outbox,)
+
+    def run(outbox) -> None:
+        async def flush() -> None:
+            import httpx
+
+            async with httpx.AsyncClient() as client:
+                dispatcher = Dispatcher(outbox, client=client, ntfy_url=ntfy_url)
+                await dispatcher.flush()
+
+        asyncio.run(flush())
+
+    return setup, run
+
+
+def bench_size(years_count: int, workdir: Path, ntfy_url: str, repeat: int) -> dict[str, dict[str, float]]:
+    """Run every stage on a page of `years_count` years."""
+    from extract_grades import PARSER_LXML, extract_rows, get_parser_backend, parse_html, parse_rows
+    from get_new_grades import GradeIndex, compare_grades, format_grades
+    from utils import load_json, save_json
+    from src.web.api import flatten_grades
+
+    years = generate_years(years_count)
+    old_years = drop_grades(years)
+    html = render_portal(years)
+    rows = extract_rows(html)
+    sheet = parse_rows(rows)
+    index = GradeIndex()
+    index.commit(index.diff(old_years)[1])
+    messages = format_grades(index.diff(sheet)[0])
+
+    snapshot = workdir / f"grades-{years_count}.json"
+    save_json(years, str(snapshot))
+    counter = iter(range(sys.maxsize))
+
+    results = {
+        "extract_rows": measure(extract_rows, lambda: (html,), repeat),
+        "parse_rows": measure(parse_rows, lambda: (rows,), repeat),
+        "compare_grades": measure(compare_grades, lambda: (old_years, years), repeat),
+        "index_diff": measure(index.diff, lambda: (sheet,), repeat),
+        "to_years": measure(sheet.to_years, tuple, repeat),
+        # A new path every call, unchanged files are not rewritten
+        "save_json": measure(
+            save_json, lambda: (years, str(workdir / f"save-{next(counter)}.json")), repeat
+        ),
+        "load_json": measure(load_json, lambda: (str(snapshot),), repeat),
+        "flatten_grades": measure(flatten_grades, lambda: (years,), repeat),
+    }
+
+    if get_parser_backend(PARSER_LXML) == PARSER_LXML:
+        results["parse_lxml"] = measure(parse_html, lambda: (html, PARSER_LXML), repeat)
+
+    setup, notify = _notify(ntfy_url, workdir, messages)
+    results["notify"] = measure(notify, setup, repeat)
+
+    return results
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat: int = DEFAULT_REPEAT) -> dict[str, Any]:
+    """
+    Benchmark every stage for each page size.
+
+    @param sizes: Numbers of years of the synthetic pages.
+    @param repeat: Number of timed calls per stage.
+    @return: {"python": version, "sizes": {years: {stage: measures}}}.
+    """
+    results: dict[str, Any] = {"python": platform.python_version(), "sizes": {}}
+
+    with tempfile.TemporaryDirectory() as workdir, StubNtfyServer() as ntfy:
+        for years_count in sizes:
+            results["sizes"][str(years_count)] = bench_size(
+                years_count, Path(workdir), ntfy.url, repeat
+            )
+
+    return results
+
+
+def compare_to_baseline(
+    results: dict[str, Any],
+    baseline: dict[str, Any],
+    time_tolerance: float = DEFAULT_TIME_TOLERANCE,
+    memory_tolerance: float = DEFAULT_MEMORY_TOLERANCE,
+) -> list[str]:
+    """
+    List the stages that regressed compared to the baseline.
+
+    Stages or sizes missing from either side are ignored.
+
+    @return: One human readable line per regression, empty if none.
+    """
+    regressions = []
+    limits = (("seconds", time_tolerance), ("peak_kb", memory_tolerance))
+
+    for size, stages in results.get("sizes", {}).items():
+        base_stages = baseline.get("sizes", {}).get(size, {})
+        for stage, measures in stages.items():
+            base = base_stages.get(stage)
+            if base is None:
+                continue
+            for key, tolerance in limits:
+                limit = base[key] * (1 + tolerance)
+                if measures[key] > limit:
+                    regressions.append(
+                        f"{stage} ({size} years): {key} {measures[key]:.4g} > "
+                        f"{base[key]:.4g} + {tolerance:.0%}"
+                    )
+
+    return regressions
+
+
+def format_results(results: dict[str, Any]) -> str:
+    lines = [f"{'stage':<16}{'years':>6}{'ms':>12}{'peak KB':>12}"]
+    for size, stages in results["sizes"].items():
+        for stage, measures in stages.items():
+            lines.append(
+                f"{stage:<16}{size:>6}{measures['seconds'] * 1000:>12.2f}"
+                f"{measures['peak_kb']:>12.1f}"
+            )
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--time-tolerance", type=float, default=DEFAULT_TIME_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=DEFAULT_MEMORY_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.repeat)
+    print(format_results(results))
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}, run with --update-baseline first")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+    regressions = compare_to_baseline(
+        results, baseline, args.time_tolerance, args.memory_tolerance
+    )
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,4 @@
-import type { FlattenedGrade } from "../types";
+import type { FlattenedGrade, GradesResponse } from "../types";
 
 export type GradeFilters = {
   search: string;
@@ -7,21 +7,56 @@ export type GradeFilters = {
   module: string;
 };
 
-export function filterRows(
-  rows: FlattenedGrade[],
+// Columns rendered by the grades view, and the API's largest page
+const FIELDS = [
+  "year",
+  "semester",
+  "module",
+  "course",
+  "grade_type",
+  "grade_value",
+  "grade_numeric",
+  "grade_coef",
+  "type_coefficient",
+  "status",
+].join(",");
+const PAGE_SIZE = 1000;
+
+export function gradesQuery(
+  filters: GradeFilters,
+  cursor: string | null = null,
+): URLSearchParams {
+  const params = new URLSearchParams({ fields: FIELDS, limit: String(PAGE_SIZE) });
+  const search = filters.search.trim();
+  if (search) params.set("q", search);
+  if (filters.year) params.set("year", filters.year);
+  if (filters.semester) params.set("semester", filters.semester);
+  if (filters.module) params.set("module", filters.module);
+  if (cursor) params.set("cursor", cursor);
+  return params;
+}
+
+// Filtered and paginated by the API. A cursor from an older version of the
+// grades is answered with 410 Gone: start over instead of mixing versions.
+export async function fetchFilteredGrades(
   filters: GradeFilters,
-): FlattenedGrade[] {
-  const search = filters.search.trim().toLowerCase();
-  return rows.filter((row) => {
-    const matchesSearch =
-      search.length === 0 ||
-      row.course.toLowerCase().includes(search) ||
-      row.module.toLowerCase().includes(search) ||
-      row.grade_type.toLowerCase().includes(search);
-    const matchesYear = !filters.year || row.year === filters.year;
-    const matchesSemester =
-      !filters.semester || row.semester === filters.semester;
-    const matchesModule = !filters.module || row.module === filters.module;
-    return matchesSearch && matchesYear && matchesSemester && matchesModule;
-  });
+  signal?: AbortSignal,
+): Promise<FlattenedGrade[]> {
+  let rows: FlattenedGrade[] = [];
+  let cursor: string | null = null;
+  for (;;) {
+    const res = await fetch(`/api/grades?${gradesQuery(filters, cursor)}`, {
+      signal,
+    });
+    if (res.status === 410 && cursor) {
+      rows = [];
+      cursor = null;
+      continue;
+    }
+    if (!res.ok) throw new Error(`Grades API: ${res.status}`);
+    const page: GradesResponse = await res.json();
+    rows = rows.concat(page.flattened);
+    cursor = page.next_cursor ?? null;
+    if (!cursor) return rows;
+  }
 }
@@ -14,8 +14,10 @@ export type FlattenedGrade = {
 };
 
 export type GradesResponse = {
-  years: unknown[];
+  years?: unknown[];
   flattened: FlattenedGrade[];
+  total?: number;
+  next_cursor?: string | null;
 };
 
 export type MetaResponse = {
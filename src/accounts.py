@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import os
+import logging
+from dataclasses import dataclass
+from urllib.parse import urlparse
+from utils import get_env_variable, load_json
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATA_DIR = "src/data"
+
+
+@dataclass(frozen=True)
+class Account:
+    """A student account to watch: where to fetch grades and where to notify."""
+
+    name: str
+    grades_url: str
+    topic: str
+    click_url: str | None = None
+    start_hour: int | None = None
+    end_hour: int | None = None
+    data_dir: str = DEFAULT_DATA_DIR
+
+    @property
+    def host(self) -> str:
+        return urlparse(self.grades_url).netloc
+
+    @property
+    def redirect_url(self) -> str:
+        return self.click_url or self.grades_url
+
+    @property
+    def new_grades_path(self) -> str:
+        return os.path.join(self.data_dir, "new_grades.json")
+
+    @property
+    def old_grades_path(self) -> str:
+        return os.path.join(self.data_dir, "old_grades.json")
+
+    @property
+    def fingerprint_path(self) -> str:
+        return os.path.join(self.data_dir, "fingerprint.txt")
+
+    @property
+    def has_window(self) -> bool:
+        return self.start_hour is not None and self.end_hour is not None
+
+    def in_window(self, hour: int) -> bool:
+        """
+        Check whether the given hour falls in the account's polling window.
+
+        @param hour: The hour of the day (0-23).
+        @return: True if the account should be polled at this hour.
+        """
+        if not self.has_window:
+            return True
+        if self.start_hour <= self.end_hour:
+            return self.start_hour <= hour < self.end_hour
+        # Window wrapping around midnight, e.g. 23 -> 2
+        return hour >= self.start_hour or hour < self.end_hour
+
+
+def _account_from_dict(entry: dict, index: int, data_root: str) -> Account:
+    name = entry.get("name") or f"account-{index}"
+    grades_url = entry.get("grades_url")
+    topic = entry.get("topic")
+
+    if not grades_url:
+        raise ValueError(f"Account {name} has no grades_url.")
+    if not topic:
+        raise ValueError(f"Account {name} has no topic.")
+
+    window = entry.get("window") or [None, None]
+    if len(window) != 2:
+        raise ValueError(f"Account {name} window must be [start_hour, end_hour].")
+
+    return Account(
+        name=name,
+        grades_url=grades_url,
+        topic=topic,
+        click_url=entry.get("click_url"),
+        start_hour=window[0],
+        end_hour=window[1],
+        data_dir=entry.get("data_dir") or os.path.join(data_root, "accounts", name),
+    )
+
+
+def load_accounts(path=None, default_window=None, data_root=DEFAULT_DATA_DIR):
+    """
+    Load the list of accounts to watch.
+
+    Accounts are read from the JSON file pointed to by `path` (or the
+    ACCOUNTS_FILE environment variable). Without a file, a single account is
+    built from GRADES_URL / NTFY_TOPIC / CLICK_GRADES_URL, keeping the data
+    files in `data_root` like before.
+
+    @param path: Optional path to the accounts JSON file.
+    @param default_window: (start_hour, end_hour) used by the env account.
+    @param data_root: Root directory for account data files.
+    @return: A list of Account objects.
+    """
+    path = path or get_env_variable("ACCOUNTS_FILE")
+
+    if path:
+        entries = load_json(path)
+        if not isinstance(entries, list):
+            raise ValueError(f"Accounts file {path} must contain a list of accounts.")
+
+        accounts = [
+            _account_from_dict(entry, index, data_root)
+            for index, entry in enumerate(entries)
+        ]
+        names = [account.name for account in accounts]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate account names in {path}.")
+
+        logger.info(f"Loaded {len(accounts)} accounts from {path}")
+        return accounts
+
+    topic_name = get_env_variable("NTFY_TOPIC")
+    if not topic_name:
+        raise ValueError("NTFY_TOPIC environment variable is not set.")
+
+    grades_url = get_env_variable("GRADES_URL")
+    if not grades_url:
+        raise ValueError("GRADES_URL environment variable is not set.")
+
+    start_hour, end_hour = default_window or (None, None)
+    return [
+        Account(
+            name="default",
+            grades_url=grades_url,
+            topic=topic_name,
+            click_url=get_env_variable("CLICK_GRADES_URL"),
+            start_hour=start_hour,
+            end_hour=end_hour,
+            data_dir=data_root,
+        )
+    ]
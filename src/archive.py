@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import os
+import gzip
+import json
+import zlib
+import logging
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+class CaptureArchive:
+    """
+    Append-only archive of the raw grades pages fetched by the scraper.
+
+    Each account gets one file per UTC day, `<directory>/<account>/<day>.ndjson.gz`,
+    holding one JSON line per captured page. Every record is written as its
+    own gzip member, so appending never rewrites the file and a write torn by
+    a crash only loses that record.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def path_for(self, account: str, captured_at: str) -> str:
+        return os.path.join(self.directory, account, f"{captured_at[:10]}.ndjson.gz")
+
+    def append(self, account, url, status_code, text, captured_at=None):
+        """
+        Archive a fetched page.
+
+        @param account: The account the page belongs to.
+        @param url: The URL the page was fetched from.
+        @param status_code: The HTTP status code of the response.
+        @param text: The HTML content of the page.
+        @param captured_at: ISO timestamp of the capture, defaults to now.
+        @return: The path of the archive file written to.
+        """
+        captured_at = captured_at or _now()
+        record = {"at": captured_at, "url": url, "status": status_code, "html": text}
+        member = gzip.compress(
+            json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n", mtime=0
+        )
+
+        path = self.path_for(account, captured_at)
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "ab") as f:
+                f.write(member)
+        return path
+
+    def accounts(self):
+        """The names of the archived accounts."""
+        try:
+            return sorted(
+                name
+                for name in os.listdir(self.directory)
+                if os.path.isdir(os.path.join(self.directory, name))
+            )
+        except FileNotFoundError:
+            return []
+
+    def records(self, account, since=None, until=None):
+        """
+        Stream the archived pages of an account, oldest first.
+
+        @param account: The account name.
+        @param since: Only days on or after this YYYY-MM-DD date.
+        @param until: Only days on or before this YYYY-MM-DD date.
+        @return: An iterator of {"at", "url", "status", "html"} records.
+        """
+        directory = os.path.join(self.directory, account)
+        try:
+            names = sorted(name for name in os.listdir(directory) if name.endswith(".ndjson.gz"))
+        except FileNotFoundError:
+            return
+
+        for name in names:
+            day = name[:10]
+            if (since and day < since) or (until and day > until):
+                continue
+            yield from _read_records(os.path.join(directory, name))
+
+
+def _read_records(path):
+    try:
+        with gzip.open(path, "rb") as f:
+            for line in f:
+                yield json.loads(line)
+    except (EOFError, gzip.BadGzipFile, zlib.error, ValueError) as e:
+        # Only the last record can be torn: the previous ones were complete
+        logger.warning(f"Stopping at a truncated record in {path}: {e}")
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+from collections import Counter
+from typing import Any, Iterable
+
+from grade_model import COURSE, GRADE_TYPE, MODULE, SEMESTER, YEAR, GradeRow, GradeSheet, as_sheet
+
+# Keys of the levels in the /api/averages payload
+CHILDREN_KEYS = ("semesters", "modules", "courses", "grade_types")
+
+
+def grade_value(value) -> float | None:
+    """The numeric value of a grade on 20, None for statuses like "Validé"."""
+    if value is None:
+        return None
+    try:
+        numeric = float(str(value).replace(",", ".").strip())
+    except ValueError:
+        return None
+    return numeric if 0 <= numeric <= 20 else None
+
+
+def _weight(value, default: float = 1.0) -> float:
+    """A coefficient or ponderation, `default` when the portal gives none."""
+    if value is None:
+        return default
+    try:
+        return float(str(value).replace(",", ".").replace("%", ""))
+    except ValueError:
+        return default
+
+
+class AverageNode:
+    """
+    Weighted sum and weight of the contributions of a node's children.
+
+    Grade types average their grades weighted by the grade coef, courses
+    their grade types weighted by the type coefficient, modules their
+    courses weighted by the course ponderation. Semesters and years add up
+    the weighted sums of their children, so their average is the
+    ponderation-weighted average of all their courses.
+    """
+
+    __slots__ = ("name", "level", "parent", "children", "total", "weight", "weight_in_parent", "contribution")
+
+    def __init__(self, name, level, parent=None, weight_in_parent=None):
+        self.name = name
+        self.level = level
+        self.parent = parent
+        self.children: dict[str, AverageNode] = {}
+        self.total = 0.0
+        self.weight = 0.0
+        # Fixed weight in the parent, None to contribute the node's own weight
+        self.weight_in_parent = weight_in_parent
+        self.contribution = (0.0, 0.0)
+
+    @property
+    def average(self) -> float | None:
+        return self.total / self.weight if self.weight else None
+
+    def _contribution(self) -> tuple[float, float]:
+        if not self.weight:
+            return 0.0, 0.0
+        if self.weight_in_parent is None:
+            return self.total, self.weight
+        return self.average * self.weight_in_parent, self.weight_in_parent
+
+    def add(self, total: float, weight: float) -> list["AverageNode"]:
+        """
+        Add to the node and update its ancestors only.
+
+        @return: The nodes whose average was recomputed, deepest first.
+        """
+        updated = []
+        node = self
+        while node is not None:
+            node.total += total
+            node.weight += weight
+            updated.append(node)
+
+            previous, node.contribution = node.contribution, node._contribution()
+            total = node.contribution[0] - previous[0]
+            weight = node.contribution[1] - previous[1]
+            node = node.parent
+        return updated
+
+
+def _row_key(row: GradeRow) -> tuple:
+    # The position of a row in the page does not matter
+    return row[1:]
+
+
+class AveragesEngine:
+    """
+    Weighted averages of every grade type, course, module, semester and year.
+
+    Averages are maintained incrementally: a new grade only updates the
+    nodes on its path to the root. sync() falls back to a full rebuild when
+    grades disappeared or changed, which only happens on corrections.
+    """
+
+    def __init__(self, sheet: GradeSheet | list[dict[str, Any]] | None = None):
+        self._load(as_sheet(sheet))
+
+    def _load(self, sheet: GradeSheet) -> None:
+        self.root = AverageNode(None, None)
+        self._grades: Counter = Counter()
+        for row in sheet:
+            self.add(row)
+
+    def _node(self, row: GradeRow, level: int) -> AverageNode:
+        node = self.root
+        for depth, name, weight in (
+            (YEAR, row.year, None),
+            (SEMESTER, row.semester, None),
+            (MODULE, row.module, None),
+            (COURSE, row.course, _weight(row.course_ponderation)),
+            (GRADE_TYPE, row.grade_type, _weight(row.type_coefficient)),
+        ):
+            if depth > level:
+                break
+            child = node.children.get(name)
+            if child is None:
+                child = node.children[name] = AverageNode(name, depth, node, weight)
+            node = child
+        return node
+
+    def add(self, row: GradeRow) -> list[AverageNode]:
+        """
+        Add one row of the sheet.
+
+        @param row: A grade, or a node without grades which is only created.
+        @return: The nodes whose average was recomputed, deepest first.
+        """
+        if row.grade is None:
+            self._node(row, row.level)
+            return []
+
+        self._grades[_row_key(row)] += 1
+        value = grade_value(row.grade)
+        node = self._node(row, GRADE_TYPE)
+        if value is None:
+            return []
+
+        coef = _weight(row.coef, 100.0)
+        return node.add(value * coef, coef)
+
+    def sync(self, sheet: GradeSheet) -> list[GradeRow]:
+        """
+        Bring the averages up to date with the current page.
+
+        @param sheet: The GradeSheet of the current page.
+        @return: The grade rows that were added.
+        """
+        current = Counter(_row_key(row) for row in sheet.grades())
+        added = current - self._grades
+        rebuild = bool(self._grades - current)
+
+        new_rows = []
+        for row in sheet:
+            if row.grade is None:
+                # Nodes without grades only need to exist, in page order
+                if not rebuild:
+                    self._node(row, row.level)
+                continue
+            key = _row_key(row)
+            if added[key]:
+                added[key] -= 1
+                new_rows.append(row)
+                if not rebuild:
+                    self.add(row)
+
+        if rebuild:
+            # A grade was removed or corrected: start over
+            self._load(sheet)
+        return new_rows
+
+    def course_average(self, row: GradeRow) -> float | None:
+        """The average of the course a grade row belongs to."""
+        return self._node(row, COURSE).average
+
+    def course_averages(self) -> dict[tuple, float]:
+        """
+        The average of every graded course, by course path.
+
+        Course names repeat across years and modules, so the key is the whole
+        path, the first four fields of a tree_diff.GradeSlot.
+
+        @return: {(year, semester, module, course): average}.
+        """
+        averages = {}
+        for year in self.root.children.values():
+            for semester in year.children.values():
+                for module in semester.children.values():
+                    for course in module.children.values():
+                        if course.average is not None:
+                            path = (year.name, semester.name, module.name, course.name)
+                            averages[path] = course.average
+        return averages
+
+    def to_dict(self, precision: int = 2) -> dict[str, Any]:
+        """
+        The averages as a nested payload, for /api/averages.
+
+        @param precision: Decimals kept in the averages.
+        @return: {"years": [{"name", "average", "semesters": [...]}, ...]}.
+        """
+
+        def render(node: AverageNode) -> dict[str, Any]:
+            average = node.average
+            payload = {
+                "name": node.name,
+                "average": round(average, precision) if average is not None else None,
+            }
+            if node.level < GRADE_TYPE:
+                payload[CHILDREN_KEYS[node.level]] = [
+                    render(child) for child in node.children.values()
+                ]
+            return payload
+
+        return {"years": [render(year) for year in self.root.children.values()]}
+
+
+def compute_averages(years: Iterable[dict[str, Any]] | GradeSheet) -> dict[str, Any]:
+    """Compute the averages payload of a grades file, see AveragesEngine.to_dict."""
+    return AveragesEngine(as_sheet(years)).to_dict()
@@ -1,22 +1,37 @@
+import io
 import re
 import logging
-from setup_logging import setup_logging
-from bs4 import BeautifulSoup
-from utils import load_env_variables
-
-setup_logging()
-load_env_variables()
+from grade_model import GradeSheetBuilder
+from metrics import counter, histogram
+from utils import get_env_variable
 
 logger = logging.getLogger(__name__)
 
+# Parser backends selectable with the GRADES_PARSER environment variable
+PARSER_BS4 = "html.parser"
+PARSER_LXML = "lxml"
+PARSERS = (PARSER_BS4, PARSER_LXML)
+
+# Raised by both backends for pages without grades table (login, maintenance)
+NO_TABLE_MESSAGE = "No grades table found in the page"
+
+parse_seconds = histogram("grades_parse_seconds", "Time spent parsing a grades page")
+parsed_rows_total = counter("grades_parsed_rows_total", "Table rows read from grades pages")
+
+
 def extract_rows(html_content):
     """Extract rows from the HTML content of the grades page.
 
     @param html_content: The HTML content of the grades page.
     @return: A list of BeautifulSoup row elements.
+    @raise ValueError: When the page has no grades table.
     """
+    from bs4 import BeautifulSoup
+
     soup = BeautifulSoup(html_content, "html.parser")
     tbody = soup.find("tbody")
+    if tbody is None:
+        raise ValueError(NO_TABLE_MESSAGE)
     return tbody.find_all("tr")
 
 
@@ -24,72 +39,142 @@ def parse_rows(rows):
     """Parse the rows of grades and organize them into a structured format.
 
     @param rows: A list of BeautifulSoup row elements containing grades data.
-    @return: A dictionary containing the structured grades data.
+    @return: The GradeSheet of the page.
+    """
+    return build_grades(_soup_row_fields(row) for row in rows)
+
+
+def _soup_row_fields(row):
+    """Read the class list and the four cell texts of a BeautifulSoup row.
+
+    @param row: A BeautifulSoup row element.
+    @return: A (classes, libelle, ponderation, coefficient, note) tuple, or None
+        if the row has no cells.
+    """
+    cells = row.find_all("td")
+    if not cells:
+        return None
+
+    return (
+        row.get("class", []),
+        cells[0].get_text(strip=True),
+        cells[1].get_text(strip=True),
+        cells[2].get_text(strip=True),
+        cells[3].get_text(strip=True),
+    )
+
+
+def iter_lxml_row_fields(html_content):
+    """Stream the rows of the first <tbody> of a page with lxml.
+
+    Rows are read from iterparse events and cleared as soon as they are
+    consumed, so no full document tree is kept in memory. Parsing stops at the
+    end of the first <tbody>.
+
+    @param html_content: The HTML content of the grades page, as str or bytes.
+    @return: An iterator of (classes, libelle, ponderation, coefficient, note)
+        tuples, like _soup_row_fields.
+    @raise ValueError: When the page has no grades table, like extract_rows.
     """
-    result = {"years": []}
-    current_year = None
-    current_semester = None
-    current_module = None
-    current_course = None
-
-    for row in rows:
-        cells = row.find_all("td")
-        if not cells:
+    from lxml import etree
+
+    if isinstance(html_content, str):
+        html_content = html_content.encode("utf-8")
+
+    events = etree.iterparse(
+        io.BytesIO(html_content),
+        events=("start", "end"),
+        html=True,
+        encoding="utf-8",
+    )
+    in_tbody = False
+
+    for event, element in events:
+        tag = element.tag
+
+        if tag == "tbody":
+            if event == "start":
+                in_tbody = True
+                continue
+            return
+
+        if not in_tbody or event != "end" or tag != "tr":
             continue
 
-        libelle = cells[0].get_text(strip=True)
-        ponderation = cells[1].get_text(strip=True)
-        coefficient = cells[2].get_text(strip=True)
-        note = cells[3].get_text(strip=True)
+        texts = [
+            "".join(part.strip() for part in cell.itertext())
+            for cell in element.iter("td")
+        ]
+        classes = element.get("class", "").split()
 
-        classes = row.get("class", [])
+        # Drop the consumed row and its already-parsed siblings
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+        if not texts:
+            continue
+        yield (classes, *texts[:4])
+
+    if not in_tbody:
+        raise ValueError(NO_TABLE_MESSAGE)
+
+
+def build_grades(row_fields):
+    """Organize row fields into a GradeSheet.
+
+    @param row_fields: An iterable of (classes, libelle, ponderation,
+        coefficient, note) tuples, None entries being skipped.
+    @return: The GradeSheet of the page.
+    """
+    builder = GradeSheetBuilder()
+    rows = 0
+
+    for fields in row_fields:
+        if fields is None:
+            continue
+
+        rows += 1
+
+        classes, libelle, ponderation, coefficient, note = fields
 
         if "master" in classes and "slave" not in classes:
-            current_year = {"year_name": libelle, "semesters": []}
-            result["years"].append(current_year)
+            builder.year(libelle)
             # logging.info(f"Processing year: {libelle}")
 
         elif "slave" in classes and re.search(
             r"semestre\s*\d+", libelle, re.IGNORECASE
         ):
             semester_name = libelle.split("/")[0].strip().lower()
-            current_semester = {"semester_name": semester_name, "semester_modules": []}
-            current_year["semesters"].append(current_semester)
+            builder.semester(semester_name)
             # logging.info(f"Processing semester: {semester_name}")
 
         elif not ponderation and not coefficient and not note:
-            current_module = {"module_name": libelle, "module_courses": []}
-            current_semester["semester_modules"].append(current_module)
+            builder.module(libelle)
             # logging.info(f"Processing module: {libelle}")
 
         elif ponderation and not coefficient and not note:
             try:
                 float_ponderation = float(ponderation.replace(",", "."))
-                current_course = {
-                    "course_name": libelle,
-                    "course_ponderation": float_ponderation,
-                    "course_grades_type": [],
-                }
-                current_module["module_courses"].append(current_course)
-                # logging.info(f"Processing course: {libelle}")
             except ValueError:
                 # logger.warning(f"Ignoring invalid ponderation: {ponderation}")
                 continue
+            builder.course(libelle, float_ponderation)
+            # logging.info(f"Processing course: {libelle}")
 
         elif coefficient and note:
             grade_entries = extract_grades(note)
             float_coef = extract_float(coefficient)
             if float_coef is None:
                 continue
-            current_course["course_grades_type"].append(
-                {
-                    "grade_type": libelle,
-                    "coefficient": float_coef,
-                    "grades": grade_entries,
-                }
+            builder.grade_type(
+                libelle,
+                float_coef,
+                ((entry["grade"], entry["coef"]) for entry in grade_entries),
             )
 
-    return result
+    parsed_rows_total.inc(rows)
+    return builder.build()
 
 
 def extract_grades(note):
@@ -132,3 +217,40 @@ def extract_float(text):
     except ValueError:
         logger.warning(f"Invalid float string: {text}")
         return None
+
+
+def get_parser_backend(backend=None):
+    """Resolve the parser backend to use.
+
+    @param backend: The requested backend, defaults to the GRADES_PARSER
+        environment variable, then to the BeautifulSoup html.parser backend.
+    @return: One of PARSERS. Falls back to html.parser when lxml is missing.
+    """
+    backend = backend or get_env_variable("GRADES_PARSER") or PARSER_BS4
+    if backend not in PARSERS:
+        raise ValueError(f"Unknown grades parser {backend!r}, expected one of {PARSERS}")
+
+    if backend == PARSER_LXML:
+        try:
+            import lxml  # noqa: F401
+        except ImportError:
+            logger.warning("lxml is not installed, falling back to html.parser")
+            return PARSER_BS4
+
+    return backend
+
+
+def parse_html(html_content, backend=None):
+    """Parse the grades page with the selected parser backend.
+
+    @param html_content: The HTML content of the grades page.
+    @param backend: The parser backend, see get_parser_backend.
+    @return: The GradeSheet of the page, see GradeSheet.to_years for the
+        nested JSON structure.
+    """
+    backend = get_parser_backend(backend)
+    with parse_seconds.time(backend=backend):
+        if backend == PARSER_LXML:
+            return build_grades(iter_lxml_row_fields(html_content))
+
+        return parse_rows(extract_rows(html_content))
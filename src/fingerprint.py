@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import os
+import re
+import hashlib
+import logging
+import threading
+from utils import load_file, save_file
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+TBODY_PATTERN = re.compile(r"<tbody\b.*?</tbody>", re.IGNORECASE | re.DOTALL)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+checks_total = counter("fingerprint_checks_total", "Grades table fingerprint checks")
+
+
+def fingerprint(html: str) -> str:
+    """
+    Compute a digest of the grades table of a page.
+
+    Only the `<tbody>` slice is hashed, with whitespace collapsed, so session
+    tokens or formatting changes elsewhere in the page do not count as a
+    change. The whole page is hashed when no `<tbody>` is found.
+
+    @param html: The HTML content of the grades page.
+    @return: The hex SHA-256 digest of the normalized table.
+    """
+    match = TBODY_PATTERN.search(html)
+    content = match.group(0) if match else html
+    normalized = WHITESPACE_PATTERN.sub(" ", content).strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class StageCounters:
+    """Thread-safe hit/miss counters shared by every fingerprint stage."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        checks_total.inc(result="hit" if hit else "miss")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+counters = StageCounters()
+
+
+class FingerprintStage:
+    """
+    Short-circuit the pipeline when the grades table did not change.
+
+    The digest of the last processed page is persisted next to the account's
+    grades files, so the check survives restarts.
+    """
+
+    def __init__(self, path: str, stats: StageCounters = counters):
+        self.path = path
+        self.stats = stats
+        self._digest = None
+        self._loaded = False
+
+    @property
+    def digest(self) -> str | None:
+        if not self._loaded:
+            content = load_file(self.path) if os.path.exists(self.path) else None
+            self._digest = content.strip() if content else None
+            self._loaded = True
+        return self._digest
+
+    def check(self, html: str) -> tuple[bool, str]:
+        """
+        Check whether the page matches the last processed one.
+
+        @param html: The HTML content of the grades page.
+        @return: A (unchanged, digest) tuple. Pass the digest to commit() once
+            the page has been processed.
+        """
+        digest = fingerprint(html)
+        unchanged = digest == self.digest
+        self.stats.record(unchanged)
+        return unchanged, digest
+
+    def commit(self, digest: str) -> None:
+        """
+        Persist the digest of a fully processed page.
+
+        @param digest: The digest returned by check().
+        """
+        if digest == self.digest:
+            return
+        save_file(digest, self.path)
+        self._digest = digest
+
@@ -1,48 +1,87 @@
-from typing import List, Dict, Set
+from __future__ import annotations
+
+from typing import List, Dict, Optional, Tuple
 from utils import load_json
+from grade_model import GradeSheet
+from tree_diff import (
+    ADDED,
+    CHANGED,
+    GradeEvent,
+    GradeSlot,
+    diff_sheets,
+    diff_slots,
+    grade_slots,
+)
 
 
-def find_new_grades(old_file: str, new_file: str) -> List[str]:
-    """Compare deux fichiers JSON et retourne les nouvelles notes."""
+def find_new_grades(old_file: str, new_file: str) -> List[Dict]:
+    """Compare deux fichiers JSON et retourne les changements de notes."""
     old_data = load_json(old_file)
     new_data = load_json(new_file)
 
     return compare_grades(old_data, new_data)
 
 
-def compare_grades(old_data: List[Dict], new_data: List[Dict]) -> List[str]:
-    """Compare deux structures de données et retourne les nouvelles notes."""
-    old_grades = _extract_grades(old_data)
-    new_grades = _extract_grades(new_data)
+def compare_grades(old_data: List[Dict], new_data: List[Dict]) -> List[Dict]:
+    """Compare deux structures de données et retourne les notes ajoutées, modifiées ou supprimées."""
+    return format_grades(diff_sheets(old_data, new_data))
+
+
+def format_grades(
+    events: List[GradeEvent], averages: Optional[Dict[Tuple, float]] = None
+) -> List[Dict]:
+    """Transforme des événements de notes en messages de notification, avec la moyenne du cours si connue."""
+    messages = []
+    for kind, slot, old, new in events:
+        message = {"title": f"{slot.course.split('/')[0].strip()} - {slot.grade_type}"}
+        if kind == ADDED:
+            message["details"] = f"{new[0]} - {new[1]}%"
+        elif kind == CHANGED:
+            message["details"] = f"{new[0]} - {new[1]}% (was {old[0]})"
+            message["change"] = kind
+        else:
+            message["details"] = f"{old[0]} - {old[1]}% removed"
+            message["change"] = kind
+        # Moyennes indexées par (année, semestre, module, cours)
+        average = averages.get(slot[:4]) if averages else None
+        if average is not None:
+            message["average"] = round(average, 2)
+        messages.append(message)
+    return messages
+
+
+class GradeIndex:
+    """Index en mémoire des notes déjà connues, conservé entre les cycles.
+
+    Les notes sont indexées par leur emplacement dans l'arbre (année,
+    semestre, module, cours, type, rang). Seules les nouvelles données sont
+    parcourues à chaque cycle : l'ancien fichier n'est relu qu'au démarrage.
+    """
 
-    return [
-        {
-            "title": f"{course.split("/")[0].strip()} - {grade_type}",
-            "details": f"{value} - {coef}%",
-        }
-        for course, grade_type, value, coef in new_grades - old_grades
-    ]
+    def __init__(self, slots: Dict[Tuple, Tuple[str, str]] = None):
+        self._slots = dict(slots or {})
 
+    @classmethod
+    def from_snapshot(cls, path: str) -> "GradeIndex":
+        """Reconstruit l'index à partir du fichier JSON des anciennes notes."""
+        return cls(grade_slots(load_json(path) or []))
 
-def _extract_grades(data: List[Dict]) -> Set[tuple]:
-    """Extrait toutes les notes sous forme de tuples uniques."""
-    grades = set()
+    def __len__(self) -> int:
+        return len(self._slots)
 
-    for year in data:
-        for semester in year.get("semesters", []):
-            for module in semester.get("semester_modules", []):
-                for course in module.get("module_courses", []):
-                    course_name = course.get("course_name", "")
-                    for grade_type in course.get("course_grades_type", []):
-                        type_name = grade_type.get("grade_type", "")
-                        for grade in grade_type.get("grades", []):
-                            value = grade.get("grade", "")
-                            coef = grade.get("coef", "")
+    def __contains__(self, slot: GradeSlot) -> bool:
+        return slot in self._slots
 
-                            if value and value != "Validé":
-                                grades.add((course_name, type_name, value, coef))
+    def diff(
+        self, data: GradeSheet | List[Dict]
+    ) -> Tuple[List[GradeEvent], Dict[Tuple, Tuple[str, str]]]:
+        """Retourne les notes ajoutées, modifiées ou supprimées et les notes courantes."""
+        current = grade_slots(data)
+        return diff_slots(self._slots, current), current
 
-    return grades
+    def commit(self, current: Dict[Tuple, Tuple[str, str]]) -> None:
+        """Remplace le contenu de l'index par les notes courantes."""
+        self._slots = current
 
 
 if __name__ == "__main__":
@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import sys
+import json
+from typing import Any, Iterable, Iterator, NamedTuple
+
+# Levels of the grades tree, from the root
+YEAR, SEMESTER, MODULE, COURSE, GRADE_TYPE, GRADE = range(6)
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class GradeRow(NamedTuple):
+    """
+    One leaf of the grades tree: a grade, or a node without children.
+
+    Rows are kept in page order. `opens` is the shallowest level at which the
+    row starts new nodes: the first grade of a new course opens at COURSE, the
+    next grades of the same grade type at GRADE. Levels below a childless
+    node are None.
+    """
+
+    opens: int
+    year: str
+    semester: str | None = None
+    module: str | None = None
+    course: str | None = None
+    course_ponderation: float | None = None
+    grade_type: str | None = None
+    type_coefficient: float | None = None
+    grade: str | None = None
+    coef: str | None = None
+
+    @property
+    def level(self) -> int:
+        """Level of the deepest node of the row."""
+        if self.grade is not None:
+            return GRADE
+        for level, name in (
+            (GRADE_TYPE, self.grade_type),
+            (COURSE, self.course),
+            (MODULE, self.module),
+            (SEMESTER, self.semester),
+        ):
+            if name is not None:
+                return level
+        return YEAR
+
+
+def _row(opens, path, grade=None, coef=None) -> GradeRow:
+    return GradeRow(opens, *path, *((None,) * (7 - len(path))), grade, coef)
+
+
+class GradeSheet:
+    """
+    The grades of one page as a flat tuple of interned rows.
+
+    This replaces the nested years -> semesters -> modules -> courses ->
+    grade types -> grades dictionaries: names shared by many grades are
+    stored once, and the differ, the history store and the API read the rows
+    directly. The nested JSON structure is only built by to_years(), to
+    write the snapshots.
+    """
+
+    __slots__ = ("rows",)
+
+    def __init__(self, rows: Iterable[GradeRow] = ()) -> None:
+        self.rows = tuple(rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[GradeRow]:
+        return iter(self.rows)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, GradeSheet):
+            return NotImplemented
+        return self.rows == other.rows
+
+    def __repr__(self) -> str:
+        return f"GradeSheet({len(self.rows)} rows)"
+
+    @classmethod
+    def from_years(cls, years: list[dict[str, Any]] | None) -> "GradeSheet":
+        """
+        Build a sheet from the nested JSON structure.
+
+        @param years: The grades data as a list of years, as in the snapshots.
+        @return: The equivalent GradeSheet.
+        """
+        rows = []
+        # Shallowest level opened since the last row was emitted
+        opens = GRADE
+
+        def emit(path, grade=None, coef=None):
+            nonlocal opens
+            rows.append(_row(opens, tuple(_intern(value) for value in path), _intern(grade), _intern(coef)))
+            opens = GRADE
+
+        for year in years or []:
+            opens = YEAR
+            year_path = (year.get("year_name", ""),)
+            semesters = year.get("semesters", [])
+            if not semesters:
+                emit(year_path)
+
+            for semester in semesters:
+                opens = min(opens, SEMESTER)
+                semester_path = year_path + (semester.get("semester_name", ""),)
+                modules = semester.get("semester_modules", [])
+                if not modules:
+                    emit(semester_path)
+
+                for module in modules:
+                    opens = min(opens, MODULE)
+                    module_path = semester_path + (module.get("module_name", ""),)
+                    courses = module.get("module_courses", [])
+                    if not courses:
+                        emit(module_path)
+
+                    for course in courses:
+                        opens = min(opens, COURSE)
+                        course_path = module_path + (
+                            course.get("course_name", ""),
+                            course.get("course_ponderation"),
+                        )
+                        grade_types = course.get("course_grades_type", [])
+                        if not grade_types:
+                            emit(course_path)
+
+                        for grade_type in grade_types:
+                            opens = min(opens, GRADE_TYPE)
+                            type_path = course_path + (
+                                grade_type.get("grade_type", ""),
+                                grade_type.get("coefficient"),
+                            )
+                            grades = grade_type.get("grades", [])
+                            if not grades:
+                                emit(type_path)
+
+                            for grade in grades:
+                                emit(type_path, grade.get("grade", ""), grade.get("coef", ""))
+
+        return cls(rows)
+
+    def to_years(self) -> list[dict[str, Any]]:
+        """
+        Serialize the sheet to the nested JSON structure of the snapshots.
+
+        @return: The grades data as a list of years.
+        """
+        years: list[dict[str, Any]] = []
+        # Last node opened at each level, grades are appended to the last one
+        current: list[dict[str, Any] | None] = [None] * GRADE
+
+        for row in self.rows:
+            deepest = row.level
+            for level in range(row.opens, min(deepest, GRADE_TYPE) + 1):
+                if level == YEAR:
+                    node = {"year_name": row.year, "semesters": []}
+                    years.append(node)
+                elif level == SEMESTER:
+                    node = {"semester_name": row.semester, "semester_modules": []}
+                    current[YEAR]["semesters"].append(node)
+                elif level == MODULE:
+                    node = {"module_name": row.module, "module_courses": []}
+                    current[SEMESTER]["semester_modules"].append(node)
+                elif level == COURSE:
+                    node = {
+                        "course_name": row.course,
+                        "course_ponderation": row.course_ponderation,
+                        "course_grades_type": [],
+                    }
+                    current[MODULE]["module_courses"].append(node)
+                else:
+                    node = {
+                        "grade_type": row.grade_type,
+                        "coefficient": row.type_coefficient,
+                        "grades": [],
+                    }
+                    current[COURSE]["course_grades_type"].append(node)
+                current[level] = node
+
+            if deepest == GRADE:
+                current[GRADE_TYPE]["grades"].append({"grade": row.grade, "coef": row.coef})
+
+        return years
+
+    def dumps(self) -> bytes:
+        """Serialize the rows compactly, e.g. to send them across processes."""
+        return json.dumps(self.rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    @classmethod
+    def loads(cls, data: bytes) -> "GradeSheet":
+        """Rebuild a sheet serialized with dumps()."""
+        return cls(GradeRow(*(_intern(value) for value in row)) for row in json.loads(data))
+
+    def grades(self) -> Iterator[GradeRow]:
+        """Iterate over the rows holding a grade."""
+        return (row for row in self.rows if row.grade is not None)
+
+
+def as_sheet(data: GradeSheet | list[dict[str, Any]] | None) -> GradeSheet:
+    """Accept either a GradeSheet or the nested JSON structure."""
+    if isinstance(data, GradeSheet):
+        return data
+    return GradeSheet.from_years(data)
+
+
+class GradeSheetBuilder:
+    """
+    Build a GradeSheet node by node while reading the page top to bottom.
+
+    Each node belongs to the last node opened one level above it, like the
+    rows of the grades table.
+    """
+
+    def __init__(self) -> None:
+        self.rows: list[GradeRow] = []
+        # Path from the root of the last node opened at each level
+        self._paths: list[tuple | None] = [None] * GRADE
+        # Level of the last row when it is a node without children yet
+        self._childless: int | None = None
+
+    def _open(self, level: int, *values) -> tuple:
+        if level == YEAR:
+            parent = ()
+        else:
+            parent = self._paths[level - 1]
+            if parent is None:
+                raise ValueError(f"Grades row found outside of any parent (level {level})")
+
+        path = parent + tuple(_intern(value) for value in values)
+        self._paths[level] = path
+
+        opens = level
+        if self._childless == level - 1:
+            # The parent is the last row: it gets a child and stops being a leaf
+            opens = self.rows.pop().opens
+
+        self._childless = level
+        self.rows.append(_row(opens, path))
+        return path
+
+    def year(self, name: str) -> None:
+        self._open(YEAR, name)
+
+    def semester(self, name: str) -> None:
+        self._open(SEMESTER, name)
+
+    def module(self, name: str) -> None:
+        self._open(MODULE, name)
+
+    def course(self, name: str, ponderation: float) -> None:
+        self._open(COURSE, name, ponderation)
+
+    def grade_type(self, name: str, coefficient: float, grades: Iterable[tuple[str, str]]) -> None:
+        """
+        Add a grade type and its (value, coef) grades.
+
+        @param name: The grade type label.
+        @param coefficient: The weight of the grade type in its course.
+        @param grades: The (value, coef) pairs of the grade type.
+        """
+        path = self._open(GRADE_TYPE, name, coefficient)
+        grades = list(grades)
+        if not grades:
+            return
+
+        opens = self.rows.pop().opens
+        for value, coef in grades:
+            self.rows.append(_row(opens, path, _intern(value), _intern(coef)))
+            opens = GRADE
+        self._childless = None
+
+    def build(self) -> GradeSheet:
+        return GradeSheet(self.rows)
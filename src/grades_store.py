@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import logging
+import argparse
+import threading
+from datetime import datetime, timezone
+from utils import load_json
+from tree_diff import iter_slots
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = "src/data/grades.db"
+
+# `slot` is the rank of the grade in its grade type (see tree_diff.GradeSlot):
+# two equal marks of one grade type are two rows, and a corrected grade
+# keeps its first value as a row of its own
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS grades (
+    id INTEGER PRIMARY KEY,
+    account TEXT NOT NULL,
+    year TEXT NOT NULL,
+    semester TEXT NOT NULL,
+    module TEXT NOT NULL,
+    course TEXT NOT NULL,
+    grade_type TEXT NOT NULL,
+    slot INTEGER NOT NULL,
+    type_coefficient REAL,
+    value TEXT NOT NULL,
+    coef TEXT NOT NULL,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    UNIQUE (account, year, semester, module, course, grade_type, slot, value, coef)
+);
+CREATE INDEX IF NOT EXISTS idx_grades_account ON grades (account);
+CREATE INDEX IF NOT EXISTS idx_grades_year_semester_module
+    ON grades (year, semester, module);
+"""
+
+UPSERT = """
+INSERT INTO grades (
+    account, year, semester, module, course, grade_type, slot, type_coefficient,
+    value, coef, first_seen, last_seen
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (account, year, semester, module, course, grade_type, slot, value, coef)
+DO UPDATE SET
+    last_seen = max(last_seen, excluded.last_seen),
+    first_seen = min(first_seen, excluded.first_seen),
+    type_coefficient = excluded.type_coefficient
+"""
+
+# Grades still on the page are the ones seen by the last recorded cycle
+TOUCH = """
+UPDATE grades SET last_seen = :seen_at
+WHERE account = :account
+    AND last_seen = (SELECT max(last_seen) FROM grades WHERE account = :account)
+    AND last_seen < :seen_at
+"""
+
+COLUMNS = (
+    "account",
+    "year",
+    "semester",
+    "module",
+    "course",
+    "grade_type",
+    "slot",
+    "type_coefficient",
+    "value",
+    "coef",
+    "first_seen",
+    "last_seen",
+)
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def iter_observations(years):
+    """
+    Yield one tuple per grade of a GradeSheet or of the nested years structure.
+
+    @param years: The parsed grades, as a GradeSheet or a list of years.
+    @return: An iterator of (year, semester, module, course, grade_type, slot,
+        type_coefficient, value, coef) tuples.
+    """
+    for slot, row in iter_slots(years):
+        if not row.grade:
+            continue
+        yield (
+            *slot,
+            row.type_coefficient,
+            row.grade,
+            row.coef,
+        )
+
+
+class GradesStore:
+    """
+    SQLite history of grade observations, one row per grade and account.
+
+    A grade is identified by its slot and value: first_seen is when it
+    appeared, last_seen the last poll that still found it, changed page or
+    not (see touch()). The database runs in WAL mode so the scraper can write while the web API
+    reads. Each polling cycle is written in a single transaction.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def record_cycle(self, account, years, seen_at=None):
+        """
+        Record every grade of a polling cycle in one transaction.
+
+        New grades get first_seen = last_seen = seen_at, known grades only get
+        their last_seen bumped.
+
+        @param account: The account name.
+        @param years: The parsed grades, as a GradeSheet or a list of years.
+        @param seen_at: ISO timestamp of the observation, defaults to now.
+        @return: The number of observations written.
+        """
+        seen_at = seen_at or _now()
+        rows = [
+            (account, *observation, seen_at, seen_at)
+            for observation in iter_observations(years)
+        ]
+        if not rows:
+            return 0
+
+        with self._lock, self._conn:
+            self._conn.executemany(UPSERT, rows)
+
+        return len(rows)
+
+    def touch(self, account, seen_at=None):
+        """
+        Record a polling cycle whose page did not change.
+
+        Bumps the last_seen of the grades seen by the last recorded cycle,
+        which are the grades still on the page.
+
+        @param account: The account name.
+        @param seen_at: ISO timestamp of the observation, defaults to now.
+        @return: The number of grades updated.
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                TOUCH, {"account": account, "seen_at": seen_at or _now()}
+            )
+        return cursor.rowcount
+
+    def count(self, account=None):
+        """
+        Count the stored grades.
+
+        @param account: Only count the grades of this account if given.
+        @return: The number of rows.
+        """
+        query = "SELECT COUNT(*) FROM grades"
+        params = ()
+        if account is not None:
+            query += " WHERE account = ?"
+            params = (account,)
+
+        with self._lock:
+            return self._conn.execute(query, params).fetchone()[0]
+
+    def history(self, account=None, year=None, semester=None, module=None):
+        """
+        Query the stored grades, oldest first.
+
+        @param account: Filter on the account name.
+        @param year: Filter on the year name.
+        @param semester: Filter on the semester name.
+        @param module: Filter on the module name.
+        @return: A list of dictionaries, one per grade.
+        """
+        filters = {
+            "account": account,
+            "year": year,
+            "semester": semester,
+            "module": module,
+        }
+        clauses = [f"{column} = ?" for column, value in filters.items() if value is not None]
+        params = [value for value in filters.values() if value is not None]
+
+        query = f"SELECT {', '.join(COLUMNS)} FROM grades"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY first_seen, id"
+
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(query, params)]
+
+    def migrate_from_json(self, account, path, seen_at=None):
+        """
+        Import an existing grades JSON file (old_grades.json / new_grades.json).
+
+        The file modification time is used as the observation time, as the
+        JSON files do not record when a grade appeared.
+
+        @param account: The account the file belongs to.
+        @param path: Path to the grades JSON file.
+        @param seen_at: ISO timestamp to use instead of the file mtime.
+        @return: The number of observations imported.
+        """
+        years = load_json(path)
+        if not isinstance(years, list):
+            logger.warning(f"Nothing to migrate from {path}")
+            return 0
+
+        if seen_at is None:
+            seen_at = datetime.fromtimestamp(
+                os.path.getmtime(path), tz=timezone.utc
+            ).isoformat(timespec="seconds")
+
+        imported = self.record_cycle(account, years, seen_at=seen_at)
+        logger.info(f"Migrated {imported} grades of {account} from {path}")
+        return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grades history store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate = subparsers.add_parser("migrate", help="Import grades JSON files")
+    migrate.add_argument("files", nargs="+", help="Grades JSON files to import")
+    migrate.add_argument("--account", default="default")
+    migrate.add_argument("--db", default=DEFAULT_DB_PATH)
+
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        store = GradesStore(args.db)
+        try:
+            for path in args.files:
+                store.migrate_from_json(args.account, path)
+        finally:
+            store.close()
+
+
+if __name__ == "__main__":
+    from setup_logging import setup_logging
+
+    setup_logging()
+    main()
@@ -1,27 +1,110 @@
 import os
-import time
+import asyncio
 import logging
-from scraper import get_response
+from scraper import fetch_page, page_cache, close_sessions, breakers
 from send_ntfy_msg import send_ntfy_msg
-from utils import load_env_variables, get_env_variable, save_json, load_json
-from extract_grades import extract_rows, parse_rows
+from utils import load_env_variables, get_env_variable, save_json, fsync_batch
+from extract_grades import parse_html
+from parse_pool import ParsePool, default_workers
+from archive import CaptureArchive
 from setup_logging import setup_logging
-from get_new_grades import find_new_grades
+from get_new_grades import GradeIndex, format_grades
+from tree_diff import ADDED, SuspectPageError, check_removals
+from averages import AveragesEngine
+from grade_model import GradeSheet, as_sheet
+from accounts import load_accounts
+from poller import Poller
+from poll_scheduler import AdaptiveScheduler
+from grades_store import GradesStore, DEFAULT_DB_PATH
+from publish_event import publish_event, new_grades_event
+from notifier import Outbox, Dispatcher, DEFAULT_OUTBOX_PATH
+from fingerprint import FingerprintStage, counters as fingerprint_counters
+from metrics import counter, histogram, flush_periodically, get_metrics_dir
+from sharding import ShardMember, WorkQueue
 
-MODE = "DEBUG"  # Set to "DEBUG" for testing, "PROD" for production
-# Set the check interval based on the mode
-if MODE == "PROD":
-    CHECK_INTERVAL = 10 * 60  # 10 minutes for production (default)
+# Hours when grades are usually published, polled often until the scheduler
+# has learned the actual publication times of an account
+DEFAULT_WINDOW = (1, 3)
 
-if MODE == "DEBUG":
-    CHECK_INTERVAL = 60  # seconds for debugging
-
-setup_logging()
 logger = logging.getLogger(__name__)
 
+# Fingerprint stage and grade index of each account, kept across polling cycles
+_fingerprints = {}
+_grade_indexes = {}
+_averages = {}
+
+# Grades history store and notification outbox, opened by main()
+_store = None
+_outbox = None
+
+# Parse worker pool, opened by main()
+_parse_pool = None
+
+# Archive of the fetched pages, when ARCHIVE_DIR is set
+_archive = None
+
+compare_seconds = histogram("grades_compare_seconds", "Time spent diffing the grades")
+new_grades_total = counter("grades_new_total", "New grades found")
+suspect_pages_total = counter("grades_suspect_pages_total", "Pages ignored for removing most known grades")
+
+
+def get_grade_index(old_grades_path):
+    """
+    Get the in-memory index of the known grades, loading it on first use.
+
+    @param old_grades_path: Path to the old grades JSON file.
+    @return: The GradeIndex rehydrated from the snapshot.
+    """
+    index = _grade_indexes.get(old_grades_path)
+    if index is None:
+        index = GradeIndex.from_snapshot(old_grades_path)
+        _grade_indexes[old_grades_path] = index
+        logger.info(f"Loaded {len(index)} known grades from {old_grades_path}")
+    return index
+
+
+def forget_account(account):
+    """
+    Drop the in-memory state of an account, reloaded on its next cycle.
+
+    Called when this worker gains an account polled by another worker until
+    now: the grade index, averages, fingerprint and page validators kept
+    from the last time it owned the account are stale.
+
+    @param account: The account gained by this worker.
+    """
+    _grade_indexes.pop(account.old_grades_path, None)
+    _averages.pop(account.old_grades_path, None)
+    _fingerprints.pop(account.name, None)
+    page_cache.forget(account.grades_url)
+
+
+def get_course_averages(old_grades_path, data):
+    """
+    Get the course averages of the current grades.
+
+    The engine of each account is kept across cycles, so only the new grades
+    are added to the averages.
+
+    @param old_grades_path: Path to the old grades JSON file, keying the account.
+    @param data: The extracted grades (GradeSheet or list of years).
+    @return: The {(year, semester, module, course): average} of the graded courses.
+    """
+    engine = _averages.get(old_grades_path)
+    if engine is None:
+        engine = _averages[old_grades_path] = AveragesEngine(data)
+    else:
+        engine.sync(as_sheet(data))
+    return engine.course_averages()
+
 
 def compare_and_upgrade_grades(
-    old_grades_path, current_grades_path, data, redirect_url, topic_name
+    old_grades_path,
+    current_grades_path,
+    data,
+    redirect_url,
+    topic_name,
+    account_name="default",
 ):
     """
     Compare the old and new grades, update the old grades file if there are differences,
@@ -29,103 +112,273 @@ def compare_and_upgrade_grades(
 
     @param old_grades_path: Path to the old grades JSON file.
     @param current_grades_path: Path to the current grades JSON file.
-    @param data: The extracted grades data to save if differences are found.
+    @param data: The extracted grades (GradeSheet or list of years), saved if
+        differences are found.
+    @param redirect_url: URL opened when the notification is clicked.
+    @param topic_name: The ntfy topic to notify.
+    @param account_name: The account the grades belong to, for live events.
+    @return: The messages of the added, changed and removed grades.
+    @raise SuspectPageError: When the page removes most of the known grades,
+        nothing is saved nor notified.
     """
-    # Get the differences between the old and new notes
-    new_grades = find_new_grades(old_grades_path, current_grades_path)
-    logger.info(f"New grades found: {new_grades}")
+    # Get the differences between the known and new notes
+    index = get_grade_index(old_grades_path)
+    with compare_seconds.time():
+        events, current = index.diff(data)
+    try:
+        check_removals(len(index), events)
+    except SuspectPageError as error:
+        suspect_pages_total.inc(account=account_name)
+        logger.warning(f"[{account_name}] Suspect grades page ignored: {error}")
+        raise
+    new_grades = format_grades(
+        events, get_course_averages(old_grades_path, data) if events else None
+    )
+    new_grades_total.inc(
+        sum(event.kind == ADDED for event in events), account=account_name
+    )
+    logger.info(f"Grade changes found: {new_grades}")
 
     # Print the differences
     if new_grades:
+        # Queue the notifications before the snapshot is updated, so a failed
+        # send is retried instead of lost
+        if _outbox is not None:
+            _outbox.enqueue(topic_name, new_grades, redirect_url)
+
         # Update the old notes file with the new notes
+        if isinstance(data, GradeSheet):
+            data = data.to_years()
         save_json(data, old_grades_path)
+        index.commit(current)
         logger.info("Differences found and old notes updated.")
         # notes_json = load_json(current_grades_path)
 
-        # Send a notification with the differences
-        for new_grade in new_grades:
-            # logger.info(f"Sending notification for {message}")
-            send_ntfy_msg(
-                topic=topic_name, message=new_grade, redirect_url=redirect_url
-            )
+        # Push the delta to the web UI
+        publish_event(new_grades_event(account_name, new_grades))
+
+        # Without the dispatcher, send a notification with the differences
+        if _outbox is None:
+            for new_grade in new_grades:
+                send_ntfy_msg(
+                    topic=topic_name, message=new_grade, redirect_url=redirect_url
+                )
     else:
         logger.info("No differences found.")
 
+    return new_grades
 
-def main():
 
-    # Load environment variables
-    load_env_variables()
+def prepare_account(account):
+    """
+    Make sure the data directory and grades files of an account exist.
+
+    @param account: The account to prepare.
+    """
+    os.makedirs(account.data_dir, exist_ok=True)
 
-    topic_name = get_env_variable("NTFY_TOPIC")
+    if not os.path.exists(account.new_grades_path):
+        logger.info(f"Creating new grades file at {account.new_grades_path}")
+        save_json([], account.new_grades_path)
 
-    if not topic_name:
-        raise ValueError("NTFY_TOPIC environment variable is not set.")
+    if not os.path.exists(account.old_grades_path):
+        logger.info(f"Creating old grades file at {account.old_grades_path}")
+        save_json([], account.old_grades_path)
 
-    grades_url = get_env_variable(f"GRADES_URL")
+    # Import the existing snapshot into an empty history store
+    if _store is not None and _store.count(account.name) == 0:
+        _store.migrate_from_json(account.name, account.old_grades_path)
 
-    if not grades_url:
-        raise ValueError("GRADES_URL environment variable is not set.")
 
-    new_grades_path = "src/data/new_grades.json"
+def check_account(account):
+    """
+    Run one fetch -> parse -> compare -> notify cycle for an account.
+
+    The files written during the cycle share a single batch of directory
+    fsyncs.
 
-    if not os.path.exists(new_grades_path):
-        logger.info(f"Creating new grades file at {new_grades_path}")
-        save_json([], new_grades_path)
+    @param account: The account to check.
+    @return: The number of new grades found.
+    """
+    with fsync_batch():
+        return _check_account(account)
 
-    old_grades_path = "src/data/old_grades.json"
 
-    if not os.path.exists(old_grades_path):
-        logger.info(f"Creating old grades file at {old_grades_path}")
-        save_json([], old_grades_path)
+def _check_account(account):
+    logger.info(f"[{account.name}] Fetching grades data...")
 
-    logger.info("Starting the grades extraction process...")
+    page = fetch_page(account.grades_url)
+    if not page.changed:
+        logger.info(f"[{account.name}] Grades page unchanged, skipping.")
+        page_cache.store(page)
+        if _store is not None:
+            _store.touch(account.name)
+        return 0
+
+    if _archive is not None:
+        _archive.append(account.name, page.url, page.status_code, page.text)
+
+    stage = _fingerprints.setdefault(
+        account.name, FingerprintStage(account.fingerprint_path)
+    )
+    unchanged, digest = stage.check(page.text)
+    if unchanged:
+        logger.info(
+            f"[{account.name}] Grades table unchanged, skipping "
+            f"(fingerprint stage: {fingerprint_counters.snapshot()})."
+        )
+        page_cache.store(page)
+        if _store is not None:
+            _store.touch(account.name)
+        return 0
+
+    if _parse_pool is not None:
+        sheet = _parse_pool.parse(page.text)
+    else:
+        sheet = parse_html(page.text)
+
+    # Diffed first: a suspect page fails the cycle before anything is saved,
+    # and is fetched again on the next one
+    new_grades = compare_and_upgrade_grades(
+        account.old_grades_path,
+        account.new_grades_path,
+        sheet,
+        account.redirect_url,
+        account.topic,
+        account_name=account.name,
+    )
+
+    save_json(sheet.to_years(), account.new_grades_path)
+    if _store is not None:
+        _store.record_cycle(account.name, sheet)
+    logger.info(f"[{account.name}] Grades extraction completed and saved.")
+    stage.commit(digest)
+    page_cache.store(page)
+    return len(new_grades)
+
+
+def adopt_orphaned_outboxes(outbox, shard):
+    """
+    Take over the notifications queued by workers that left for good.
+
+    Each orphaned outbox file is claimed with an atomic rename, so a single
+    live worker adopts it. Files claimed by this worker before a crash are
+    adopted on the next start.
+
+    @param outbox: The Outbox of this worker.
+    @param shard: The ShardMember of this worker.
+    @return: The number of notifications adopted.
+    """
+    directory = os.path.dirname(outbox.path) or "."
+    claim_suffix = f".adopted-by-{shard.worker_id}"
+    live = set(shard.queue.workers(shard.worker_ttl))
+    adopted = 0
 
-    while True:
-
-        # Check the current hour
-        now = time.localtime()
-        current_hour = now.tm_hour
-        logger.info(f"Current hour: {current_hour}")
-
-        start_period = 1
-        end_period = 3
-
-        # If the current hour is between 3 and 5, proceed with the extraction
-        if (start_period <= current_hour < end_period) or MODE == "DEBUG":
-            CHECK_INTERVAL = 10 * 60
-            logger.info("hour between 3 n 5 or debug_mode - Fetching grades data...")
-            # Sleep for 5 minutes to avoid multiple requests in the same hour
-
-            # Fetch the grades data
-            html = get_response(grades_url).text
-            rows = extract_rows(html)
-            result = parse_rows(rows)
-
-            save_json(result["years"], new_grades_path)
-            logger.info("Grades extraction completed and saved to new_grades.json.")
-
-            # _ = get_diffs(old_grades_path, new_grades_path)
-
-            compare_and_upgrade_grades(
-                old_grades_path,
-                new_grades_path,
-                result["years"],
-                grades_url,
-                topic_name,
-            )
-            logger.info(
-                f"Waiting for {CHECK_INTERVAL} seconds before the next check...\n"
-            )
-            time.sleep(CHECK_INTERVAL)
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(claim_suffix):
+            claimed = os.path.join(directory, name)
+        elif name.startswith("outbox-") and name.endswith(".json"):
+            if name[len("outbox-"):-len(".json")] in live:
+                continue
+            claimed = os.path.join(directory, name + claim_suffix)
+            try:
+                os.rename(os.path.join(directory, name), claimed)
+            except FileNotFoundError:
+                # Adopted by another worker
+                continue
         else:
-            CHECK_INTERVAL = (
-                (24 - current_hour + start_period) * 60 * 60
-            )  # Adjust check interval for debug mode
-            logger.info(
-                f"Current hour is not between 3 and 5. Waiting for {CHECK_INTERVAL} seconds before the next check...\n"
-            )
-            time.sleep(CHECK_INTERVAL)
+            continue
+
+        count = outbox.adopt(claimed)
+        logger.info(f"Adopted {count} queued notifications from {name}")
+        adopted += count
+    return adopted
+
+
+async def run_scraper(poller, dispatcher, metrics_name="scraper"):
+    """Run the polling engine, the notification dispatcher and the metrics flusher."""
+    tasks = [
+        poller.run(),
+        dispatcher.run(),
+        flush_periodically(os.path.join(get_metrics_dir(), f"{metrics_name}.json")),
+    ]
+    if poller.shard is not None:
+        tasks.append(poller.shard.run())
+    await asyncio.gather(*tasks)
+
+
+def main():
+    global _store, _outbox, _parse_pool, _archive
+
+    # Process-wide setup, kept out of the imports so they stay side-effect free
+    setup_logging()
+    load_env_variables()
+
+    # Worker mode: the accounts are split with the workers sharing the queue
+    shard = None
+    metrics_name = "scraper"
+    outbox_path = DEFAULT_OUTBOX_PATH
+    shard_queue = get_env_variable("SHARD_QUEUE")
+    if shard_queue:
+        # The outbox and metrics files are named after the worker: a new id
+        # on every restart would strand the queued notifications
+        worker_id = get_env_variable("WORKER_ID")
+        if not worker_id:
+            raise ValueError("WORKER_ID must be set, and kept across restarts, when SHARD_QUEUE is set.")
+        shard = ShardMember(
+            WorkQueue(shard_queue),
+            worker_id=worker_id,
+            heartbeat_interval=float(get_env_variable("SHARD_HEARTBEAT") or 10),
+            on_gain=forget_account,
+        )
+        shard.beat()
+        metrics_name = f"scraper-{shard.worker_id}"
+        outbox_path = os.path.join(
+            os.path.dirname(DEFAULT_OUTBOX_PATH), f"outbox-{shard.worker_id}.json"
+        )
+        logger.info(f"Running as worker {shard.worker_id} of {shard_queue}")
+
+    _store = GradesStore(get_env_variable("GRADES_DB") or DEFAULT_DB_PATH)
+    archive_dir = get_env_variable("ARCHIVE_DIR")
+    if archive_dir:
+        _archive = CaptureArchive(archive_dir)
+    _outbox = Outbox(get_env_variable("NTFY_OUTBOX") or outbox_path)
+    if shard is not None:
+        adopt_orphaned_outboxes(_outbox, shard)
+    dispatcher = Dispatcher(
+        _outbox, max_concurrency=int(get_env_variable("NTFY_CONCURRENCY") or 4)
+    )
+
+    accounts = load_accounts(default_window=DEFAULT_WINDOW)
+
+    for account in accounts:
+        prepare_account(account)
+
+    # Single-account setups and single-core devices parse in-process
+    _parse_pool = ParsePool(
+        workers=int(
+            get_env_variable("PARSE_WORKERS") or default_workers(len(accounts))
+        )
+    )
+
+    poller = Poller(
+        accounts,
+        check_account,
+        scheduler_factory=AdaptiveScheduler.for_account,
+        max_concurrency=int(get_env_variable("MAX_CONCURRENCY") or 8),
+        shard=shard,
+        breakers=breakers,
+    )
+
+    logger.info("Starting the grades extraction process...")
+    try:
+        asyncio.run(run_scraper(poller, dispatcher, metrics_name))
+    finally:
+        close_sessions()
+        _parse_pool.close()
+        _store.close()
+        if shard is not None:
+            shard.queue.close()
 
 
 if __name__ == "__main__":
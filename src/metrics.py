@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import os
+import json
+import time
+import asyncio
+import logging
+import tempfile
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS_DIR = "src/data/metrics"
+DEFAULT_FLUSH_INTERVAL = 15.0
+# Snapshots not rewritten for this long come from stopped processes, such
+# as scraper workers that left for good
+STALE_SNAPSHOT_AGE = 10 * DEFAULT_FLUSH_INTERVAL
+
+# Latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels) -> str:
+    if not labels:
+        return ""
+    return ",".join(f'{name}="{value}"' for name, value in sorted(labels.items()))
+
+
+class Counter:
+    """A monotonically increasing count, per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = dict(self._values)
+        return {"type": self.kind, "help": self.help, "samples": samples}
+
+
+class Histogram:
+    """Observations counted in fixed buckets, with their sum, per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket..., count above the last bucket, sum]
+        self._values: dict[str, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[position] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the `with` block, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        counts = self._values.get(_label_key(labels))
+        return int(sum(counts[:-1])) if counts else 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = {key: list(counts) for key, counts in self._values.items()}
+        return {
+            "type": self.kind,
+            "help": self.help,
+            "buckets": list(self.buckets),
+            "samples": samples,
+        }
+
+
+class Registry:
+    """
+    The metrics of one process.
+
+    Updates only touch in-memory counters. The scraper and the web API run as
+    separate processes, so the scraper periodically writes a JSON snapshot of
+    its registry to a shared directory, and the API merges these snapshots
+    with its own metrics when /metrics is scraped.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, Counter | Histogram] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._get(Counter, name, help)
+
+    def histogram(self, name: str, help: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def write(self, path: str) -> None:
+        """
+        Atomically replace `path` with a snapshot of the registry.
+
+        Metrics are not worth an fsync: a snapshot lost in a crash is replaced
+        by the next one.
+        """
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        payload = {"pid": os.getpid(), "written_at": time.time(), "metrics": self.snapshot()}
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(payload, f, separators=(",", ":"))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str) -> Counter:
+    """Get or create a counter of the process registry."""
+    return REGISTRY.counter(name, help)
+
+
+def histogram(name: str, help: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+    """Get or create a histogram of the process registry."""
+    return REGISTRY.histogram(name, help, buckets)
+
+
+def get_metrics_dir() -> str:
+    return os.getenv("METRICS_DIR") or DEFAULT_METRICS_DIR
+
+
+async def flush_periodically(path: str, interval: float = DEFAULT_FLUSH_INTERVAL, registry: Registry = REGISTRY) -> None:
+    """Write the registry snapshot to `path` every `interval` seconds, until cancelled."""
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await loop.run_in_executor(None, registry.write, path)
+            except OSError as e:
+                logger.warning(f"Failed to write metrics to {path}: {e}")
+    finally:
+        try:
+            registry.write(path)
+        except OSError:
+            pass
+
+
+def read_snapshots(directory: str, max_age: float | None = None, now: float | None = None) -> list[dict]:
+    """
+    Read the registry snapshots written by other processes.
+
+    @param directory: The shared metrics directory.
+    @param max_age: Seconds after which a snapshot is ignored as stale, None
+        to read them all.
+    @param now: The current UNIX time, defaults to now.
+    @return: The "metrics" part of every readable, fresh snapshot.
+    """
+    now = time.time() if now is None else now
+    snapshots = []
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return snapshots
+
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                payload = json.load(f)
+            if max_age is not None and now - payload.get("written_at", 0) > max_age:
+                continue
+            snapshots.append(payload["metrics"])
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.warning(f"Ignoring unreadable metrics snapshot {name}")
+    return snapshots
+
+
+def merge_snapshots(snapshots) -> dict:
+    """Sum the samples of metrics reported by several processes."""
+    merged: dict[str, dict] = {}
+
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.get(name)
+            if target is None:
+                merged[name] = {**metric, "samples": {}}
+                target = merged[name]
+            elif target["type"] != metric["type"] or target.get("buckets") != metric.get("buckets"):
+                logger.warning(f"Conflicting definitions of metric {name}, keeping the first one")
+                continue
+
+            samples = target["samples"]
+            for key, value in metric["samples"].items():
+                if metric["type"] == Histogram.kind:
+                    current = samples.get(key)
+                    samples[key] = (
+                        list(value) if current is None else [a + b for a, b in zip(current, value)]
+                    )
+                else:
+                    samples[key] = samples.get(key, 0) + value
+
+    return merged
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _with_label(key: str, label: str) -> str:
+    return f"{{{key},{label}}}" if key else f"{{{label}}}"
+
+
+def render_prometheus(metrics: dict) -> str:
+    """
+    Render merged snapshots in the Prometheus text exposition format.
+
+    @param metrics: Metrics as returned by merge_snapshots.
+    @return: The text served on /metrics.
+    """
+    lines = []
+    for name in sorted(metrics):
+        metric = metrics[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+
+        for key in sorted(metric["samples"]):
+            value = metric["samples"][key]
+            labels = f"{{{key}}}" if key else ""
+
+            if metric["type"] != Histogram.kind:
+                lines.append(f"{name}{labels} {_format_value(value)}")
+                continue
+
+            cumulative = 0
+            bounds = [str(bound) for bound in metric["buckets"]] + ["+Inf"]
+            for bound, count in zip(bounds, value[:-1]):
+                cumulative += count
+                le = _with_label(key, f'le="{bound}"')
+                lines.append(f"{name}_bucket{le} {_format_value(cumulative)}")
+            lines.append(f"{name}_sum{labels} {_format_value(value[-1])}")
+            lines.append(f"{name}_count{labels} {_format_value(cumulative)}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,315 @@
+from __future__ import annotations
+
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+import threading
+from collections import Counter
+from utils import load_json, save_json
+from send_ntfy_msg import get_ntfy_url, notifications_total
+from metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTBOX_PATH = "src/data/outbox.json"
+DEFAULT_DEAD_LETTER_PATH = "src/data/outbox_dead.ndjson"
+
+request_seconds = histogram("ntfy_request_seconds", "Latency of the requests to ntfy")
+
+
+def build_notification(messages, topic, redirect_url):
+    """
+    Build the ntfy JSON payload for one or several grades of a topic.
+
+    Grades landing together are coalesced into a single notification.
+
+    @param messages: The grade messages ({"title", "details"}) to announce.
+    @param topic: The ntfy topic.
+    @param redirect_url: URL opened when the notification is clicked.
+    @return: The payload for ntfy's JSON publishing endpoint.
+    """
+    if len(messages) == 1:
+        title = messages[0]["title"]
+        body = messages[0]["details"].split("/")[0]
+        if messages[0].get("average") is not None:
+            body += f"\nNew average: {messages[0]['average']}"
+    else:
+        # Corrections and removals carry the kind of change
+        kinds = Counter(message.get("change", "new") for message in messages)
+        title = ", ".join(
+            f"{kinds[kind]} {kind}" for kind in ("new", "changed", "removed") if kinds[kind]
+        ) + " grades"
+        body = "\n".join(
+            f"{message['title']}: {message['details']}"
+            + (f" (average {message['average']})" if message.get("average") is not None else "")
+            for message in messages
+        )
+
+    payload = {
+        "topic": topic,
+        "title": title,
+        "message": body,
+        "tags": ["face_in_clouds"],
+        "priority": 5,
+    }
+    if redirect_url:
+        payload["click"] = redirect_url
+    return payload
+
+
+class Outbox:
+    """
+    Persistent queue of notifications waiting to be sent.
+
+    Every change is written to disk before returning, so notifications
+    survive a crash or a restart. Safe to use from the polling threads.
+    """
+
+    def __init__(self, path=DEFAULT_OUTBOX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._items = load_json(path) if os.path.exists(path) else []
+        if not isinstance(self._items, list):
+            logger.error(f"Invalid outbox {path}, starting with an empty queue")
+            self._items = []
+        self.on_enqueue = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def _save(self):
+        # Durable even inside a polling cycle's fsync batch: the queued
+        # notifications must hit the disk before old_grades.json does
+        save_json(self._items, self.path, compact=True, durable=True)
+
+    def enqueue(self, topic, messages, redirect_url):
+        """
+        Queue grade notifications for a topic.
+
+        @param topic: The ntfy topic.
+        @param messages: The grade messages ({"title", "details"}).
+        @param redirect_url: URL opened when the notification is clicked.
+        """
+        if not messages:
+            return
+
+        now = time.time()
+        with self._lock:
+            for message in messages:
+                self._items.append(
+                    {
+                        "id": uuid.uuid4().hex,
+                        "topic": topic,
+                        "redirect_url": redirect_url,
+                        "message": message,
+                        "attempts": 0,
+                        "created": now,
+                        "next_attempt": now,
+                    }
+                )
+            self._save()
+
+        if self.on_enqueue is not None:
+            self.on_enqueue()
+
+    def adopt(self, path):
+        """
+        Move the notifications of another outbox file into this one.
+
+        @param path: The outbox file of a worker gone for good, removed once
+            its notifications are saved here.
+        @return: The number of notifications adopted.
+        """
+        items = load_json(path) if os.path.exists(path) else []
+        if not isinstance(items, list):
+            logger.error(f"Invalid outbox {path}, nothing to adopt")
+            items = []
+
+        with self._lock:
+            known = {item["id"] for item in self._items}
+            items = [item for item in items if item.get("id") not in known]
+            self._items.extend(items)
+            self._save()
+        os.remove(path)
+
+        if items and self.on_enqueue is not None:
+            self.on_enqueue()
+        return len(items)
+
+    def due(self, now=None):
+        """Return the items ready to be sent, grouped by (topic, redirect_url)."""
+        now = time.time() if now is None else now
+        groups = {}
+        with self._lock:
+            for item in self._items:
+                if item["next_attempt"] <= now:
+                    key = (item["topic"], item["redirect_url"])
+                    groups.setdefault(key, []).append(dict(item))
+        return groups
+
+    def next_attempt(self):
+        with self._lock:
+            return min((item["next_attempt"] for item in self._items), default=None)
+
+    def remove(self, ids):
+        ids = set(ids)
+        with self._lock:
+            self._items = [item for item in self._items if item["id"] not in ids]
+            self._save()
+
+    def reschedule(self, ids, backoff):
+        """
+        Record a failed attempt for the given items.
+
+        @param ids: The ids of the items that failed.
+        @param backoff: Callable giving the retry delay in seconds from the
+            number of attempts.
+        @return: The updated items.
+        """
+        ids = set(ids)
+        now = time.time()
+        updated = []
+        with self._lock:
+            for item in self._items:
+                if item["id"] in ids:
+                    item["attempts"] += 1
+                    item["next_attempt"] = now + backoff(item["attempts"])
+                    updated.append(dict(item))
+            self._save()
+        return updated
+
+
+class Dispatcher:
+    """
+    Send queued notifications to ntfy from the asyncio loop.
+
+    Grades queued for the same topic are coalesced into one message. Requests
+    share a pooled async HTTP client, at most `max_concurrency` are in flight,
+    failures are retried with exponential backoff and given up items are
+    appended to a dead-letter file.
+    """
+
+    def __init__(
+        self,
+        outbox,
+        client=None,
+        max_concurrency=4,
+        max_attempts=6,
+        base_delay=5.0,
+        max_delay=15 * 60.0,
+        coalesce_delay=1.0,
+        dead_letter_path=DEFAULT_DEAD_LETTER_PATH,
+        ntfy_url=None,
+    ):
+        self.outbox = outbox
+        self.client = client
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.coalesce_delay = coalesce_delay
+        self.dead_letter_path = dead_letter_path
+        self.ntfy_url = ntfy_url or get_ntfy_url()
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self._wakeup = None
+        self.sent = 0
+        self.failed = 0
+
+    async def run(self):
+        """Send notifications as they are queued, until cancelled."""
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self.outbox.on_enqueue = lambda: loop.call_soon_threadsafe(self._wakeup.set)
+
+        owns_client = self.client is None
+        if owns_client:
+            self.client = httpx.AsyncClient(
+                timeout=10.0,
+                limits=httpx.Limits(max_connections=8, max_keepalive_connections=4),
+            )
+
+        try:
+            while True:
+                await self.flush()
+                await self._wait()
+        finally:
+            self.outbox.on_enqueue = None
+            if owns_client:
+                await self.client.aclose()
+
+    async def _wait(self):
+        next_attempt = self.outbox.next_attempt()
+        timeout = None
+        if next_attempt is not None:
+            timeout = max(next_attempt - time.time(), 0.05)
+
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return
+
+        self._wakeup.clear()
+        # Let grades of the same burst land before sending them together
+        await asyncio.sleep(self.coalesce_delay)
+
+    async def flush(self):
+        """Send every due notification group once."""
+        groups = self.outbox.due()
+        if groups:
+            await asyncio.gather(
+                *(self._send_group(topic, url, items) for (topic, url), items in groups.items())
+            )
+
+    async def _send_group(self, topic, redirect_url, items):
+        messages = [item["message"] for item in items]
+        payload = build_notification(messages, topic, redirect_url)
+        ids = [item["id"] for item in items]
+
+        async with self._semaphore:
+            try:
+                with request_seconds.time():
+                    response = await self.client.post(self.ntfy_url, json=payload)
+                response.raise_for_status()
+            except Exception as e:
+                self.failed += 1
+                notifications_total.inc(result="failed")
+                self._retry_later(ids, e)
+                return
+
+        self.sent += 1
+        notifications_total.inc(result="sent")
+        self.outbox.remove(ids)
+        logger.info(f"✅ Sent {len(messages)} grade(s) to topic {topic}")
+
+    def backoff(self, attempts):
+        """Exponential backoff with jitter, capped at max_delay."""
+        delay = min(self.base_delay * (2 ** (attempts - 1)), self.max_delay)
+        return delay * random.uniform(0.8, 1.2)
+
+    def _retry_later(self, ids, error):
+        updated = self.outbox.reschedule(ids, self.backoff)
+        given_up = [item for item in updated if item["attempts"] >= self.max_attempts]
+        if given_up:
+            self._dead_letter(given_up, error)
+
+        if len(given_up) < len(updated):
+            logger.warning(f"🛑 Failed to send ntfy message, will retry: {error}")
+
+    def _dead_letter(self, items, error):
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            for item in items:
+                f.write(json.dumps({**item, "error": str(error)}, ensure_ascii=False))
+                f.write("\n")
+        self.outbox.remove(item["id"] for item in items)
+        notifications_total.inc(len(items), result="dead_letter")
+        logger.error(
+            f"🛑 Giving up on {len(items)} notification(s) after "
+            f"{self.max_attempts} attempts, written to {self.dead_letter_path}"
+        )
+
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from grade_model import GradeSheet
+from extract_grades import get_parser_backend, parse_html, parse_seconds, parsed_rows_total
+from setup_logging import setup_logging
+from metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+pool_seconds = histogram(
+    "grades_parse_pool_seconds", "Round trip of a grades page through the parse pool"
+)
+
+
+def default_workers(accounts: int = 1) -> int:
+    """
+    Number of parse workers when PARSE_WORKERS is not set.
+
+    One core is left to the fetch side and the web API, and there is no point
+    in more workers than accounts parsed at the same time.
+
+    @param accounts: The number of accounts polled.
+    @return: The worker count, 1 or less meaning in-process parsing.
+    """
+    return min(accounts, (os.cpu_count() or 1) - 1)
+
+
+def parse_to_bytes(html: bytes, backend: str | None = None) -> tuple[bytes, str, float, float]:
+    """
+    Parse a page and return the compact serialized GradeSheet.
+
+    Runs in the worker processes: only bytes cross the process boundary, no
+    soup or tree objects are pickled. The registry of a worker is never
+    flushed, so the parse metrics are sent back with the sheet and recorded
+    by the parent, see record_parse().
+
+    @param html: The UTF-8 encoded HTML content of the grades page.
+    @param backend: The parser backend, see extract_grades.get_parser_backend.
+    @return: The GradeSheet serialized with GradeSheet.dumps(), the backend
+        used, the parse duration in seconds and the number of table rows read.
+    """
+    backend = get_parser_backend(backend)
+    # A worker runs one task at a time, so the delta only counts this page
+    rows_before = parsed_rows_total.value()
+    start = time.perf_counter()
+    data = parse_html(html.decode("utf-8"), backend).dumps()
+    return data, backend, time.perf_counter() - start, parsed_rows_total.value() - rows_before
+
+
+def record_parse(result: tuple[bytes, str, float, float]) -> GradeSheet:
+    """
+    Record the parse metrics of a worker result in this process.
+
+    @param result: The tuple returned by parse_to_bytes().
+    @return: The parsed GradeSheet.
+    """
+    data, backend, seconds, rows = result
+    parse_seconds.observe(seconds, backend=backend)
+    parsed_rows_total.inc(rows)
+    return GradeSheet.loads(data)
+
+
+class ParsePool:
+    """
+    Parse grades pages in a pool of worker processes.
+
+    BeautifulSoup parsing is CPU-bound and holds the GIL, so parsing many
+    pages from the polling threads serializes them on one core. The pool
+    spreads them over `workers` processes while the calling threads wait
+    without holding the GIL, so fetches keep going. With one worker or less
+    (single-core devices) pages are parsed in-process. If a worker dies, the
+    page is parsed in-process and the pool is recreated on the next call.
+    """
+
+    def __init__(self, workers: int | None = None, backend: str | None = None):
+        """
+        @param workers: Number of worker processes, defaults to PARSE_WORKERS
+            then to default_workers().
+        @param backend: The parser backend used by the workers.
+        """
+        if workers is None:
+            workers = int(os.getenv("PARSE_WORKERS") or default_workers())
+        self.workers = workers
+        self.backend = backend
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def in_process(self) -> bool:
+        return self.workers <= 1
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Not forked: the scraper process runs threads and an event loop
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=setup_logging,
+                )
+                logger.info(f"Started a parse pool of {self.workers} workers")
+            return self._executor
+
+    def _reset(self, executor) -> None:
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def parse(self, html: str) -> GradeSheet:
+        """
+        Parse a grades page, blocking the calling thread until it is done.
+
+        @param html: The HTML content of the grades page.
+        @return: The GradeSheet of the page.
+        """
+        if self.in_process:
+            return parse_html(html, self.backend)
+
+        executor = self._get_executor()
+        with pool_seconds.time():
+            try:
+                result = executor.submit(parse_to_bytes, html.encode("utf-8"), self.backend).result()
+            except BrokenProcessPool:
+                logger.exception("Parse pool broken, parsing in-process")
+                self._reset(executor)
+                return parse_html(html, self.backend)
+
+        return record_parse(result)
+
+    def map(self, pages, window: int | None = None, return_exceptions: bool = False):
+        """
+        Parse many pages, e.g. to backfill the history from archived pages.
+
+        Pages are read from `pages` as workers free up: at most `window` pages
+        are in flight, so a long archive is never loaded in memory at once.
+
+        @param pages: An iterable of HTML contents.
+        @param window: Maximum pages in flight, defaults to twice the workers.
+        @param return_exceptions: Yield the exception raised by a page that
+            fails to parse instead of raising it, so the next pages still are.
+        @return: An iterator of GradeSheets, in the order of `pages`.
+        """
+        if self.in_process:
+            for html in pages:
+                yield self._outcome(lambda: parse_html(html, self.backend), return_exceptions)
+            return
+
+        executor = self._get_executor()
+        window = window or 2 * self.workers
+        pending = deque()
+
+        for html in pages:
+            pending.append(executor.submit(parse_to_bytes, html.encode("utf-8"), self.backend))
+            if len(pending) >= window:
+                future = pending.popleft()
+                yield self._outcome(lambda: record_parse(future.result()), return_exceptions)
+
+        while pending:
+            future = pending.popleft()
+            yield self._outcome(lambda: record_parse(future.result()), return_exceptions)
+
+    @staticmethod
+    def _outcome(parse, return_exceptions: bool):
+        try:
+            return parse()
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            return e
+
+    def close(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
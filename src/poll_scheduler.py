@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import os
+import time
+import random
+import logging
+from utils import load_json, save_json, get_env_variable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_INTERVAL = 5 * 60
+DEFAULT_MAX_INTERVAL = 6 * 60 * 60
+DEFAULT_JITTER = 0.1
+
+# A slot with at least this share of the busiest slot's publications is likely
+LIKELY_THRESHOLD = 0.2
+
+# Enough doublings to reach any sensible ceiling
+MAX_BACKOFF_EXPONENT = 16
+
+
+def _slot(now) -> str:
+    return f"{now.tm_wday}-{now.tm_hour}"
+
+
+class AdaptiveScheduler:
+    """
+    Decide when to poll an account next from what happened before.
+
+    The hours at which new grades were observed are counted per weekday and
+    hour. Likely slots are polled at `min_interval`; elsewhere the delay
+    doubles after every idle poll up to `max_interval`, without sleeping past
+    the next likely slot. Failures back off exponentially as well, and every
+    delay is jittered so a fleet of scrapers does not poll in lockstep.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        min_interval: float = DEFAULT_MIN_INTERVAL,
+        max_interval: float = DEFAULT_MAX_INTERVAL,
+        jitter: float = DEFAULT_JITTER,
+        prior_hours=(),
+    ):
+        """
+        @param path: JSON file where the learned publication slots are
+            persisted, if any. The idle and failure streaks only live in
+            memory: they change on every poll.
+        @param min_interval: Floor of the delay between two polls, in seconds.
+        @param max_interval: Ceiling of the delay between two polls, in seconds.
+        @param jitter: Relative random spread applied to every delay.
+        @param prior_hours: Hours considered likely before anything is learned.
+        """
+        self.path = path
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.jitter = jitter
+        self.prior_hours = set(prior_hours)
+        self.publications: dict[str, int] = {}
+        self.idle_streak = 0
+        self.failures = 0
+
+        state = load_json(path) if path and os.path.exists(path) else None
+        if isinstance(state, dict):
+            self.publications = dict(state.get("publications", {}))
+
+    @classmethod
+    def for_account(cls, account):
+        """Build the scheduler of an account, configured from the environment."""
+        prior_hours = ()
+        if account.has_window:
+            prior_hours = [hour for hour in range(24) if account.in_window(hour)]
+
+        return cls(
+            path=os.path.join(account.data_dir, "schedule.json"),
+            min_interval=float(
+                get_env_variable("POLL_MIN_INTERVAL") or DEFAULT_MIN_INTERVAL
+            ),
+            max_interval=float(
+                get_env_variable("POLL_MAX_INTERVAL") or DEFAULT_MAX_INTERVAL
+            ),
+            jitter=float(get_env_variable("POLL_JITTER") or DEFAULT_JITTER),
+            prior_hours=prior_hours,
+        )
+
+    def likelihood(self, weekday: int, hour: int) -> float:
+        """
+        Publications observed in this slot, relative to the busiest slot.
+
+        Before anything is observed, prior hours count as likely.
+        """
+        busiest = max(self.publications.values(), default=0)
+        if busiest == 0:
+            return 1.0 if hour in self.prior_hours else 0.0
+        return self.publications.get(f"{weekday}-{hour}", 0) / busiest
+
+    def is_likely(self, weekday: int, hour: int) -> bool:
+        return self.likelihood(weekday, hour) >= LIKELY_THRESHOLD
+
+    def record(self, new_grades: int = 0, failed: bool = False, now=None) -> None:
+        """
+        Record the outcome of a poll.
+
+        @param new_grades: The number of new grades found.
+        @param failed: Whether the poll failed.
+        @param now: A time.struct_time, defaults to the local time.
+        """
+        now = now or time.localtime()
+
+        if failed:
+            self.failures += 1
+        elif new_grades:
+            slot = _slot(now)
+            self.publications[slot] = self.publications.get(slot, 0) + 1
+            self.idle_streak = 0
+            self.failures = 0
+            if self.path:
+                save_json({"publications": self.publications}, self.path, compact=True)
+        else:
+            self.idle_streak += 1
+            self.failures = 0
+
+    def seconds_until_likely(self, now) -> float | None:
+        """Seconds until the start of the next likely hour, None if there is none."""
+        elapsed = now.tm_min * 60 + now.tm_sec
+        for offset in range(1, 7 * 24 + 1):
+            hour = (now.tm_hour + offset) % 24
+            weekday = (now.tm_wday + (now.tm_hour + offset) // 24) % 7
+            if self.is_likely(weekday, hour):
+                return offset * 3600 - elapsed
+        return None
+
+    def next_delay(self, now=None) -> float:
+        """
+        Compute the number of seconds to wait before the next poll.
+
+        @param now: A time.struct_time, defaults to the local time.
+        @return: The jittered delay, within [min_interval, max_interval].
+        """
+        now = now or time.localtime()
+
+        if self.failures:
+            delay = self.min_interval * 2 ** min(self.failures, MAX_BACKOFF_EXPONENT)
+        elif self.is_likely(now.tm_wday, now.tm_hour):
+            delay = self.min_interval
+        else:
+            delay = self.min_interval * 2 ** min(self.idle_streak, MAX_BACKOFF_EXPONENT)
+            until_likely = self.seconds_until_likely(now)
+            if until_likely is not None:
+                delay = min(delay, until_likely)
+
+        # Leave room for the jitter under the ceiling, or every delay that
+        # reaches it would be clamped back to exactly max_interval
+        ceiling = max(self.max_interval * (1 - self.jitter), self.min_interval)
+        delay = min(max(delay, self.min_interval), ceiling)
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return min(max(delay, self.min_interval), self.max_interval)
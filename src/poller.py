@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from poll_scheduler import AdaptiveScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class Poller:
+    """
+    Poll many accounts concurrently from a single asyncio loop.
+
+    Each account runs as its own task. The blocking fetch/parse/diff/notify
+    cycle is handed to a bounded thread pool, so at most `max_concurrency`
+    cycles run at the same time whatever the number of accounts. The delay
+    before the next cycle of an account comes from its AdaptiveScheduler.
+
+    With a `shard` (see sharding.ShardMember), only the accounts owned by
+    this worker are polled, each cycle under a lease of the shared queue.
+    With `breakers` (see scraper.breakers), the accounts of a host are not
+    polled while its circuit breaker is open. Requests to a host are paced
+    by its token bucket in scraper.get_response.
+    """
+
+    def __init__(
+        self,
+        accounts,
+        cycle,
+        scheduler_factory=None,
+        max_concurrency: int = 8,
+        shard=None,
+        breakers=None,
+    ):
+        """
+        @param accounts: The accounts to poll.
+        @param cycle: Blocking callable running one polling cycle for an
+            account and returning the number of new grades found.
+        @param scheduler_factory: Callable building the AdaptiveScheduler of
+            an account, defaults to an in-memory scheduler.
+        @param max_concurrency: Maximum number of cycles running at once.
+        @param shard: The ShardMember of this worker, None to poll every account.
+        @param breakers: Registry of the circuit breakers of the portal hosts.
+        """
+        self.accounts = list(accounts)
+        self.cycle = cycle
+        self.scheduler_factory = scheduler_factory or (lambda account: AdaptiveScheduler())
+        self.schedulers = {}
+        self.max_concurrency = max(1, max_concurrency)
+        self.shard = shard
+        self.breakers = breakers
+        self._semaphore = None
+        self._executor = None
+
+    async def run(self) -> None:
+        """Start one task per account and run until cancelled."""
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="poller"
+        )
+        logger.info(
+            f"Polling {len(self.accounts)} accounts "
+            f"(max {self.max_concurrency} concurrent cycles)"
+        )
+
+        try:
+            await asyncio.gather(
+                *(
+                    asyncio.create_task(self._watch(account), name=account.name)
+                    for account in self.accounts
+                )
+            )
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _watch(self, account) -> None:
+        while True:
+            if self.shard is not None and not self.shard.owns(account):
+                # Polled by another worker, until the ring changes
+                await asyncio.sleep(self.shard.heartbeat_interval)
+                continue
+            delay = await self.poll_once(account)
+            await asyncio.sleep(delay)
+
+    def scheduler(self, account) -> AdaptiveScheduler:
+        scheduler = self.schedulers.get(account.name)
+        if scheduler is None:
+            scheduler = self.scheduler_factory(account)
+            self.schedulers[account.name] = scheduler
+        return scheduler
+
+    async def poll_once(self, account) -> float:
+        """
+        Run one cycle for the account.
+
+        A failing cycle is logged and does not stop the other accounts.
+
+        @param account: The account to poll.
+        @return: Seconds to wait before polling this account again.
+        """
+        if self.breakers is not None:
+            wait = self.breakers.get(account.host).retry_after()
+            if wait > 0:
+                # The portal is failing: not a failure of this account
+                logger.info(f"[{account.name}] {account.host} paused, next check in {wait:.0f} seconds")
+                return wait
+
+        if self.shard is not None and not await asyncio.to_thread(self.shard.claim, account):
+            # Moved to another worker, or already polled in this window
+            return self.shard.heartbeat_interval
+
+        scheduler = self.scheduler(account)
+        new_grades = 0
+        failed = False
+
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            try:
+                new_grades = await loop.run_in_executor(
+                    self._executor, self.cycle, account
+                )
+            except Exception:
+                failed = True
+                logger.exception(f"[{account.name}] Polling cycle failed")
+
+        scheduler.record(new_grades=new_grades or 0, failed=failed)
+        delay = scheduler.next_delay()
+        if self.shard is not None:
+            await asyncio.to_thread(self.shard.release, account, delay)
+        logger.info(f"[{account.name}] Next check in {delay:.0f} seconds")
+        return delay
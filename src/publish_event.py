@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import json
+import socket
+import logging
+from datetime import datetime, timezone
+from utils import get_env_variable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EVENTS_SOCKET = "src/data/events.sock"
+
+# Stay well under the default datagram size limit of Unix sockets
+MAX_DATAGRAM_SIZE = 64 * 1024
+
+
+def get_events_socket():
+    return get_env_variable("EVENTS_SOCKET") or DEFAULT_EVENTS_SOCKET
+
+
+def new_grades_event(account, grades):
+    """
+    Build the compact delta event sent when new grades are detected.
+
+    @param account: The account name.
+    @param grades: The new grades, as returned by format_grades.
+    @return: The event as a dictionary.
+    """
+    return {
+        "type": "new_grades",
+        "account": account,
+        "at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "count": len(grades),
+        "grades": grades,
+    }
+
+
+def publish_event(event, path=None):
+    """
+    Send an event to the web API over its Unix datagram socket.
+
+    Publishing never blocks nor fails the polling cycle: if the API is not
+    listening, the event is dropped (clients fetch the data on reconnect).
+
+    @param event: The event to send, as a JSON-serializable dictionary.
+    @param path: Path to the socket, defaults to EVENTS_SOCKET.
+    @return: True if the event was handed to the socket.
+    """
+    path = path or get_events_socket()
+    payload = json.dumps(event, ensure_ascii=False, separators=(",", ":")).encode(
+        "utf-8"
+    )
+    if len(payload) > MAX_DATAGRAM_SIZE:
+        # Too many grades at once: only announce them, clients refetch
+        event = {key: value for key, value in event.items() if key != "grades"}
+        payload = json.dumps(event, separators=(",", ":")).encode("utf-8")
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    try:
+        sock.sendto(payload, path)
+        return True
+    except (FileNotFoundError, ConnectionRefusedError, BlockingIOError) as e:
+        logger.debug(f"Event not delivered to {path}: {e}")
+        return False
+    finally:
+        sock.close()
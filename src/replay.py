@@ -0,0 +1,172 @@
+"""
+Replay archived portal pages through the parse and diff pipeline.
+
+Reads the pages captured in ARCHIVE_DIR (see archive.py), parses and diffs
+them account by account as fast as possible, and prints the notifications
+that would have been sent, one JSON line each. Nothing is fetched, saved or
+sent. Useful to check a parser change against months of real pages, or to
+measure throughput on real payloads:
+
+    python src/replay.py --archive src/data/archive --parser lxml > replay.ndjson
+"""
+
+from __future__ import annotations
+
+import sys
+import json
+import time
+import logging
+import argparse
+from collections import deque
+from archive import CaptureArchive
+from averages import AveragesEngine
+from get_new_grades import GradeIndex, format_grades
+from notifier import build_notification
+from parse_pool import ParsePool, default_workers
+from utils import get_env_variable
+
+logger = logging.getLogger(__name__)
+
+
+def replay_account(archive, account, pool, out, since=None, until=None, notify_initial=False):
+    """
+    Replay the archived pages of an account.
+
+    The grade index starts empty. Unless `notify_initial` is set, the first
+    page only primes it, as the grades already known at the start of the
+    archive were notified before it. A page that fails to parse is logged
+    with its offset in the account's archive and skipped.
+
+    @param archive: The CaptureArchive to read.
+    @param account: The account name.
+    @param pool: The ParsePool parsing the pages.
+    @param out: Text stream the notifications are written to.
+    @param since: Only replay days on or after this YYYY-MM-DD date.
+    @param until: Only replay days on or before this YYYY-MM-DD date.
+    @param notify_initial: Also emit the grades of the first page.
+    @return: A (pages, characters of HTML, notifications, failed pages) tuple.
+    """
+    index = GradeIndex()
+    engine = None
+    pages = size = notifications = failed = 0
+    captures = deque()
+
+    def html_of(records):
+        nonlocal size
+        for record in records:
+            captures.append(record["at"])
+            size += len(record["html"])
+            yield record["html"]
+
+    records = archive.records(account, since=since, until=until)
+    for offset, sheet in enumerate(pool.map(html_of(records), return_exceptions=True)):
+        captured_at = captures.popleft()
+        pages += 1
+        if isinstance(sheet, Exception):
+            failed += 1
+            logger.warning(
+                f"[{account}] Skipping archived page {offset} captured at {captured_at}: {sheet}"
+            )
+            continue
+
+        events, current = index.diff(sheet)
+        index.commit(current)
+        if pages - failed == 1 and not notify_initial:
+            continue
+
+        # Averages as the scraper computes them, see main.get_course_averages
+        averages = None
+        if events:
+            if engine is None:
+                engine = AveragesEngine(sheet)
+            else:
+                engine.sync(sheet)
+            averages = engine.course_averages()
+
+        new_grades = format_grades(events, averages)
+        if new_grades:
+            notifications += 1
+            out.write(
+                json.dumps(
+                    {
+                        "account": account,
+                        "at": captured_at,
+                        "grades": new_grades,
+                        "notification": build_notification(new_grades, account, None),
+                    },
+                    ensure_ascii=False,
+                )
+                + "\n"
+            )
+
+    return pages, size, notifications, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay archived grades pages.")
+    parser.add_argument(
+        "--archive",
+        default=get_env_variable("ARCHIVE_DIR"),
+        help="Archive directory, defaults to ARCHIVE_DIR",
+    )
+    parser.add_argument("--account", action="append", help="Only replay these accounts")
+    parser.add_argument("--since", help="First day to replay (YYYY-MM-DD)")
+    parser.add_argument("--until", help="Last day to replay (YYYY-MM-DD)")
+    parser.add_argument("--parser", help="Parser backend, defaults to GRADES_PARSER")
+    parser.add_argument("--workers", type=int, help="Parse workers, defaults to PARSE_WORKERS")
+    parser.add_argument(
+        "--notify-initial",
+        action="store_true",
+        help="Also emit the grades already present on the first page",
+    )
+    args = parser.parse_args(argv)
+
+    if not args.archive:
+        parser.error("no archive directory, pass --archive or set ARCHIVE_DIR")
+
+    # Replays are CPU-bound: use the cores whatever the number of accounts
+    workers = args.workers
+    if workers is None:
+        workers = int(get_env_variable("PARSE_WORKERS") or default_workers(sys.maxsize))
+
+    archive = CaptureArchive(args.archive)
+    pool = ParsePool(workers=workers, backend=args.parser)
+    total_pages = total_size = total_notifications = total_failed = 0
+    start = time.perf_counter()
+
+    try:
+        for account in args.account or archive.accounts():
+            pages, size, notifications, failed = replay_account(
+                archive,
+                account,
+                pool,
+                sys.stdout,
+                since=args.since,
+                until=args.until,
+                notify_initial=args.notify_initial,
+            )
+            logger.info(
+                f"[{account}] {pages} pages, {notifications} notifications, {failed} failed"
+            )
+            total_pages += pages
+            total_size += size
+            total_notifications += notifications
+            total_failed += failed
+    finally:
+        pool.close()
+
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"Replayed {total_pages} pages ({total_size / 1e6:.1f}M characters) in {elapsed:.2f}s "
+        f"({total_pages / elapsed if elapsed else 0:.1f} pages/s), "
+        f"{total_notifications} notifications, {total_failed} pages failed to parse"
+    )
+
+
+if __name__ == "__main__":
+    from setup_logging import setup_logging
+    from utils import load_env_variables
+
+    setup_logging()
+    load_env_variables()
+    main()
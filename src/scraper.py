@@ -1,12 +1,16 @@
-import requests
+import os
+import random
+import hashlib
 import logging
+import threading
 import time
-from urllib3.exceptions import NameResolutionError
-from requests.exceptions import ConnectionError
-from setup_logging import setup_logging
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+from metrics import counter, histogram
 
+# requests is imported on first use: it is the heaviest dependency of the
+# scraper and is not needed to start the polling loop
 
-setup_logging()
 logger = logging.getLogger(__name__)
 
 # Headers to mimic a real browser and avoid 403 errors
@@ -23,61 +27,443 @@ HEADERS = {
     "Cache-Control": "max-age=0",
 }
 
+# Connections kept open per host, shared by every account polling that host
+POOL_MAXSIZE = 16
 
-def get_response(url, max_retries=3, base_delay=5):
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+request_seconds = histogram(
+    "scraper_request_seconds", "Latency of the requests to the grades portal"
+)
+responses_total = counter(
+    "scraper_responses_total", "Responses received from the grades portal"
+)
+retries_total = counter(
+    "scraper_request_retries_total", "Requests retried after a transient failure"
+)
+dns_failures_total = counter(
+    "scraper_dns_failures_total", "DNS resolution failures for the grades portal"
+)
+errors_total = counter(
+    "scraper_request_errors_total", "Requests to the grades portal that failed"
+)
+throttled_seconds = histogram(
+    "scraper_throttled_seconds", "Time requests waited for a token of their host"
+)
+breaker_transitions_total = counter(
+    "scraper_breaker_transitions_total", "Circuit breaker state changes per portal host"
+)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of sending a request to a host whose breaker is open."""
+
+    def __init__(self, host, retry_after):
+        super().__init__(f"Circuit open for {host}, retrying in {retry_after:.0f} seconds")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Allow `rate` requests per second to a host, with bursts of `burst`.
+
+    Tokens are reserved before sleeping, so concurrent callers queue up one
+    token apart instead of all waking at once.
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, sleeping until one is available.
+
+        @return: The seconds waited.
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait:
+            self._sleep(wait)
+        return wait
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests to a host after repeated timeouts or 5xx.
+
+    After `failure_threshold` failures in a row the breaker opens: requests
+    fail fast for `reset_timeout` seconds. It then lets a single probe
+    through (half-open), which closes it on success or opens it again.
+    """
+
+    def __init__(self, host, failure_threshold=5, reset_timeout=60.0, clock=time.monotonic):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        if state != self._state:
+            logger.warning(f"Circuit breaker for {self.host}: {self._state} -> {state}")
+            breaker_transitions_total.inc(host=self.host, state=state)
+            self._state = state
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                self._transition(HALF_OPEN)
+                self._probing = False
+            return self._state
+
+    def retry_after(self):
+        """Seconds before the host may be tried again, 0 when it may be now."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_timeout - self._clock())
+
+    def allow(self):
+        """Tell whether a request may be sent, taking the probe slot when half-open."""
+        state = self.state
+        with self._lock:
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+                self._probing = False
+                self._transition(OPEN)
+
+    def release(self):
+        """Give back the probe slot after an attempt that told nothing about the host."""
+        with self._lock:
+            self._probing = False
+
+
+class HostRegistry:
+    """Lazily create one object per portal host, e.g. one breaker per host."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, host):
+        with self._lock:
+            item = self._items.get(host)
+            if item is None:
+                item = self._items[host] = self._factory(host)
+            return item
+
+
+# Shared by every account of a host, configured by HOST_RATE, HOST_BURST,
+# BREAKER_FAILURES and BREAKER_RESET when the host is first requested
+buckets = HostRegistry(
+    lambda host: TokenBucket(
+        rate=float(os.getenv("HOST_RATE") or 1.0),
+        burst=float(os.getenv("HOST_BURST") or 3),
+    )
+)
+breakers = HostRegistry(
+    lambda host: CircuitBreaker(
+        host,
+        failure_threshold=int(os.getenv("BREAKER_FAILURES") or 5),
+        reset_timeout=float(os.getenv("BREAKER_RESET") or 60),
+    )
+)
+
+
+def backoff_delay(base_delay, attempt, retry_after=None):
     """
-    Get the response from a url with retry logic for DNS failures.
+    Delay before retrying, exponential with jitter.
+
+    The jitter keeps the accounts of a host from retrying in lockstep.
+
+    @param base_delay: Delay of the first retry in seconds.
+    @param attempt: The number of the failed attempt, from 0.
+    @param retry_after: Delay asked by the portal (Retry-After), a minimum.
+    @return: The delay in seconds.
+    """
+    delay = base_delay * (2**attempt)
+    delay = random.uniform(delay / 2, delay)
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        # Missing, or an HTTP date
+        return None
+
+
+def get_session(url):
+    """
+    Get the long-lived session used for the host of the given URL.
+
+    Sessions are created once per host and reused across polls and accounts,
+    so the TCP/TLS connection to the portal is kept alive between requests.
+
+    @param url: The URL that will be requested.
+    @return: The requests.Session for this host.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    host = urlparse(url).netloc
+
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[host] = session
+
+    return session
+
+
+def close_sessions():
+    """Close every pooled session and their connections."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def get_response(url, max_retries=3, base_delay=5, headers=None):
+    """
+    Get the response from a url, within the rate limit and breaker of its host.
+
+    DNS failures, timeouts, 5xx and 429 responses are retried with jittered
+    exponential backoff. Timeouts, refused connections, 5xx and 429 also
+    count towards the circuit breaker of the host; the other errors give
+    back its half-open probe.
 
     @param url: The URL to fetch the response from.
-    @param max_retries: Maximum number of retry attempts for transient errors.
+    @param max_retries: Maximum number of attempts for transient errors.
     @param base_delay: Base delay in seconds for exponential backoff.
-    @return: response object from requests.get.
+    @param headers: Extra headers sent on top of the session HEADERS.
+    @return: response object from the pooled session.
+    @raise CircuitOpenError: When the breaker of the host is open.
     """
+    import requests
+
     last_exception = None
+    reason = None
+    session = get_session(url)
+    host = urlparse(url).netloc
+    breaker = breakers.get(host)
+    bucket = buckets.get(host)
 
     for attempt in range(max_retries):
+        if not breaker.allow():
+            errors_total.inc(host=host, error="circuit_open")
+            raise CircuitOpenError(host, breaker.retry_after())
+        throttled_seconds.observe(bucket.acquire(), host=host)
+
+        retry_after = None
         try:
-            response = requests.get(url, headers=HEADERS, timeout=10)
-            response.raise_for_status()
-            logger.info(f"Successfully fetched data from {url}")
-            return response
+            with request_seconds.time(host=host):
+                response = session.get(url, headers=headers, timeout=10)
+            responses_total.inc(host=host, status=response.status_code)
+
+            if response.status_code >= 500 or response.status_code == 429:
+                # The portal is struggling or throttling us: back off
+                breaker.record_failure()
+                errors_total.inc(host=host, error="http")
+                reason = "http"
+                retry_after = _retry_after(response)
+                last_exception = requests.HTTPError(
+                    f"{response.status_code} Error for url: {url}", response=response
+                )
+            else:
+                breaker.record_success()
+                response.raise_for_status()
+                logger.info(f"Successfully fetched data from {url}")
+                return response
 
-        except ConnectionError as e:
+        except requests.Timeout as e:
+            # Before ConnectionError: connect timeouts are both
+            breaker.record_failure()
+            errors_total.inc(host=host, error="timeout")
+            reason = "timeout"
+            last_exception = e
+
+        except requests.ConnectionError as e:
             last_exception = e
             # Check if it's a DNS resolution error
             if "Failed to resolve" in str(e) or "NameResolutionError" in str(e):
-                delay = base_delay * (2**attempt)  # Exponential backoff
-                logger.warning(
-                    f"DNS resolution failed for {url} (attempt {attempt + 1}/{max_retries}). "
-                    f"Retrying in {delay} seconds... Error: {e}"
-                )
-                if attempt < max_retries - 1:
-                    time.sleep(delay)
-                    continue
-                else:
+                # A local resolver problem, not a failure of the host
+                breaker.release()
+                dns_failures_total.inc(host=host)
+                reason = "dns"
+                if attempt == max_retries - 1:
                     logger.error(f"DNS resolution failed after {max_retries} attempts")
+                    errors_total.inc(host=host, error="dns")
             else:
                 # Non-DNS connection error, don't retry
+                breaker.record_failure()
+                errors_total.inc(host=host, error="connection")
                 logger.error(f"Connection error while fetching data: {e}")
                 raise RuntimeError(f"Connection error while fetching data: {e}")
 
-        except requests.Timeout as e:
-            last_exception = e
-            logger.error(f"Request timeout while fetching data: {e}")
-            raise RuntimeError(f"Request timeout while fetching data: {e}")
-
         except requests.HTTPError as e:
-            last_exception = e
+            # 4xx: retrying would not help
+            errors_total.inc(host=host, error="http")
             logger.error(f"HTTP error while fetching data: {e}")
             raise RuntimeError(f"HTTP error while fetching data: {e}")
 
         except requests.RequestException as e:
-            last_exception = e
+            breaker.release()
+            errors_total.inc(host=host, error="request")
             logger.error(f"Request error while fetching data: {e}")
             raise RuntimeError(f"Request error while fetching data: {e}")
 
+        # Once the breaker is open, the next attempt fails fast
+        if attempt < max_retries - 1 and breaker.state != OPEN:
+            delay = backoff_delay(base_delay, attempt, retry_after)
+            logger.warning(
+                f"Fetching {url} failed ({reason}, attempt {attempt + 1}/{max_retries}). "
+                f"Retrying in {delay:.1f} seconds... Error: {last_exception}"
+            )
+            retries_total.inc(host=host, reason=reason)
+            time.sleep(delay)
+
     # If we exhausted all retries
     raise RuntimeError(
         f"Failed to fetch data after {max_retries} attempts. "
         f"Last error: {last_exception}"
     )
+
+
+@dataclass
+class FetchResult:
+    """Outcome of a conditional fetch of a page."""
+
+    url: str
+    status_code: int
+    changed: bool
+    text: str = None
+    validators: dict = field(default_factory=dict)
+
+
+class PageCache:
+    """
+    Remember the validators of the last processed response of each URL.
+
+    The ETag / Last-Modified headers are replayed as If-None-Match /
+    If-Modified-Since, and a hash of the body is kept for portals that
+    ignore conditional requests.
+    """
+
+    def __init__(self):
+        self._validators = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            return dict(self._validators.get(url, {}))
+
+    def store(self, result):
+        """
+        Record a fetch result once it has been fully processed.
+
+        @param result: The FetchResult returned by fetch_page.
+        """
+        if result.validators:
+            with self._lock:
+                self._validators[result.url] = result.validators
+
+    def forget(self, url):
+        with self._lock:
+            self._validators.pop(url, None)
+
+
+page_cache = PageCache()
+
+
+def fetch_page(url, cache=page_cache, **kwargs):
+    """
+    Fetch a page, telling whether it changed since the last processed fetch.
+
+    The cache is not updated here: call cache.store(result) once the page has
+    been handled, so a failure downstream gets the page fetched again.
+
+    @param url: The URL to fetch.
+    @param cache: The PageCache holding the previous validators.
+    @return: A FetchResult, with text set only when the page changed.
+    """
+    previous = cache.get(url)
+    headers = {}
+    if previous.get("etag"):
+        headers["If-None-Match"] = previous["etag"]
+    if previous.get("last_modified"):
+        headers["If-Modified-Since"] = previous["last_modified"]
+
+    response = get_response(url, headers=headers, **kwargs)
+
+    if response.status_code == 304:
+        logger.info(f"Page not modified (304): {url}")
+        return FetchResult(url=url, status_code=304, changed=False)
+
+    digest = hashlib.sha256(response.content).hexdigest()
+    validators = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "digest": digest,
+    }
+
+    if digest == previous.get("digest"):
+        logger.info(f"Page body unchanged: {url}")
+        return FetchResult(
+            url=url,
+            status_code=response.status_code,
+            changed=False,
+            validators=validators,
+        )
+
+    return FetchResult(
+        url=url,
+        status_code=response.status_code,
+        changed=True,
+        text=response.text,
+        validators=validators,
+    )
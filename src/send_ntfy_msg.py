@@ -1,16 +1,16 @@
-import requests
 import os
 import logging
-from setup_logging import setup_logging
-from utils import load_env_variables
-
-setup_logging()
-load_env_variables()
+from metrics import counter
 
 logger = logging.getLogger(__name__)
 
-grades_url = os.getenv("CLICK_GRADES_URL")
-ntfy_topic = os.getenv("NTFY_TOPIC")
+NTFY_TIMEOUT = 10
+
+notifications_total = counter("ntfy_notifications_total", "Notifications sent to ntfy")
+
+
+def get_ntfy_url():
+    return (os.getenv("NTFY_URL") or "https://ntfy.sh").rstrip("/")
 
 
 def send_ntfy_msg(topic, message, redirect_url):
@@ -20,27 +20,43 @@ def send_ntfy_msg(topic, message, redirect_url):
     @param topic: The ntfy topic to send the message to.
     @param message: The message to send.
     """
+    import requests
+
+    body = message["details"].split("/")[0]
+    if message.get("average") is not None:
+        body += f"\nNew average: {message['average']}"
+
     try:
         response = requests.post(
-            f"https://ntfy.sh/{topic}",
-            data=message["details"].split("/")[0].encode(encoding="utf-8"),
+            f"{get_ntfy_url()}/{topic}",
+            data=body.encode(encoding="utf-8"),
             headers={
                 "Tags": "face_in_clouds",
                 "Title": message["title"],
                 "Priority": "5",
                 "Click": redirect_url,
             },
+            timeout=NTFY_TIMEOUT,
         )
         response.raise_for_status()
+        notifications_total.inc(result="sent")
         logger.info(
-            f"✅ Sending {message["title"]} ; {message["details"]} to topic {topic}"
+            f"✅ Sending {message['title']} ; {message['details']} to topic {topic}"
         )
 
     except Exception as e:
+        notifications_total.inc(result="failed")
         logger.error(f"🛑 Failed to send ntfy message: {e}")
 
 
 if __name__ == "__main__":
+    from setup_logging import setup_logging
+    from utils import load_env_variables
+
+    setup_logging()
+    load_env_variables()
+    ntfy_topic = os.getenv("NTFY_TOPIC")
+
     try:
         send_ntfy_msg(ntfy_topic, "bogos binted")
         logger.info("Notification sent successfully.")
@@ -0,0 +1,353 @@
+"""
+Split the accounts between several scraper workers.
+
+Every worker registers in a shared SQLite work queue (SHARD_QUEUE) and sends
+heartbeats. The live workers form a consistent-hash ring: each account
+belongs to one worker, and when a worker joins or leaves only the accounts
+of its arc move. Before polling, a worker takes a lease on the account; the
+lease and the earliest time of the next poll are checked in the same
+statement, so an account moving between workers is never polled twice in
+the same window. Show the current assignment with:
+
+    python src/sharding.py --queue src/data/shards.db
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import socket
+import sqlite3
+import asyncio
+import bisect
+import hashlib
+import logging
+import argparse
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Virtual nodes per worker, so the accounts spread evenly
+DEFAULT_REPLICAS = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    account TEXT PRIMARY KEY,
+    worker TEXT,
+    expires REAL NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0
+);
+"""
+
+# Take the lease if it is free, ours or expired, and the account is due
+ACQUIRE = """
+INSERT INTO leases (account, worker, expires) VALUES (:account, :worker, :expires)
+ON CONFLICT (account) DO UPDATE SET
+    worker = excluded.worker,
+    expires = excluded.expires
+WHERE (leases.worker IS NULL OR leases.worker = excluded.worker OR leases.expires < :now)
+    AND leases.not_before <= :now
+"""
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class HashRing:
+    """Consistent-hash ring mapping account names to worker ids."""
+
+    def __init__(self, workers=(), replicas: int = DEFAULT_REPLICAS):
+        self.workers = tuple(sorted(set(workers)))
+        points = sorted(
+            (_hash(f"{worker}#{replica}"), worker)
+            for worker in self.workers
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [worker for _, worker in points]
+
+    def owner(self, key: str) -> str | None:
+        """
+        Find the worker responsible for a key.
+
+        @param key: The account name.
+        @return: The worker id, None when there are no workers.
+        """
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+    def assignment(self, keys) -> dict[str, list[str]]:
+        """The keys of each worker."""
+        shards = {worker: [] for worker in self.workers}
+        for key in keys:
+            owner = self.owner(key)
+            if owner is not None:
+                shards[owner].append(key)
+        return shards
+
+
+class WorkQueue:
+    """
+    Worker registry and account leases in a SQLite database.
+
+    The database must be shared by the workers: a file on the host, or on a
+    volume mounted by every container. Safe to use from several threads.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def heartbeat(self, worker: str, now: float | None = None) -> None:
+        now = time.time() if now is None else now
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO workers (id, heartbeat) VALUES (?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (worker, now),
+            )
+
+    def workers(self, ttl: float, now: float | None = None) -> list[str]:
+        """The workers that sent a heartbeat in the last `ttl` seconds, read-only."""
+        now = time.time() if now is None else now
+        with self._lock:
+            return [
+                worker
+                for (worker,) in self._conn.execute(
+                    "SELECT id FROM workers WHERE heartbeat >= ? ORDER BY id", (now - ttl,)
+                )
+            ]
+
+    def live_workers(self, ttl: float, now: float | None = None) -> list[str]:
+        """
+        The workers that sent a heartbeat in the last `ttl` seconds.
+
+        Older workers are removed and their leases released.
+        """
+        now = time.time() if now is None else now
+        with self._lock, self._conn:
+            dead = [
+                worker
+                for (worker,) in self._conn.execute(
+                    "SELECT id FROM workers WHERE heartbeat < ?", (now - ttl,)
+                )
+            ]
+            for worker in dead:
+                self._forget(worker)
+            return [worker for (worker,) in self._conn.execute("SELECT id FROM workers ORDER BY id")]
+
+    def leave(self, worker: str) -> None:
+        """Unregister a worker and release its leases."""
+        with self._lock, self._conn:
+            self._forget(worker)
+
+    def _forget(self, worker: str) -> None:
+        self._conn.execute("DELETE FROM workers WHERE id = ?", (worker,))
+        self._conn.execute(
+            "UPDATE leases SET worker = NULL, expires = 0 WHERE worker = ?", (worker,)
+        )
+
+    def acquire(self, account: str, worker: str, ttl: float, now: float | None = None) -> bool:
+        """
+        Take the lease of an account before polling it.
+
+        @param account: The account name.
+        @param worker: The worker id.
+        @param ttl: Seconds after which a lease not released is up for grabs.
+        @param now: The current UNIX time, defaults to now.
+        @return: True if the worker holds the lease and the account is due.
+        """
+        now = time.time() if now is None else now
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                ACQUIRE,
+                {"account": account, "worker": worker, "expires": now + ttl, "now": now},
+            )
+            return cursor.rowcount == 1
+
+    def release(self, account: str, worker: str, next_poll: float) -> None:
+        """
+        Release the lease of an account after polling it.
+
+        @param account: The account name.
+        @param worker: The worker id, only its own lease is released.
+        @param next_poll: UNIX time before which no worker may poll it again.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE leases SET worker = NULL, expires = 0, not_before = ? "
+                "WHERE account = ? AND worker = ?",
+                (next_poll, account, worker),
+            )
+
+    def leases(self) -> dict[str, tuple[str | None, float, float]]:
+        """The (worker, expires, not_before) lease of every account."""
+        with self._lock:
+            return {
+                account: (worker, expires, not_before)
+                for account, worker, expires, not_before in self._conn.execute(
+                    "SELECT account, worker, expires, not_before FROM leases"
+                )
+            }
+
+
+class ShardMember:
+    """
+    A scraper worker taking part in the sharding.
+
+    run() keeps the worker registered and rebuilds the ring when workers
+    join or leave. The Poller asks owns() whether to watch an account, then
+    claim() and release() around every cycle.
+
+    State kept in memory for an account (grade index, fingerprint, page
+    validators) goes stale while another worker polls it: `on_gain` is
+    called with the account when this worker claims it for the first time
+    since it last owned it, to drop that state before the cycle runs.
+    """
+
+    def __init__(
+        self,
+        queue: WorkQueue,
+        worker_id: str | None = None,
+        heartbeat_interval: float = 10.0,
+        worker_ttl: float | None = None,
+        lease_ttl: float = 600.0,
+        on_gain=None,
+    ):
+        """
+        @param queue: The shared WorkQueue.
+        @param worker_id: Unique id of the worker, defaults to host and pid.
+        @param heartbeat_interval: Seconds between two heartbeats.
+        @param worker_ttl: Seconds without heartbeat after which a worker is
+            considered gone, defaults to three heartbeats.
+        @param lease_ttl: Seconds after which the lease of a worker that
+            crashed mid-cycle expires, longer than any cycle.
+        @param on_gain: Callable taking an account newly claimed by this worker.
+        """
+        self.queue = queue
+        self.worker_id = worker_id or default_worker_id()
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_ttl = worker_ttl or 3 * heartbeat_interval
+        self.lease_ttl = lease_ttl
+        self.on_gain = on_gain
+        self.ring = HashRing([self.worker_id])
+        # Accounts claimed since this worker last gained them
+        self._claimed: set[str] = set()
+
+    def beat(self) -> bool:
+        """
+        Send a heartbeat and refresh the ring.
+
+        @return: True if the workers changed since the last beat.
+        """
+        self.queue.heartbeat(self.worker_id)
+        workers = self.queue.live_workers(self.worker_ttl)
+        if self.worker_id not in workers:
+            # Taken for dead after a long pause: register again
+            self.queue.heartbeat(self.worker_id)
+            workers.append(self.worker_id)
+
+        if tuple(sorted(workers)) == self.ring.workers:
+            return False
+        self.ring = HashRing(workers)
+        # Accounts moving away are gained again if they ever come back
+        self._claimed = {name for name in self._claimed if self.ring.owner(name) == self.worker_id}
+        logger.info(f"[{self.worker_id}] Rebalanced over {len(workers)} workers: {', '.join(self.ring.workers)}")
+        return True
+
+    def owns(self, account) -> bool:
+        return self.ring.owner(account.name) == self.worker_id
+
+    def claim(self, account) -> bool:
+        """Take the lease of an account owned by this worker."""
+        if not self.owns(account) or not self.queue.acquire(
+            account.name, self.worker_id, self.lease_ttl
+        ):
+            return False
+
+        if account.name not in self._claimed:
+            self._claimed.add(account.name)
+            if self.on_gain is not None:
+                self.on_gain(account)
+        return True
+
+    def release(self, account, delay: float) -> None:
+        """Release the lease, no worker polling the account for `delay` seconds."""
+        self.queue.release(account.name, self.worker_id, time.time() + delay)
+
+    async def run(self) -> None:
+        """Send heartbeats until cancelled, then leave the ring."""
+        try:
+            while True:
+                await asyncio.to_thread(self.beat)
+                await asyncio.sleep(self.heartbeat_interval)
+        finally:
+            self.queue.leave(self.worker_id)
+            logger.info(f"[{self.worker_id}] Left the ring")
+
+
+def main(argv=None):
+    from accounts import load_accounts
+    from utils import get_env_variable
+
+    parser = argparse.ArgumentParser(description="Show how the accounts are split between the workers.")
+    parser.add_argument(
+        "--queue",
+        default=get_env_variable("SHARD_QUEUE"),
+        help="Work queue database, defaults to SHARD_QUEUE",
+    )
+    parser.add_argument(
+        "--ttl",
+        type=float,
+        default=3 * float(get_env_variable("SHARD_HEARTBEAT") or 10),
+        help="Seconds before a silent worker is considered gone, defaults to three SHARD_HEARTBEAT",
+    )
+    args = parser.parse_args(argv)
+    if not args.queue:
+        parser.error("no work queue, pass --queue or set SHARD_QUEUE")
+
+    queue = WorkQueue(args.queue)
+    # Read-only: dead workers are left for the live ones to remove
+    ring = HashRing(queue.workers(args.ttl))
+    leases = queue.leases()
+    now = time.time()
+
+    for worker, accounts in ring.assignment(account.name for account in load_accounts()).items():
+        print(f"{worker}: {len(accounts)} accounts")
+        for account in accounts:
+            holder, _, not_before = leases.get(account, (None, 0, 0))
+            state = f"polling ({holder})" if holder else f"next poll in {max(0, not_before - now):.0f}s"
+            print(f"    {account}: {state}")
+    queue.close()
+
+
+if __name__ == "__main__":
+    from setup_logging import setup_logging
+    from utils import load_env_variables
+
+    setup_logging()
+    load_env_variables()
+    main()
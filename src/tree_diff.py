@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+from typing import Any, Iterator, NamedTuple
+
+from grade_model import GRADE, GradeRow, GradeSheet, as_sheet
+
+ADDED, CHANGED, REMOVED = "added", "changed", "removed"
+
+# Statuses shown in the grade column that are not marks
+NOT_GRADES = ("", "Validé")
+
+# Share of the known grades a page may remove before it is taken for a
+# broken page (login, maintenance, partial render) rather than corrections
+MAX_REMOVED_SHARE = 0.5
+
+
+class SuspectPageError(ValueError):
+    """Raised instead of committing a page that removes most known grades."""
+
+    def __init__(self, removed, known):
+        super().__init__(f"Page removes {removed} of the {known} known grades")
+        self.removed = removed
+        self.known = known
+
+
+class GradeSlot(NamedTuple):
+    """
+    Stable identity of a grade in the tree.
+
+    `slot` is the position of the grade within its grade type, so two equal
+    marks of the same grade type stay two grades. Ponderations and
+    coefficients are attributes, not part of the identity.
+    """
+
+    year: str
+    semester: str | None
+    module: str | None
+    course: str | None
+    grade_type: str | None
+    slot: int
+
+
+class GradeEvent(NamedTuple):
+    """A grade added, changed or removed between two pages."""
+
+    kind: str
+    slot: GradeSlot
+    # (value, coef) before and after the change, None when absent
+    old: tuple[str, str] | None
+    new: tuple[str, str] | None
+
+
+def iter_slots(data: GradeSheet | list[dict[str, Any]] | None) -> Iterator[tuple[GradeSlot, GradeRow]]:
+    """
+    Yield every grade row of a page with its slot, in page order.
+
+    Empty cells and statuses are included and take a slot.
+
+    @param data: The GradeSheet or the nested JSON structure of a page.
+    @return: An iterator of (GradeSlot, GradeRow) pairs.
+    """
+    positions: dict[tuple, int] = {}
+    for row in as_sheet(data).grades():
+        path = (row.year, row.semester, row.module, row.course, row.grade_type)
+        position = positions[path] = positions.get(path, -1) + 1
+        yield GradeSlot(*path, position), row
+
+
+def grade_slots(data: GradeSheet | list[dict[str, Any]] | None) -> dict[tuple, tuple[str, str]]:
+    """
+    Key the grades of a page by their slot, in page order.
+
+    Empty cells and statuses still take a slot, so a grade filled in later
+    keeps the identity of its placeholder, but they are left out of the map.
+    This runs on every page of every cycle: the keys are plain tuples of the
+    GradeSlot fields, which hash and compare like GradeSlots but are smaller
+    and cheaper to build, and the GradeSlots are only built for the events.
+
+    @param data: The GradeSheet or the nested JSON structure of a page.
+    @return: {(year, semester, module, course, grade_type, slot): (value, coef)}
+        of the actual grades.
+    """
+    slots = {}
+    positions: dict[tuple, int] = {}
+    path = None
+    position = -1
+
+    for row in as_sheet(data).rows:
+        grade = row.grade
+        if grade is None:
+            continue
+        if row.opens < GRADE:
+            # First grade of a grade type, the next ones only open at GRADE
+            if path is not None:
+                positions[path] = position
+            path = (row.year, row.semester, row.module, row.course, row.grade_type)
+            position = positions.get(path, -1)
+        position += 1
+        if grade not in NOT_GRADES:
+            slots[(*path, position)] = (grade, row.coef)
+
+    return slots
+
+
+def diff_slots(
+    old: dict[tuple, tuple[str, str]], new: dict[tuple, tuple[str, str]]
+) -> list[GradeEvent]:
+    """
+    Diff two slot maps built by grade_slots().
+
+    Walks the new page once and the old one only when some of its grades
+    were not matched, so the cost is linear in the number of grades.
+
+    @param old: The slots of the previous page.
+    @param new: The slots of the current page.
+    @return: The added and changed grades in page order, then the removed ones.
+    """
+    events = []
+    matched = 0
+
+    for slot, grade in new.items():
+        previous = old.get(slot)
+        if previous is None:
+            events.append(GradeEvent(ADDED, GradeSlot._make(slot), None, grade))
+            continue
+        matched += 1
+        if previous != grade:
+            events.append(GradeEvent(CHANGED, GradeSlot._make(slot), previous, grade))
+
+    if matched < len(old):
+        events.extend(
+            GradeEvent(REMOVED, GradeSlot._make(slot), grade, None)
+            for slot, grade in old.items()
+            if slot not in new
+        )
+
+    return events
+
+
+def diff_sheets(old_data, new_data) -> list[GradeEvent]:
+    """
+    Diff the grades of two pages.
+
+    @param old_data: The previous GradeSheet or nested JSON structure.
+    @param new_data: The current GradeSheet or nested JSON structure.
+    @return: The GradeEvents, see diff_slots().
+    """
+    return diff_slots(grade_slots(old_data), grade_slots(new_data))
+
+
+def check_removals(known: int, events: list[GradeEvent]) -> None:
+    """
+    Refuse a diff removing all or most of the known grades.
+
+    An empty or truncated page would otherwise overwrite the snapshot, and
+    the next good page would announce every grade again.
+
+    @param known: Number of grades known before the page.
+    @param events: The GradeEvents of the page.
+    @raise SuspectPageError: When more than MAX_REMOVED_SHARE of the known
+        grades would be removed.
+    """
+    removed = sum(event.kind == REMOVED for event in events)
+    if removed and removed > known * MAX_REMOVED_SHARE:
+        raise SuspectPageError(removed, known)
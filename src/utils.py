@@ -1,11 +1,20 @@
 import json
 import os
 import logging
-from setup_logging import setup_logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import orjson
+except ImportError:  # Optional: faster JSON codec
+    orjson = None
 
-setup_logging()
 logger = logging.getLogger(__name__)
 
+# Directories waiting for an fsync at the end of the current fsync_batch()
+_fsync_batch = threading.local()
+
 
 def load_json(path):
     """
@@ -15,24 +24,137 @@ def load_json(path):
     @return: The loaded JSON data as a dictionary or list, or None if an error occurs.
     """
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            content = f.read()
+        if orjson is not None:
+            return orjson.loads(content)
+        return json.loads(content)
 
     except Exception as e:
         logger.error(f"Error loading JSON from {path}: {e}")
         return None
 
 
-def save_json(data, path):
+def dump_json(data, compact=False):
+    """
+    Encode data as UTF-8 JSON.
+
+    @param data: The data to encode.
+    @param compact: Skip indentation and use the faster orjson codec if available.
+    @return: The encoded bytes.
+    """
+    if compact:
+        if orjson is not None:
+            return orjson.dumps(data)
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8"
+        )
+    return json.dumps(data, indent=4, ensure_ascii=False).encode("utf-8")
+
+
+def _fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def fsync_batch():
+    """
+    Group the directory fsyncs of the atomic writes done in this block.
+
+    Every file is still fsynced before being renamed in place, but each
+    directory is only fsynced once, when the block exits.
+    """
+    pending = getattr(_fsync_batch, "directories", None)
+    if pending is not None:
+        # Nested batch: the outermost one flushes
+        yield
+        return
+
+    _fsync_batch.directories = set()
+    try:
+        yield
+    finally:
+        directories = _fsync_batch.directories
+        _fsync_batch.directories = None
+        for directory in directories:
+            try:
+                _fsync_directory(directory)
+            except OSError as e:
+                logger.error(f"Error syncing directory {directory}: {e}")
+
+
+def _unchanged(content, path):
+    # Read from disk every time: in shard mode another worker may have
+    # rewritten the file since this process last wrote it
+    try:
+        if os.path.getsize(path) != len(content):
+            return False
+        with open(path, "rb") as f:
+            return f.read() == content
+    except OSError:
+        return False
+
+
+def atomic_write(content, path, durable=False):
+    """
+    Write bytes to a file atomically, skipping the write if nothing changed.
+
+    The content goes to a temporary file in the same directory, which is
+    fsynced and renamed over the target: a crash leaves either the old or the
+    new file, never a truncated one.
+
+    @param content: The bytes to write.
+    @param path: The target file path.
+    @param durable: Fsync the directory right away, even inside fsync_batch().
+    @return: True if the file was written, False if it already had this content.
+    """
+    if _unchanged(content, path):
+        return False
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    pending = getattr(_fsync_batch, "directories", None)
+    if pending is not None and not durable:
+        pending.add(directory)
+    else:
+        _fsync_directory(directory)
+
+    return True
+
+
+def save_json(data, path, compact=False, durable=False):
     """
     Save the given data to a JSON file at the specified path.
 
+    The file is replaced atomically and left untouched if its content did not
+    change.
+
     @param data: The data to save, as a dictionary or list.
     @param path: The file path where the JSON data should be saved.
+    @param compact: Write compact JSON instead of indented JSON.
+    @param durable: Make the write durable right away, see atomic_write.
     """
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        atomic_write(dump_json(data, compact=compact), path, durable=durable)
 
     except Exception as e:
         logger.error(f"Error saving JSON to {path}: {e}")
@@ -46,8 +168,7 @@ def save_file(data, path):
     @param path: The file path where the data should be saved.
     """
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(data)
+        atomic_write(data.encode("utf-8"), path)
 
     except Exception as e:
         logger.error(f"Error saving file to {path}: {e}")
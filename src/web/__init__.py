@@ -1 +1,9 @@
+import sys
+from pathlib import Path
 
+# The scraper modules import each other as top-level modules (they are run as
+# `python src/main.py`), so make `src/` importable the same way in the API,
+# which shares some of them.
+SRC_DIR = Path(__file__).resolve().parents[1]
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
@@ -1,17 +1,90 @@
 from __future__ import annotations
 
 import json
-from datetime import datetime, timezone
+import os
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Any
 
-from fastapi import FastAPI, HTTPException, Response
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
 from fastapi.staticfiles import StaticFiles
 
+# Scraper modules, importable as top-level modules (see __init__.py)
+from averages import compute_averages
+from grade_model import GradeSheet
+from metrics import (
+    REGISTRY,
+    STALE_SNAPSHOT_AGE,
+    merge_snapshots,
+    read_snapshots,
+    render_prometheus,
+)
+
+from .cache import CachedBody, GradesCache, HistoryStatsCache, dump_json
+from .events import EventBroker, listen_unix_socket, stream_events
+from .export import (
+    DEFAULT_BATCH_SIZE,
+    MAX_BATCH_SIZE,
+    MEDIA_TYPES,
+    available_formats,
+    stream_export,
+)
+from .query import MAX_LIMIT, StaleCursorError
+from . import stats
+
+# Clients may keep responses but must revalidate them with If-None-Match
+CACHE_CONTROL = "no-cache"
+PREFERRED_ENCODINGS = ("br", "gzip")
+
 BASE_DIR = Path(__file__).resolve().parents[2]
 DEFAULT_DATA_PATH = BASE_DIR / "src" / "data" / "new_grades.json"
 DEFAULT_STATIC_DIR = Path(__file__).resolve().parent / "static"
+DEFAULT_EVENTS_SOCKET = Path(
+    os.getenv("EVENTS_SOCKET") or BASE_DIR / "src" / "data" / "events.sock"
+)
+DEFAULT_METRICS_DIR = Path(os.getenv("METRICS_DIR") or BASE_DIR / "src" / "data" / "metrics")
+DEFAULT_DB_PATH = Path(os.getenv("GRADES_DB") or BASE_DIR / "src" / "data" / "grades.db")
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+request_seconds = REGISTRY.histogram(
+    "api_request_seconds", "Time spent handling API requests"
+)
+requests_total = REGISTRY.counter("api_requests_total", "API requests handled")
+
+
+class MetricsMiddleware:
+    """Count and time the HTTP requests, labelled by route template."""
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: dict) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            request_seconds.observe(time.perf_counter() - start, route=route)
+            requests_total.inc(route=route, status=status)
 
 
 def _parse_grades_file(data_path: Path) -> list[dict[str, Any]]:
@@ -63,96 +136,277 @@ def _to_float(value: Any) -> float | None:
 def flatten_grades(years: list[dict[str, Any]]) -> list[dict[str, Any]]:
     flattened: list[dict[str, Any]] = []
 
-    for year in years:
-        year_name = year.get("year_name", "")
-        for semester in year.get("semesters", []):
-            semester_name = semester.get("semester_name", "")
-            for module in semester.get("semester_modules", []):
-                module_name = module.get("module_name", "")
-                for course in module.get("module_courses", []):
-                    course_name = course.get("course_name", "")
-                    for grade_type in course.get("course_grades_type", []):
-                        type_name = grade_type.get("grade_type", "")
-                        type_coefficient = grade_type.get("coefficient")
-                        grades = grade_type.get("grades", [])
-
-                        if not grades:
-                            flattened.append(
-                                {
-                                    "year": year_name,
-                                    "semester": semester_name,
-                                    "module": module_name,
-                                    "course": course_name,
-                                    "grade_type": type_name,
-                                    "grade_value": None,
-                                    "grade_numeric": None,
-                                    "grade_coef": None,
-                                    "type_coefficient": type_coefficient,
-                                    "status": "pending",
-                                }
-                            )
-                            continue
-
-                        for entry in grades:
-                            raw_grade = entry.get("grade")
-                            numeric_grade = _to_float(raw_grade)
-                            status = (
-                                "numeric" if numeric_grade is not None else "status"
-                            )
-                            flattened.append(
-                                {
-                                    "year": year_name,
-                                    "semester": semester_name,
-                                    "module": module_name,
-                                    "course": course_name,
-                                    "grade_type": type_name,
-                                    "grade_value": raw_grade,
-                                    "grade_numeric": numeric_grade,
-                                    "grade_coef": entry.get("coef"),
-                                    "type_coefficient": type_coefficient,
-                                    "status": status,
-                                }
-                            )
+    for row in GradeSheet.from_years(years):
+        # Years, modules and courses without grade types are not listed
+        if row.grade_type is None:
+            continue
+
+        if row.grade is None:
+            grade_numeric = None
+            status = "pending"
+        else:
+            grade_numeric = _to_float(row.grade)
+            status = "numeric" if grade_numeric is not None else "status"
+
+        flattened.append(
+            {
+                "year": row.year,
+                "semester": row.semester,
+                "module": row.module,
+                "course": row.course,
+                "grade_type": row.grade_type,
+                "grade_value": row.grade,
+                "grade_numeric": grade_numeric,
+                "grade_coef": row.coef,
+                "type_coefficient": row.type_coefficient,
+                "status": status,
+            }
+        )
 
     return flattened
 
 
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def _accepted_encodings(accept_encoding: str | None) -> set[str]:
+    accepted: set[str] = set()
+
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name and quality > 0:
+            accepted.add(name.strip().lower())
+
+    return accepted
+
+
+def _cached_response(request: Request, cached: CachedBody) -> Response:
+    headers = {
+        "ETag": cached.etag,
+        "Cache-Control": CACHE_CONTROL,
+        "Vary": "Accept-Encoding",
+    }
+
+    if _etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return Response(status_code=304, headers=headers)
+
+    accepted = _accepted_encodings(request.headers.get("accept-encoding"))
+    for encoding in PREFERRED_ENCODINGS:
+        if (encoding in accepted or "*" in accepted) and cached.supports(encoding):
+            headers["Content-Encoding"] = encoding
+            return Response(
+                content=cached.encode(encoding),
+                media_type="application/json",
+                headers=headers,
+            )
+
+    return Response(content=cached.body, media_type="application/json", headers=headers)
+
+
+def _cache_metrics(cache: GradesCache) -> dict[str, Any]:
+    return {
+        "api_grades_cache_lookups_total": {
+            "type": "counter",
+            "help": "Lookups of the parsed grades file in the API cache",
+            "samples": {'result="hit"': cache.hits, 'result="miss"': cache.misses},
+        }
+    }
+
+
 def build_app(
     data_path: Path = DEFAULT_DATA_PATH,
     static_dir: Path = DEFAULT_STATIC_DIR,
+    events_socket: Path | None = DEFAULT_EVENTS_SOCKET,
+    metrics_dir: Path | None = DEFAULT_METRICS_DIR,
+    db_path: Path = DEFAULT_DB_PATH,
 ) -> FastAPI:
-    app = FastAPI(title="Grades Notifier UI API", version="1.0.0")
+    broker = EventBroker()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        transport = None
+        if events_socket is not None:
+            transport = await listen_unix_socket(broker, events_socket)
+        try:
+            yield
+        finally:
+            if transport is not None:
+                transport.close()
+                events_socket.unlink(missing_ok=True)
+
+    app = FastAPI(title="Grades Notifier UI API", version="1.0.0", lifespan=lifespan)
+    app.state.event_broker = broker
+    app.add_middleware(MetricsMiddleware)
+
+    cache = GradesCache(
+        data_path,
+        _parse_grades_file,
+        flatten_grades,
+        compute_averages,
+    )
+    app.state.grades_cache = cache
+    stats_cache = HistoryStatsCache(db_path, stats.compute_stats)
+    app.state.stats_cache = stats_cache
 
     @app.get("/api/grades")
-    def get_grades() -> dict[str, Any]:
-        years = _parse_grades_file(data_path)
-        return {"years": years, "flattened": flatten_grades(years)}
+    def get_grades(
+        request: Request,
+        year: str | None = None,
+        semester: str | None = None,
+        module: str | None = None,
+        q: str | None = None,
+        status: str | None = None,
+        limit: int | None = Query(default=None, ge=1, le=MAX_LIMIT),
+        cursor: str | None = None,
+        fields: str | None = None,
+        include_years: bool | None = None,
+    ) -> Response:
+        snapshot = cache.get()
+        filters = {"year": year, "semester": semester, "module": module, "status": status}
+        filtered = any(value is not None for value in filters.values()) or any(
+            (q, limit, cursor, fields)
+        )
+
+        # The unfiltered payload is pre-serialized, compressed and ETag-ed
+        if not filtered and include_years is not False:
+            return _cached_response(request, snapshot.grades_body)
+
+        selected_fields = None
+        if fields:
+            selected_fields = [field.strip() for field in fields.split(",") if field.strip()]
+            known = snapshot.flattened[0].keys() if snapshot.flattened else selected_fields
+            unknown = [field for field in selected_fields if field not in known]
+            if unknown:
+                raise HTTPException(
+                    status_code=400,
+                    detail={"message": f"Unknown fields: {', '.join(unknown)}"},
+                )
+
+        try:
+            result = snapshot.index.query(
+                filters,
+                search=q,
+                limit=limit,
+                cursor=cursor,
+                fields=selected_fields,
+            )
+        except StaleCursorError as e:
+            raise HTTPException(status_code=410, detail={"message": str(e)})
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail={"message": str(e)})
+        payload: dict[str, Any] = {
+            "flattened": result.rows,
+            "total": result.total,
+            "next_cursor": result.next_cursor,
+        }
+        if include_years:
+            payload["years"] = snapshot.years
+
+        return Response(content=dump_json(payload), media_type="application/json")
 
     @app.get("/api/meta")
-    def get_meta() -> dict[str, Any]:
-        years = _parse_grades_file(data_path)
-        flattened = flatten_grades(years)
-
-        if data_path.exists():
-            last_updated = datetime.fromtimestamp(
-                data_path.stat().st_mtime,
-                tz=timezone.utc,
-            ).isoformat()
-        else:
-            last_updated = None
-
-        return {
-            "last_updated": last_updated,
-            "filters": {
-                "years": sorted({row["year"] for row in flattened if row["year"]}),
-                "semesters": sorted(
-                    {row["semester"] for row in flattened if row["semester"]}
-                ),
-                "modules": sorted(
-                    {row["module"] for row in flattened if row["module"]}
-                ),
+    def get_meta(request: Request) -> Response:
+        return _cached_response(request, cache.get().meta_body)
+
+    @app.get("/api/averages")
+    def get_averages(request: Request) -> Response:
+        # Weighted averages per year, semester, module, course and grade type
+        return _cached_response(request, cache.get().averages_body)
+
+    @app.get("/api/stats")
+    def get_stats(request: Request) -> Response:
+        # Grade distribution of all accounts, computed on the first request
+        # after the history store changed
+        if not stats.available():
+            raise HTTPException(
+                status_code=501,
+                detail={"message": "Grade statistics need the optional numpy package"},
+            )
+        body = stats_cache.get()
+        if body is None:
+            raise HTTPException(
+                status_code=404,
+                detail={"message": f"Grades history not found: {db_path.as_posix()}"},
+            )
+        return _cached_response(request, body)
+
+    @app.get("/api/export")
+    def get_export(
+        format: str = "csv",
+        account: str | None = None,
+        year: str | None = None,
+        semester: str | None = None,
+        module: str | None = None,
+        batch_size: int = Query(default=DEFAULT_BATCH_SIZE, ge=1, le=MAX_BATCH_SIZE),
+    ) -> StreamingResponse:
+        # Streams the grades history store, not the current grades file
+        formats = available_formats()
+        if format not in formats:
+            raise HTTPException(
+                status_code=400,
+                detail={"message": f"Unsupported format: {format}", "formats": formats},
+            )
+        if not db_path.exists():
+            raise HTTPException(
+                status_code=404,
+                detail={"message": f"Grades history not found: {db_path.as_posix()}"},
+            )
+
+        filters = {"account": account, "year": year, "semester": semester, "module": module}
+        return StreamingResponse(
+            stream_export(db_path, format, filters, batch_size),
+            media_type=MEDIA_TYPES[format],
+            headers={
+                "Content-Disposition": f'attachment; filename="grades.{format}"',
+                "Cache-Control": "no-store",
             },
-        }
+        )
+
+    @app.get("/api/events")
+    async def get_events(request: Request) -> StreamingResponse:
+        last_event_id = request.headers.get("last-event-id")
+        try:
+            last_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_id = None
+
+        subscriber = broker.subscribe(last_id)
+        return StreamingResponse(
+            stream_events(broker, subscriber),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @app.get("/api/cache")
+    def get_cache_stats() -> dict[str, Any]:
+        return cache.stats()
+
+    @app.get("/metrics")
+    def get_metrics() -> PlainTextResponse:
+        # The scraper runs in its own process and shares its metrics as files
+        snapshots = [REGISTRY.snapshot(), _cache_metrics(cache)]
+        if metrics_dir is not None:
+            snapshots.extend(read_snapshots(str(metrics_dir), max_age=STALE_SNAPSHOT_AGE))
+
+        return PlainTextResponse(
+            render_prometheus(merge_snapshots(snapshots)),
+            media_type=PROMETHEUS_CONTENT_TYPE,
+        )
 
     assets_dir = static_dir / "assets"
     if assets_dir.exists():
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import gzip
+import json
+import hashlib
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+from .query import GradesQueryIndex
+
+try:
+    import brotli
+except ImportError:  # Optional: responses fall back to gzip
+    brotli = None
+
+
+def dump_json(payload: Any) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode(
+        "utf-8"
+    )
+
+
+class CachedBody:
+    """A serialized response body with its strong ETag and compressed variants."""
+
+    def __init__(self, body: bytes) -> None:
+        self.body = body
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self._encoded: dict[str, bytes] = {"identity": body}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def supports(encoding: str) -> bool:
+        if encoding == "br":
+            return brotli is not None
+        return encoding in ("gzip", "identity")
+
+    def encode(self, encoding: str) -> bytes:
+        """Return the body compressed with `encoding`, compressing it only once."""
+        encoded = self._encoded.get(encoding)
+        if encoded is not None:
+            return encoded
+
+        with self._lock:
+            encoded = self._encoded.get(encoding)
+            if encoded is None:
+                if encoding == "br":
+                    encoded = brotli.compress(self.body, quality=9)
+                elif encoding == "gzip":
+                    encoded = gzip.compress(self.body, compresslevel=6, mtime=0)
+                else:
+                    raise ValueError(f"Unsupported encoding: {encoding}")
+                self._encoded[encoding] = encoded
+
+        return encoded
+
+
+@dataclass(frozen=True)
+class GradesSnapshot:
+    """Everything the API serves for one generation of the grades file."""
+
+    generation: tuple[int, int]
+    years: list[dict[str, Any]]
+    flattened: list[dict[str, Any]]
+    filters: dict[str, list[str]]
+    index: GradesQueryIndex
+    last_updated: str
+    grades_body: CachedBody
+    meta_body: CachedBody
+    averages_body: CachedBody | None = None
+
+
+def build_filters(flattened: list[dict[str, Any]]) -> dict[str, list[str]]:
+    return {
+        "years": sorted({row["year"] for row in flattened if row["year"]}),
+        "semesters": sorted({row["semester"] for row in flattened if row["semester"]}),
+        "modules": sorted({row["module"] for row in flattened if row["module"]}),
+    }
+
+
+class GradesCache:
+    """
+    Memoize the parsed grades file, revalidated on its mtime and size.
+
+    A snapshot is built once per file generation: concurrent requests for a
+    new generation wait on the same lock and share the snapshot built by the
+    first one.
+    """
+
+    def __init__(
+        self,
+        data_path: Path,
+        parse: Callable[[Path], list[dict[str, Any]]],
+        flatten: Callable[[list[dict[str, Any]]], list[dict[str, Any]]],
+        averages: Callable[[list[dict[str, Any]]], dict[str, Any]] | None = None,
+    ) -> None:
+        self.data_path = data_path
+        self._parse = parse
+        self._flatten = flatten
+        self._averages = averages
+        self._snapshot: GradesSnapshot | None = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _generation(self) -> tuple[int, int] | None:
+        try:
+            stat = self.data_path.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self) -> GradesSnapshot:
+        generation = self._generation()
+        snapshot = self._snapshot
+        if generation is not None and snapshot is not None:
+            if snapshot.generation == generation:
+                self.hits += 1
+                return snapshot
+
+        with self._lock:
+            generation = self._generation()
+            snapshot = self._snapshot
+            if generation is not None and snapshot is not None:
+                if snapshot.generation == generation:
+                    self.hits += 1
+                    return snapshot
+
+            self.misses += 1
+            # Raises the API errors (missing file, invalid JSON) uncached
+            years = self._parse(self.data_path)
+            snapshot = self._build(generation or (0, 0), years)
+            self._snapshot = snapshot
+            return snapshot
+
+    def _build(
+        self, generation: tuple[int, int], years: list[dict[str, Any]]
+    ) -> GradesSnapshot:
+        flattened = self._flatten(years)
+        filters = build_filters(flattened)
+        last_updated = datetime.fromtimestamp(
+            generation[0] / 1e9, tz=timezone.utc
+        ).isoformat()
+
+        return GradesSnapshot(
+            generation=generation,
+            years=years,
+            flattened=flattened,
+            filters=filters,
+            index=GradesQueryIndex(flattened, generation),
+            last_updated=last_updated,
+            grades_body=CachedBody(dump_json({"years": years, "flattened": flattened})),
+            meta_body=CachedBody(
+                dump_json({"last_updated": last_updated, "filters": filters})
+            ),
+            averages_body=(
+                CachedBody(dump_json(self._averages(years)))
+                if self._averages is not None
+                else None
+            ),
+        )
+
+    def stats(self) -> dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "generation": list(snapshot.generation) if snapshot else None,
+        }
+
+
+class HistoryStatsCache:
+    """
+    Memoize a body computed from the grades history store.
+
+    The store runs in WAL mode, so its generation is the mtime and size of
+    both the database and its WAL file. The body is computed by the first
+    request after a change, never while nobody asks for it.
+    """
+
+    def __init__(self, db_path: Path, compute: Callable[[Path], Any]) -> None:
+        self.db_path = db_path
+        self._compute = compute
+        self._cached: tuple[tuple[int, ...], CachedBody] | None = None
+        self._lock = threading.Lock()
+        self.misses = 0
+
+    def _generation(self) -> tuple[int, ...] | None:
+        try:
+            stat = self.db_path.stat()
+        except FileNotFoundError:
+            return None
+        wal_generation = (0, 0)
+        try:
+            wal = Path(f"{self.db_path}-wal").stat()
+        except FileNotFoundError:
+            pass
+        else:
+            # Readers create an empty WAL when there is none
+            if wal.st_size:
+                wal_generation = (wal.st_mtime_ns, wal.st_size)
+        return (stat.st_mtime_ns, stat.st_size, *wal_generation)
+
+    def get(self) -> CachedBody | None:
+        """Return the body of the current generation, None without a store."""
+        generation = self._generation()
+        if generation is None:
+            return None
+
+        cached = self._cached
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+
+        with self._lock:
+            cached = self._cached
+            if cached is not None and cached[0] == generation:
+                return cached[1]
+            self.misses += 1
+            body = CachedBody(dump_json(self._compute(self.db_path)))
+            self._cached = (generation, body)
+            return body
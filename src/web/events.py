@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import os
+import json
+import asyncio
+import logging
+import socket
+from collections import deque
+from pathlib import Path
+from typing import Any, AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+REPLAY_SIZE = 256
+CLIENT_QUEUE_SIZE = 64
+HEARTBEAT_SECONDS = 15.0
+
+
+class Subscriber:
+    """One connected client: a bounded queue of events waiting to be sent."""
+
+    def __init__(self, maxsize: int = CLIENT_QUEUE_SIZE) -> None:
+        self.queue: asyncio.Queue[tuple[int, dict[str, Any]]] = asyncio.Queue(maxsize)
+        self.lagging = False
+
+    def offer(self, item: tuple[int, dict[str, Any]]) -> bool:
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.lagging = True
+            return False
+        return True
+
+
+class EventBroker:
+    """
+    Fan events out to connected clients, keeping the last ones for replay.
+
+    A client that does not keep up is disconnected instead of buffering
+    without limit: it reconnects with Last-Event-ID and catches up from the
+    replay buffer.
+    """
+
+    def __init__(
+        self, replay_size: int = REPLAY_SIZE, client_queue_size: int = CLIENT_QUEUE_SIZE
+    ) -> None:
+        self.replay: deque[tuple[int, dict[str, Any]]] = deque(maxlen=replay_size)
+        self.client_queue_size = client_queue_size
+        self.subscribers: set[Subscriber] = set()
+        self.last_id = 0
+
+    def publish(self, event: dict[str, Any]) -> int:
+        self.last_id += 1
+        item = (self.last_id, event)
+        self.replay.append(item)
+
+        for subscriber in list(self.subscribers):
+            if not subscriber.offer(item):
+                logger.warning("Dropping a slow event stream client")
+                self.subscribers.discard(subscriber)
+
+        return self.last_id
+
+    def subscribe(self, last_event_id: int | None = None) -> Subscriber:
+        subscriber = Subscriber(self.client_queue_size)
+
+        if last_event_id is not None:
+            for item in self.replay:
+                if item[0] > last_event_id and not subscriber.offer(item):
+                    break
+
+        if not subscriber.lagging:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+
+
+def format_sse(event_id: int, event: dict[str, Any]) -> bytes:
+    data = json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+    event_type = event.get("type", "message")
+    return f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n".encode("utf-8")
+
+
+async def stream_events(
+    broker: EventBroker,
+    subscriber: Subscriber,
+    heartbeat: float = HEARTBEAT_SECONDS,
+) -> AsyncIterator[bytes]:
+    """Yield Server-Sent Events for one client until it lags or disconnects."""
+    try:
+        yield b"retry: 3000\n\n"
+        while True:
+            if subscriber.queue.empty() and subscriber.lagging:
+                return
+            try:
+                event_id, event = await asyncio.wait_for(
+                    subscriber.queue.get(), timeout=heartbeat
+                )
+            except asyncio.TimeoutError:
+                yield b": keep-alive\n\n"
+                continue
+            yield format_sse(event_id, event)
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, broker: EventBroker) -> None:
+        self.broker = broker
+
+    def datagram_received(self, data: bytes, addr: Any) -> None:
+        try:
+            event = json.loads(data)
+        except ValueError:
+            logger.warning("Ignoring malformed event datagram")
+            return
+        if isinstance(event, dict):
+            self.broker.publish(event)
+
+
+async def listen_unix_socket(
+    broker: EventBroker, path: Path
+) -> asyncio.DatagramTransport:
+    """
+    Receive events published by the scraper on a Unix datagram socket.
+
+    @param broker: The broker the received events are published to.
+    @param path: Path of the socket file, replaced if it already exists.
+    @return: The transport; close it to stop listening.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        os.unlink(path)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(str(path))
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _DatagramProtocol(broker), sock=sock
+    )
+    return transport
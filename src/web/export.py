@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import io
+import csv
+import json
+import sqlite3
+from pathlib import Path
+from typing import Any, Iterator
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # Optional: only CSV and NDJSON exports are offered
+    pyarrow = None
+
+# Columns of the grades history table, in export order
+COLUMNS = (
+    "account",
+    "year",
+    "semester",
+    "module",
+    "course",
+    "grade_type",
+    "slot",
+    "type_coefficient",
+    "value",
+    "coef",
+    "first_seen",
+    "last_seen",
+)
+FILTERS = ("account", "year", "semester", "module")
+DEFAULT_BATCH_SIZE = 5000
+MAX_BATCH_SIZE = 100_000
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+COLUMNAR_FORMATS = ("arrow", "parquet")
+
+
+def available_formats() -> list[str]:
+    if pyarrow is None:
+        return [fmt for fmt in MEDIA_TYPES if fmt not in COLUMNAR_FORMATS]
+    return list(MEDIA_TYPES)
+
+
+def iter_batches(
+    db_path: Path, filters: dict[str, str | None], batch_size: int = DEFAULT_BATCH_SIZE
+) -> Iterator[list[tuple]]:
+    """
+    Read the grades history in batches of rows, in insertion order.
+
+    Each batch is its own short read, resuming after the last id of the
+    previous one on the primary key: no read transaction stays open while
+    the client consumes the stream, so the scraper's WAL checkpoints are
+    never held back by a slow download. Rows inserted during the export are
+    included if they come after the current position. A streamed response
+    advances the generator from any thread of the server pool, one step at a
+    time, so the connection is not tied to a thread.
+    """
+    clauses = ["id > ?"]
+    clauses += [f"{column} = ?" for column in FILTERS if filters.get(column) is not None]
+    params = [filters[column] for column in FILTERS if filters.get(column) is not None]
+    query = (
+        f"SELECT id, {', '.join(COLUMNS)} FROM grades"
+        f" WHERE {' AND '.join(clauses)} ORDER BY id LIMIT ?"
+    )
+
+    conn = sqlite3.connect(
+        f"{db_path.resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False
+    )
+    try:
+        last_id = 0
+        while True:
+            rows = conn.execute(query, [last_id, *params, batch_size]).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [row[1:] for row in rows]
+    finally:
+        conn.close()
+
+
+def _csv_chunks(batches: Iterator[list[tuple]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _ndjson_chunks(batches: Iterator[list[tuple]]) -> Iterator[bytes]:
+    for rows in batches:
+        yield "".join(
+            json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + "\n" for row in rows
+        ).encode("utf-8")
+
+
+class _ChunkSink:
+    """Writable file collecting what pyarrow writes, drained after each batch."""
+
+    def __init__(self) -> None:
+        self.chunks: list[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data: Any) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _arrow_schema():
+    types = {"slot": pyarrow.int64(), "type_coefficient": pyarrow.float64()}
+    return pyarrow.schema([(column, types.get(column, pyarrow.string())) for column in COLUMNS])
+
+
+def _columnar_chunks(batches: Iterator[list[tuple]], fmt: str) -> Iterator[bytes]:
+    schema = _arrow_schema()
+    sink = _ChunkSink()
+    stream = pyarrow.PythonFile(sink, mode="w")
+    if fmt == "arrow":
+        writer = pyarrow.ipc.new_stream(stream, schema)
+    else:
+        writer = pyarrow.parquet.ParquetWriter(stream, schema)
+
+    try:
+        for rows in batches:
+            columns = zip(*rows)
+            batch = pyarrow.record_batch(
+                [pyarrow.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema,
+            )
+            if fmt == "arrow":
+                writer.write_batch(batch)
+            else:
+                # One row group per batch
+                writer.write_table(pyarrow.Table.from_batches([batch]))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def stream_export(
+    db_path: Path,
+    fmt: str,
+    filters: dict[str, str | None] | None = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Iterator[bytes]:
+    """
+    Stream the grades history as CSV, NDJSON, Arrow IPC or Parquet.
+
+    Rows are read from the store and encoded one batch at a time, so memory
+    stays bounded by `batch_size` whatever the size of the history.
+
+    @param db_path: The grades history database written by the scraper.
+    @param fmt: One of available_formats().
+    @param filters: Optional account/year/semester/module equality filters.
+    @param batch_size: Rows read and encoded at once.
+    @return: An iterator of encoded chunks.
+    """
+    batches = iter_batches(db_path, filters or {}, batch_size)
+    if fmt == "csv":
+        return _csv_chunks(batches)
+    if fmt == "ndjson":
+        return _ndjson_chunks(batches)
+    return _columnar_chunks(batches, fmt)
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import hashlib
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Any
+
+FACETS = ("year", "semester", "module", "status")
+SEARCH_FIELDS = ("course", "module", "grade_type")
+MAX_LIMIT = 1000
+
+
+class StaleCursorError(ValueError):
+    """The cursor was issued for another generation of the grades."""
+
+
+@dataclass(frozen=True)
+class QueryResult:
+    rows: list[dict[str, Any]]
+    total: int
+    next_cursor: str | None
+
+
+class GradesQueryIndex:
+    """
+    Per-facet and search indexes over the flattened rows of one generation.
+
+    Each facet maps a value to the sorted positions of its rows, and the search
+    index holds the lowercased course/module/grade_type text of every row, so
+    a query only touches the rows of its most selective facet.
+    """
+
+    def __init__(
+        self, flattened: list[dict[str, Any]], generation: tuple[int, int] = (0, 0)
+    ) -> None:
+        self.rows = flattened
+        # Cursors are positions in this generation only: tag them with it
+        self.token = hashlib.blake2b(
+            repr(generation).encode(), digest_size=4
+        ).hexdigest()
+        self.facets: dict[str, dict[str, list[int]]] = {facet: {} for facet in FACETS}
+        self.search: list[str] = []
+
+        for position, row in enumerate(flattened):
+            for facet in FACETS:
+                self.facets[facet].setdefault(row[facet], []).append(position)
+            self.search.append(
+                "\n".join(str(row[field] or "") for field in SEARCH_FIELDS).lower()
+            )
+
+    def _positions(self, filters: dict[str, str | None]) -> list[int] | range:
+        selected = [
+            self.facets[facet].get(value, [])
+            for facet, value in filters.items()
+            if value is not None
+        ]
+        if not selected:
+            return range(len(self.rows))
+
+        selected.sort(key=len)
+        positions = selected[0]
+        for other in selected[1:]:
+            members = set(other)
+            positions = [position for position in positions if position in members]
+        return positions
+
+    def _decode_cursor(self, cursor: str | None) -> int:
+        if not cursor:
+            return 0
+        token, _, position = cursor.partition(".")
+        if not position.isdigit():
+            raise ValueError(f"Malformed cursor: {cursor!r}")
+        if token != self.token:
+            raise StaleCursorError(
+                "The grades changed since this cursor was issued, start over"
+            )
+        return int(position)
+
+    def query(
+        self,
+        filters: dict[str, str | None],
+        search: str | None = None,
+        limit: int | None = None,
+        cursor: str | None = None,
+        fields: list[str] | None = None,
+    ) -> QueryResult:
+        """
+        Select rows by facet values and search text, one page at a time.
+
+        @param filters: Facet name to wanted value, None meaning any value.
+        @param search: Case-insensitive text searched in course, module and
+            grade type.
+        @param limit: Maximum number of rows returned.
+        @param cursor: The next_cursor returned by the previous page.
+        @param fields: Keep only these keys in the returned rows.
+        @raise StaleCursorError: If the cursor belongs to another generation.
+        @raise ValueError: If the cursor is malformed.
+        """
+        start_position = self._decode_cursor(cursor)
+        positions = self._positions(filters)
+
+        needle = (search or "").strip().lower()
+        if needle:
+            positions = [
+                position for position in positions if needle in self.search[position]
+            ]
+
+        total = len(positions)
+        start = bisect_left(positions, start_position) if start_position else 0
+        end = total if limit is None else min(start + limit, total)
+        page = positions[start:end]
+
+        if fields:
+            rows = [{field: self.rows[p][field] for field in fields} for p in page]
+        else:
+            rows = [self.rows[p] for p in page]
+
+        next_cursor = f"{self.token}.{positions[end]}" if end < total else None
+        return QueryResult(rows=rows, total=total, next_cursor=next_cursor)
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import sqlite3
+import importlib.util
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+# numpy is optional, /api/stats is disabled without it. It is imported on
+# first use, as it would double the import time of the API
+
+PASS_MARK = 10.0
+HISTOGRAM_BINS = 20
+PERCENTILES = (10, 25, 50, 75, 90)
+
+# The grades currently on each account's page: the rows seen by its last
+# recorded cycle (see TOUCH in grades_store)
+CURRENT_GRADES = """
+SELECT g.account, g.year, g.semester, g.module, g.value, g.coef, g.type_coefficient
+FROM grades AS g
+JOIN (
+    SELECT account, max(last_seen) AS last_seen FROM grades GROUP BY account
+) AS latest ON g.account = latest.account AND g.last_seen = latest.last_seen
+"""
+
+
+def available() -> bool:
+    return importlib.util.find_spec("numpy") is not None
+
+
+def _float_array(values: list[Any]) -> "numpy.ndarray":
+    """Convert a column to float64, None and unparseable values becoming NaN."""
+    import numpy
+
+    try:
+        # Converts numbers, numeric strings and None in one pass
+        return numpy.array(values, dtype=numpy.float64)
+    except (TypeError, ValueError):
+        return numpy.array([_to_number(value) for value in values], dtype=numpy.float64)
+
+
+def _to_number(value: Any) -> float:
+    if value is None:
+        return float("nan")
+    try:
+        return float(str(value).replace(",", "."))
+    except ValueError:
+        return float("nan")
+
+
+def _categories(values: list[Any]) -> tuple[list[str], "numpy.ndarray"]:
+    import numpy
+
+    labels, codes = numpy.unique(
+        numpy.array([value or "" for value in values], dtype=object), return_inverse=True
+    )
+    return [str(label) for label in labels], codes.astype(numpy.int32)
+
+
+@dataclass(frozen=True)
+class GradeArrays:
+    """
+    The current grades of every account as typed column arrays.
+
+    Values, coefs and type coefficients are float64 with NaN for missing
+    ones; values outside 0-20 (statuses like "Validé") are NaN too.
+    Accounts, years, semesters and modules are stored as int32 codes into
+    their sorted labels.
+    """
+
+    value: "numpy.ndarray"
+    coef: "numpy.ndarray"
+    type_coefficient: "numpy.ndarray"
+    account: "numpy.ndarray"
+    year: "numpy.ndarray"
+    semester: "numpy.ndarray"
+    module: "numpy.ndarray"
+    accounts: list[str]
+    years: list[str]
+    semesters: list[str]
+    modules: list[str]
+
+    @classmethod
+    def from_rows(cls, rows: list[tuple]) -> "GradeArrays":
+        """
+        @param rows: (account, year, semester, module, value, coef,
+            type_coefficient) tuples, as selected by CURRENT_GRADES.
+        """
+        import numpy
+
+        columns = list(zip(*rows)) if rows else [()] * 7
+        accounts, account = _categories(list(columns[0]))
+        years, year = _categories(list(columns[1]))
+        semesters, semester = _categories(list(columns[2]))
+        modules, module = _categories(list(columns[3]))
+
+        value = _float_array(list(columns[4]))
+        with numpy.errstate(invalid="ignore"):
+            value[(value < 0) | (value > 20)] = numpy.nan
+
+        return cls(
+            value=value,
+            coef=_float_array(list(columns[5])),
+            type_coefficient=_float_array(list(columns[6])),
+            account=account,
+            year=year,
+            semester=semester,
+            module=module,
+            accounts=accounts,
+            years=years,
+            semesters=semesters,
+            modules=modules,
+        )
+
+    @classmethod
+    def from_store(cls, db_path: Path) -> "GradeArrays":
+        """Load the current grades of every account from the history store."""
+        conn = sqlite3.connect(f"{db_path.resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            return cls.from_rows(conn.execute(CURRENT_GRADES).fetchall())
+        finally:
+            conn.close()
+
+    @property
+    def weight(self) -> "numpy.ndarray":
+        """Weight of each grade: its coef times the coefficient of its grade type."""
+        return self.coef * self.type_coefficient
+
+
+def _round(value: float) -> float | None:
+    import numpy
+
+    return None if numpy.isnan(value) else round(float(value), 2)
+
+
+def _summary(values: "numpy.ndarray", weights: "numpy.ndarray") -> dict[str, Any]:
+    import numpy
+
+    if not len(values):
+        return {
+            "count": 0,
+            "mean": None,
+            "weighted_mean": None,
+            "pass_ratio": None,
+            "percentiles": None,
+        }
+    percentiles = numpy.percentile(values, PERCENTILES)
+    # Grades without a coef or a grade type coefficient are left out
+    weighted = weights > 0
+    return {
+        "count": int(len(values)),
+        "mean": _round(values.mean()),
+        "weighted_mean": (
+            _round(numpy.average(values[weighted], weights=weights[weighted]))
+            if weighted.any()
+            else None
+        ),
+        "pass_ratio": _round((values >= PASS_MARK).mean()),
+        "percentiles": {f"p{p}": _round(v) for p, v in zip(PERCENTILES, percentiles)},
+    }
+
+
+def compute_stats(db_path: Path) -> dict[str, Any]:
+    """
+    Distribution statistics of the current numeric grades of all accounts,
+    for /api/stats.
+
+    @param db_path: The grades history database written by the scraper.
+    @return: The overall summary, a 0-20 histogram and one summary per
+        (year, semester, module).
+    """
+    import numpy
+
+    arrays = GradeArrays.from_store(db_path)
+    graded = ~numpy.isnan(arrays.value)
+    values = arrays.value[graded]
+    weights = numpy.nan_to_num(arrays.weight[graded], nan=0.0)
+
+    counts, edges = numpy.histogram(values, bins=HISTOGRAM_BINS, range=(0, 20))
+
+    # Group the numeric grades by module: sort by module key, then cut the
+    # sorted values where the key changes
+    keys = numpy.stack(
+        [arrays.year[graded], arrays.semester[graded], arrays.module[graded]], axis=1
+    )
+    modules = []
+    if len(values):
+        groups, group = numpy.unique(keys, axis=0, return_inverse=True)
+        group = group.reshape(-1)
+        order = numpy.argsort(group, kind="stable")
+        bounds = numpy.searchsorted(group[order], numpy.arange(len(groups) + 1))
+        sorted_values = values[order]
+        sorted_weights = weights[order]
+        for (year, semester, module), start, end in zip(groups, bounds[:-1], bounds[1:]):
+            modules.append(
+                {
+                    "year": arrays.years[year],
+                    "semester": arrays.semesters[semester],
+                    "module": arrays.modules[module],
+                    **_summary(sorted_values[start:end], sorted_weights[start:end]),
+                }
+            )
+
+    return {
+        "rows": len(arrays.value),
+        "accounts": len(numpy.unique(arrays.account[graded])),
+        **_summary(values, weights),
+        "pass_mark": PASS_MARK,
+        "histogram": {
+            "edges": [float(edge) for edge in edges],
+            "counts": [int(count) for count in counts],
+        },
+        "modules": modules,
+    }
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import pytest
 from fastapi.testclient import TestClient
 
 from src.web.api import build_app
@@ -87,3 +90,398 @@ def test_api_meta_filters(tmp_path: Path) -> None:
     assert body["filters"]["years"] == ["Y1"]
     assert body["filters"]["semesters"] == ["S1"]
     assert body["filters"]["modules"] == ["M1"]
+
+
+def test_api_grades_cache_revalidates_on_change(tmp_path: Path) -> None:
+    grades_file = tmp_path / "new_grades.json"
+    write_grades(grades_file)
+    client = TestClient(build_app(data_path=grades_file, static_dir=tmp_path / "static"))
+
+    first = client.get("/api/grades").json()
+    client.get("/api/meta")
+    assert client.get("/api/cache").json()["misses"] == 1
+    assert client.get("/api/cache").json()["hits"] == 1
+
+    payload = json.loads(grades_file.read_text(encoding="latin"))
+    payload[0]["year_name"] = "Y2"
+    grades_file.write_text(json.dumps(payload), encoding="latin")
+    stat = grades_file.stat()
+    os.utime(grades_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    second = client.get("/api/grades").json()
+    assert first["flattened"][0]["year"] == "Y1"
+    assert second["flattened"][0]["year"] == "Y2"
+    assert client.get("/api/meta").json()["filters"]["years"] == ["Y2"]
+    assert client.get("/api/cache").json()["misses"] == 2
+
+
+def test_grades_cache_builds_generation_once(tmp_path: Path) -> None:
+    grades_file = tmp_path / "new_grades.json"
+    write_grades(grades_file)
+    app = build_app(data_path=grades_file, static_dir=tmp_path / "static")
+    cache = app.state.grades_cache
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        snapshots = list(pool.map(lambda _: cache.get(), range(32)))
+
+    assert len({id(snapshot) for snapshot in snapshots}) == 1
+    assert cache.misses == 1
+
+
+def test_api_grades_etag_not_modified(tmp_path: Path) -> None:
+    grades_file = tmp_path / "new_grades.json"
+    write_grades(grades_file)
+    client = TestClient(build_app(data_path=grades_file, static_dir=tmp_path / "static"))
+
+    response = client.get("/api/grades")
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"] == "no-cache"
+
+    cached = client.get("/api/grades", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["etag"] == etag
+
+    meta = client.get("/api/meta", headers={"If-None-Match": etag})
+    assert meta.status_code == 200
+    assert meta.headers["etag"] != etag
+
+
+def test_api_grades_compressed_once(tmp_path: Path) -> None:
+    grades_file = tmp_path / "new_grades.json"
+    write_grades(grades_file)
+    app = build_app(data_path=grades_file, static_dir=tmp_path / "static")
+    client = TestClient(app)
+
+    gzipped = client.get("/api/grades", headers={"Accept-Encoding": "gzip"})
+    plain = client.get("/api/grades", headers={"Accept-Encoding": "identity"})
+
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert "content-encoding" not in plain.headers
+    assert gzipped.json() == plain.json()
+    assert gzipped.headers["vary"] == "Accept-Encoding"
+
+    cached = app.state.grades_cache.get().grades_body
+    assert cached.encode("gzip") is cached.encode("gzip")
+
+
+SNAPSHOT = Path(__file__).resolve().parents[1] / "src" / "data" / "new_grades.json"
+
+
+def snapshot_client(tmp_path: Path) -> TestClient:
+    grades_file = tmp_path / "new_grades.json"
+    grades_file.write_text(SNAPSHOT.read_text(encoding="utf-8"), encoding="utf-8")
+    return TestClient(build_app(data_path=grades_file, static_dir=tmp_path / "static"))
+
+
+def test_api_grades_server_side_filters(tmp_path: Path) -> None:
+    client = snapshot_client(tmp_path)
+    everything = client.get("/api/grades").json()["flattened"]
+    module = everything[0]["module"]
+
+    body = client.get("/api/grades", params={"module": module, "status": "numeric"}).json()
+
+    expected = [
+        row for row in everything if row["module"] == module and row["status"] == "numeric"
+    ]
+    assert "years" not in body
+    assert body["flattened"] == expected
+    assert body["total"] == len(expected)
+
+    search = everything[0]["course"].split()[0].upper()
+    found = client.get("/api/grades", params={"q": search}).json()["flattened"]
+    assert found == [
+        row
+        for row in everything
+        if search.lower() in f"{row['course']}\n{row['module']}\n{row['grade_type']}".lower()
+    ]
+
+
+def test_api_grades_pagination_and_projection(tmp_path: Path) -> None:
+    client = snapshot_client(tmp_path)
+    everything = client.get("/api/grades").json()["flattened"]
+
+    pages: list[dict] = []
+    params: dict = {"limit": 7, "fields": "course,grade_value"}
+    while True:
+        body = client.get("/api/grades", params=params).json()
+        pages.extend(body["flattened"])
+        if body["next_cursor"] is None:
+            break
+        params["cursor"] = body["next_cursor"]
+
+    assert pages == [
+        {"course": row["course"], "grade_value": row["grade_value"]} for row in everything
+    ]
+
+    unknown = client.get("/api/grades", params={"fields": "course,password"})
+    assert unknown.status_code == 400
+
+
+def test_api_grades_cursor_expires_with_generation(tmp_path: Path) -> None:
+    client = snapshot_client(tmp_path)
+    cursor = client.get("/api/grades", params={"limit": 7}).json()["next_cursor"]
+    assert client.get("/api/grades", params={"cursor": cursor}).status_code == 200
+
+    grades_file = tmp_path / "new_grades.json"
+    stat = grades_file.stat()
+    os.utime(grades_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    stale = client.get("/api/grades", params={"cursor": cursor})
+    assert stale.status_code == 410
+    assert client.get("/api/grades", params={"cursor": "garbage"}).status_code == 400
+
+
+def test_api_grades_years_block_optional(tmp_path: Path) -> None:
+    client = snapshot_client(tmp_path)
+
+    without = client.get("/api/grades", params={"include_years": "false"}).json()
+    with_years = client.get("/api/grades", params={"limit": 1, "include_years": "true"}).json()
+
+    assert "years" not in without
+    assert len(without["flattened"]) == without["total"]
+    assert with_years["years"]
+    assert len(with_years["flattened"]) == 1
+
+
+def test_api_metrics_include_scraper_snapshots(tmp_path: Path) -> None:
+    from metrics import Registry
+
+    grades_file = tmp_path / "new_grades.json"
+    metrics_dir = tmp_path / "metrics"
+    write_grades(grades_file)
+
+    scraper = Registry()
+    scraper.counter("grades_new_total", "New grades found").inc(3, account="alice")
+    scraper.write(str(metrics_dir / "scraper.json"))
+
+    client = TestClient(
+        build_app(data_path=grades_file, static_dir=tmp_path, metrics_dir=metrics_dir)
+    )
+    client.get("/api/grades")
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'grades_new_total{account="alice"} 3' in response.text
+    assert 'api_requests_total{route="/api/grades",status="200"}' in response.text
+    assert 'api_grades_cache_lookups_total{result="miss"} 1' in response.text
+
+
+def test_api_averages_cached_per_generation(tmp_path: Path) -> None:
+    grades_file = tmp_path / "new_grades.json"
+    write_grades(grades_file)
+    client = TestClient(build_app(data_path=grades_file, static_dir=tmp_path / "static"))
+
+    response = client.get("/api/averages")
+    year = response.json()["years"][0]
+    assert year["name"] == "Y1"
+    assert year["average"] == 15.0
+    assert year["semesters"][0]["modules"][0]["courses"][0]["grade_types"][0]["average"] == 15.0
+
+    cached = client.get("/api/averages", headers={"If-None-Match": response.headers["etag"]})
+    assert cached.status_code == 304
+    assert client.get("/api/cache").json()["misses"] == 1
+
+
+def write_history(path: Path) -> None:
+    from grades_store import GradesStore
+
+    store = GradesStore(str(path))
+    for account in ("alice", "bob"):
+        for day in ("2025-01-10", "2025-02-10"):
+            years = json.loads(json.dumps(EXPORT_YEARS).replace("DAY", day))
+            store.record_cycle(account, years, seen_at=f"{day}T08:00:00+00:00")
+    store.close()
+
+
+EXPORT_YEARS = [
+    {
+        "year_name": "Y1",
+        "semesters": [
+            {
+                "semester_name": "S1",
+                "semester_modules": [
+                    {
+                        "module_name": "M1",
+                        "module_courses": [
+                            {
+                                "course_name": "Course A",
+                                "course_ponderation": 2.0,
+                                "course_grades_type": [
+                                    {
+                                        "grade_type": "Exam",
+                                        "coefficient": 60.0,
+                                        "grades": [{"grade": "DAY", "coef": "100"}],
+                                    }
+                                ],
+                            }
+                        ],
+                    }
+                ],
+            }
+        ],
+    }
+]
+
+
+def test_api_export_streams_csv_and_ndjson(tmp_path: Path) -> None:
+    db_path = tmp_path / "grades.db"
+    write_history(db_path)
+    client = TestClient(
+        build_app(data_path=tmp_path / "new_grades.json", static_dir=tmp_path / "static", db_path=db_path)
+    )
+
+    response = client.get("/api/export", params={"batch_size": 1})
+    assert response.headers["content-type"] == "text/csv; charset=utf-8"
+    lines = response.text.splitlines()
+    assert lines[0].startswith("account,year,semester,module,course")
+    assert len(lines) == 5
+    assert lines[1].split(",")[:2] == ["alice", "Y1"]
+
+    response = client.get("/api/export", params={"format": "ndjson", "account": "bob"})
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["value"] for row in rows] == ["2025-01-10", "2025-02-10"]
+    assert rows[0]["type_coefficient"] == 60.0
+
+
+def test_export_batches_resume_in_other_threads(tmp_path: Path) -> None:
+    from src.web.export import iter_batches
+
+    db_path = tmp_path / "grades.db"
+    write_history(db_path)
+    # The server runs every step of a streamed export in any thread of its pool
+    exports = [iter_batches(db_path, {}, batch_size=1) for _ in range(8)]
+    rows: list[list[tuple]] = [[] for _ in exports]
+
+    for _ in range(5):
+        with ThreadPoolExecutor(max_workers=len(exports)) as pool:
+            steps = [pool.submit(next, batches, []) for batches in exports]
+        for export_rows, step in zip(rows, steps):
+            export_rows.extend(step.result())
+
+    assert all(len(export_rows) == 4 for export_rows in rows)
+    assert rows[0] == rows[-1]
+
+
+def test_export_holds_no_transaction_between_batches(tmp_path: Path) -> None:
+    import sqlite3
+
+    from src.web.export import iter_batches
+
+    db_path = tmp_path / "grades.db"
+    write_history(db_path)
+    batches = iter_batches(db_path, {"account": "alice"}, batch_size=1)
+    first = next(batches)
+
+    # A paused download must not stop the scraper's WAL from being checkpointed
+    writer = sqlite3.connect(db_path)
+    with writer:
+        writer.execute(
+            "UPDATE grades SET last_seen = '2025-03-10T08:00:00+00:00' WHERE account = 'bob'"
+        )
+    busy, _, _ = writer.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    writer.close()
+    assert busy == 0
+
+    assert [row[-2] for row in [*first, *sum(batches, [])]] == [
+        "2025-01-10T08:00:00+00:00",
+        "2025-02-10T08:00:00+00:00",
+    ]
+
+
+def test_api_export_errors(tmp_path: Path) -> None:
+    client = TestClient(
+        build_app(
+            data_path=tmp_path / "new_grades.json",
+            static_dir=tmp_path / "static",
+            db_path=tmp_path / "missing.db",
+        )
+    )
+
+    assert client.get("/api/export").status_code == 404
+    response = client.get("/api/export", params={"format": "xlsx"})
+    assert response.status_code == 400
+    assert "csv" in response.json()["detail"]["formats"]
+
+
+def test_api_export_arrow(tmp_path: Path) -> None:
+    pyarrow = pytest.importorskip("pyarrow")
+    db_path = tmp_path / "grades.db"
+    write_history(db_path)
+    client = TestClient(
+        build_app(data_path=tmp_path / "new_grades.json", static_dir=tmp_path / "static", db_path=db_path)
+    )
+
+    response = client.get("/api/export", params={"format": "arrow", "batch_size": 3})
+    table = pyarrow.ipc.open_stream(response.content).read_all()
+
+    assert table.num_rows == 4
+    assert table.column("account").to_pylist() == ["alice", "bob", "alice", "bob"]
+
+
+def write_graded_history(path: Path) -> None:
+    from grades_store import GradesStore
+
+    store = GradesStore(str(path))
+    cycles = (
+        ("alice", "2025-01-10", [("12", "100", 60.0)]),
+        # Corrected: only the new value is current
+        ("alice", "2025-02-10", [("16", "100", 60.0), ("Validé", "100", 40.0)]),
+        ("bob", "2025-01-10", [("8", "50", 60.0), ("4", "50", 60.0)]),
+    )
+    for account, day, grades in cycles:
+        years = json.loads(json.dumps(EXPORT_YEARS))
+        grade_types = years[0]["semesters"][0]["semester_modules"][0]["module_courses"][0][
+            "course_grades_type"
+        ]
+        grade_types[:] = [
+            {
+                "grade_type": f"Type {index}",
+                "coefficient": coefficient,
+                "grades": [{"grade": value, "coef": coef}],
+            }
+            for index, (value, coef, coefficient) in enumerate(grades)
+        ]
+        store.record_cycle(account, years, seen_at=f"{day}T08:00:00+00:00")
+    store.close()
+
+
+def test_api_stats(tmp_path: Path) -> None:
+    pytest.importorskip("numpy")
+    db_path = tmp_path / "grades.db"
+    app = build_app(
+        data_path=tmp_path / "new_grades.json", static_dir=tmp_path / "static", db_path=db_path
+    )
+    client = TestClient(app)
+
+    assert client.get("/api/stats").status_code == 404
+
+    write_graded_history(db_path)
+    assert app.state.stats_cache.misses == 0
+
+    response = client.get("/api/stats")
+    stats = response.json()
+
+    assert stats["accounts"] == 2
+    assert stats["rows"] == 4
+    assert stats["count"] == 3 == sum(stats["histogram"]["counts"])
+    assert stats["mean"] == round((16 + 8 + 4) / 3, 2)
+    assert stats["weighted_mean"] == round((16 * 100 + 8 * 50 + 4 * 50) / 200, 2)
+    assert stats["pass_ratio"] == round(1 / 3, 2)
+    module = stats["modules"][0]
+    assert module["count"] == 3
+    assert module["percentiles"]["p10"] <= module["percentiles"]["p50"] <= module["percentiles"]["p90"]
+
+    cached = client.get("/api/stats", headers={"If-None-Match": response.headers["etag"]})
+    assert cached.status_code == 304
+    assert app.state.stats_cache.misses == 1
+
+    # A new cycle in the store is a new generation
+    from grades_store import GradesStore
+
+    store = GradesStore(str(db_path))
+    store.touch("bob", seen_at="2025-03-10T08:00:00+00:00")
+    store.close()
+    assert client.get("/api/stats").json()["count"] == 3
+    assert app.state.stats_cache.misses == 2
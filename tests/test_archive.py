@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import io
+import json
+import logging
+from pathlib import Path
+
+import pytest
+
+from archive import CaptureArchive
+from benchmarks.portal import drop_grades, generate_years, render_portal
+from parse_pool import ParsePool
+from replay import main as replay_main, replay_account
+
+
+def test_records_are_appended_per_day(tmp_path: Path) -> None:
+    archive = CaptureArchive(str(tmp_path))
+    archive.append("alice", "https://portal/notes", 200, "<p>1</p>", captured_at="2024-01-31T23:59:00+00:00")
+    archive.append("alice", "https://portal/notes", 200, "<p>2</p>", captured_at="2024-02-01T00:01:00+00:00")
+    archive.append("alice", "https://portal/notes", 200, "<p>3</p>", captured_at="2024-02-01T08:00:00+00:00")
+
+    assert archive.accounts() == ["alice"]
+    assert [record["html"] for record in archive.records("alice")] == ["<p>1</p>", "<p>2</p>", "<p>3</p>"]
+    assert len(list(archive.records("alice", since="2024-02-01"))) == 2
+    assert len(list(archive.records("alice", until="2024-01-31"))) == 1
+    assert list(archive.records("bob")) == []
+
+
+def test_torn_last_record_is_skipped(tmp_path: Path) -> None:
+    archive = CaptureArchive(str(tmp_path))
+    archive.append("alice", "u", 200, "complete", captured_at="2024-02-01T08:00:00+00:00")
+    path = archive.append("alice", "u", 200, "torn" * 100, captured_at="2024-02-01T09:00:00+00:00")
+    data = Path(path).read_bytes()
+    Path(path).write_bytes(data[:-20])
+
+    assert [record["html"] for record in archive.records("alice")] == ["complete"]
+
+
+def test_replay_emits_the_notifications_that_would_have_fired(tmp_path: Path) -> None:
+    years = generate_years(1, modules=2, seed=1)
+    archive = CaptureArchive(str(tmp_path))
+    pages = [render_portal(drop_grades(years, every=3)), render_portal(drop_grades(years, every=3)), render_portal(years)]
+    for hour, html in enumerate(pages):
+        archive.append("alice", "u", 200, html, captured_at=f"2024-02-01T0{hour}:00:00+00:00")
+
+    out = io.StringIO()
+    pages_count, size, notifications, failed = replay_account(archive, "alice", ParsePool(workers=1), out)
+
+    assert (pages_count, notifications, failed) == (3, 1, 0)
+    assert size == sum(len(html) for html in pages)
+    event = json.loads(out.getvalue())
+    assert event["at"] == "2024-02-01T02:00:00+00:00"
+    assert event["notification"]["topic"] == "alice"
+    assert event["grades"]
+    # Averages are computed as the scraper does
+    assert any("average" in grade for grade in event["grades"])
+
+
+def test_replay_skips_pages_that_fail_to_parse(tmp_path: Path, caplog: pytest.LogCaptureFixture) -> None:
+    years = generate_years(1, modules=2, seed=1)
+    archive = CaptureArchive(str(tmp_path))
+    pages = [render_portal(drop_grades(years, every=3)), "<html>maintenance</html>", render_portal(years)]
+    for hour, html in enumerate(pages):
+        archive.append("alice", "u", 200, html, captured_at=f"2024-02-01T0{hour}:00:00+00:00")
+
+    out = io.StringIO()
+    with caplog.at_level(logging.WARNING, logger="replay"):
+        pages_count, _, notifications, failed = replay_account(
+            archive, "alice", ParsePool(workers=1), out
+        )
+
+    assert (pages_count, notifications, failed) == (3, 1, 1)
+    assert "page 1 captured at 2024-02-01T01:00:00+00:00" in caplog.text
+    assert json.loads(out.getvalue())["at"] == "2024-02-01T02:00:00+00:00"
+
+
+def test_replay_cli(tmp_path: Path, capsys) -> None:
+    archive = CaptureArchive(str(tmp_path))
+    archive.append("alice", "u", 200, render_portal(generate_years(1, modules=1)))
+
+    replay_main(["--archive", str(tmp_path), "--workers", "1", "--notify-initial"])
+
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])["account"] == "alice"
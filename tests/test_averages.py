@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+
+from averages import AveragesEngine, compute_averages
+from get_new_grades import format_grades
+from grade_model import GradeSheet, GradeSheetBuilder
+from notifier import build_notification
+from tree_diff import ADDED, GradeEvent, GradeSlot
+
+SNAPSHOT = Path(__file__).resolve().parents[1] / "src" / "data" / "new_grades.json"
+
+
+def build_sheet(extra_exam=None):
+    builder = GradeSheetBuilder()
+    builder.year("ING2")
+    builder.semester("S1")
+    builder.module("Maths")
+    builder.course("Analyse", 2.0)
+    builder.grade_type("DE", 60.0, [("10", "50"), ("14", "50")])
+    builder.grade_type("CC", 40.0, [("15", "100")])
+    builder.course("Algebre", 1.0)
+    builder.grade_type("DE", 100.0, [("9", "100")] + ([extra_exam] if extra_exam else []))
+    builder.module("Langues")
+    builder.course("Anglais", 1.0)
+    builder.grade_type("Oral", 100.0, [("Validé", "100")])
+    return builder.build()
+
+
+def test_weighted_averages() -> None:
+    years = compute_averages(build_sheet())["years"]
+
+    module = years[0]["semesters"][0]["modules"][0]
+    analyse, algebre = module["courses"]
+    # DE: (10 + 14) / 2 = 12, CC: 15 -> 12 * 0.6 + 15 * 0.4
+    assert analyse["average"] == 13.2
+    assert [grade_type["average"] for grade_type in analyse["grade_types"]] == [12, 15]
+    assert algebre["average"] == 9
+    # Courses weighted by their ponderation: (13.2 * 2 + 9) / 3
+    assert module["average"] == 11.8
+    assert years[0]["average"] == 11.8
+    # Statuses are not grades
+    assert years[0]["semesters"][0]["modules"][1]["average"] is None
+
+
+def test_new_grade_only_updates_its_ancestors() -> None:
+    engine = AveragesEngine(build_sheet())
+    analyse = engine.root.children["ING2"].children["S1"].children["Maths"].children["Analyse"]
+
+    added = engine.sync(build_sheet(extra_exam=("13", "100")))
+
+    assert [row.grade for row in added] == ["13"]
+    assert analyse.average == pytest.approx(13.2)
+    assert engine.to_dict() == compute_averages(build_sheet(extra_exam=("13", "100")))
+
+    row = added[0]
+    updated = engine.add(row)
+    assert [node.name for node in updated] == ["DE", "Algebre", "Maths", "S1", "ING2", None]
+
+
+def test_sync_rebuilds_on_corrections() -> None:
+    engine = AveragesEngine(build_sheet(extra_exam=("13", "100")))
+
+    assert engine.sync(build_sheet(extra_exam=("12", "100"))) != []
+    assert engine.to_dict() == compute_averages(build_sheet(extra_exam=("12", "100")))
+    assert engine.sync(build_sheet(extra_exam=("12", "100"))) == []
+
+
+def test_snapshot_averages_are_incremental() -> None:
+    years = json.loads(SNAPSHOT.read_text(encoding="utf-8"))
+    engine = AveragesEngine()
+
+    engine.sync(build_sheet())
+    engine.sync(GradeSheet())
+    engine.sync(GradeSheet.from_years(years))
+
+    assert engine.to_dict() == compute_averages(years)
+
+
+def test_notification_shows_course_average() -> None:
+    slot = GradeSlot("ING2", "S1", "Maths", "Analyse / Analysis", "DE", 0)
+    grades = format_grades([GradeEvent(ADDED, slot, None, ("14", "50"))], {slot[:4]: 13.234})
+
+    assert grades == [{"title": "Analyse - DE", "details": "14 - 50%", "average": 13.23}]
+    assert build_notification(grades, "topic", None)["message"] == "14 - 50%\nNew average: 13.23"
+
+
+def test_course_averages_are_keyed_by_path() -> None:
+    builder = GradeSheetBuilder()
+    for year, grade in (("ING1", "8"), ("ING2", "16")):
+        builder.year(year)
+        builder.semester("S1")
+        builder.module("Langues")
+        builder.course("Anglais", 1.0)
+        builder.grade_type("Oral", 100.0, [(grade, "100")])
+    engine = AveragesEngine(builder.build())
+
+    assert engine.course_averages() == {
+        ("ING1", "S1", "Langues", "Anglais"): 8,
+        ("ING2", "S1", "Langues", "Anglais"): 16,
+    }
+
+    slot = GradeSlot("ING1", "S1", "Langues", "Anglais", "Oral", 0)
+    grades = format_grades([GradeEvent(ADDED, slot, None, ("8", "100"))], engine.course_averages())
+    assert grades[0]["average"] == 8
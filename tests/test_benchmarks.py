@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from benchmarks.portal import generate_years, render_portal
+from benchmarks.run import compare_to_baseline, run_benchmarks
+from extract_grades import parse_html
+
+
+def test_synthetic_portal_parses_back() -> None:
+    years = generate_years(2, seed=3)
+
+    assert parse_html(render_portal(years)).to_years() == years
+
+
+def test_benchmark_run_covers_every_stage() -> None:
+    results = run_benchmarks(sizes=(1,), repeat=1)
+
+    stages = results["sizes"]["1"]
+    for stage in ("extract_rows", "parse_rows", "compare_grades", "save_json", "load_json", "flatten_grades", "notify"):
+        assert stages[stage]["seconds"] > 0
+        assert stages[stage]["peak_kb"] > 0
+
+
+def test_regressions_beyond_tolerance_are_reported() -> None:
+    baseline = {"sizes": {"1": {"parse_rows": {"seconds": 1.0, "peak_kb": 100.0}}}}
+    results = {
+        "sizes": {
+            "1": {
+                "parse_rows": {"seconds": 1.4, "peak_kb": 130.0},
+                "new_stage": {"seconds": 9.0, "peak_kb": 9.0},
+            }
+        }
+    }
+
+    regressions = compare_to_baseline(results, baseline, time_tolerance=0.5, memory_tolerance=0.2)
+
+    assert len(regressions) == 1
+    assert regressions[0].startswith("parse_rows (1 years): peak_kb")
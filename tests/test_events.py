@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import tempfile
+from pathlib import Path
+
+from starlette.requests import Request
+
+from publish_event import new_grades_event, publish_event
+from src.web.api import build_app
+from src.web.events import EventBroker, format_sse, listen_unix_socket, stream_events
+
+
+async def collect(stream, count: int) -> list[bytes]:
+    chunks = []
+    async for chunk in stream:
+        chunks.append(chunk)
+        if len(chunks) == count:
+            break
+    return chunks
+
+
+def test_broker_fans_out_and_replays() -> None:
+    async def scenario() -> None:
+        broker = EventBroker(replay_size=3)
+        live = broker.subscribe()
+        for index in range(5):
+            broker.publish({"type": "new_grades", "count": index})
+
+        assert live.queue.qsize() == 5
+
+        late = broker.subscribe(last_event_id=3)
+        replayed = [late.queue.get_nowait()[0] for _ in range(late.queue.qsize())]
+        assert replayed == [4, 5]
+
+    asyncio.run(scenario())
+
+
+def test_slow_client_is_dropped() -> None:
+    async def scenario() -> None:
+        broker = EventBroker(client_queue_size=2)
+        slow = broker.subscribe()
+        for index in range(3):
+            broker.publish({"type": "new_grades", "count": index})
+
+        assert slow.lagging
+        assert slow not in broker.subscribers
+
+        # The client still receives what was queued, then the stream ends
+        chunks = await collect(stream_events(broker, slow), 10)
+        assert chunks[1:] == [
+            format_sse(1, {"type": "new_grades", "count": 0}),
+            format_sse(2, {"type": "new_grades", "count": 1}),
+        ]
+
+    asyncio.run(scenario())
+
+
+def test_scraper_events_reach_the_broker() -> None:
+    async def scenario(path: Path) -> None:
+        broker = EventBroker()
+        subscriber = broker.subscribe()
+        transport = await listen_unix_socket(broker, path)
+        try:
+            event = new_grades_event("alice", [{"title": "Maths - Exam", "details": "15 - 100%"}])
+            assert publish_event(event, path=str(path))
+            event_id, received = await asyncio.wait_for(subscriber.queue.get(), 1)
+        finally:
+            transport.close()
+
+        assert event_id == 1
+        assert received["account"] == "alice"
+        assert received["grades"][0]["title"] == "Maths - Exam"
+
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(scenario(Path(directory) / "events.sock"))
+
+
+def test_publish_without_listener_is_dropped(tmp_path: Path) -> None:
+    assert not publish_event({"type": "new_grades"}, path=str(tmp_path / "missing.sock"))
+
+
+def test_api_events_endpoint_replays(tmp_path: Path) -> None:
+    app = build_app(
+        data_path=tmp_path / "new_grades.json",
+        static_dir=tmp_path / "static",
+        events_socket=None,
+    )
+    app.state.event_broker.publish({"type": "new_grades", "account": "alice", "count": 1})
+    endpoint = next(route.endpoint for route in app.routes if route.path == "/api/events")
+
+    async def scenario() -> list[bytes]:
+        request = Request({"type": "http", "headers": [(b"last-event-id", b"0")]})
+        response = await endpoint(request)
+        assert response.media_type == "text/event-stream"
+        chunks = await collect(response.body_iterator, 2)
+        await response.body_iterator.aclose()
+        return chunks
+
+    chunks = asyncio.run(scenario())
+
+    assert chunks[0] == b"retry: 3000\n\n"
+    assert chunks[1].startswith(b"id: 1\nevent: new_grades\ndata: ")
+    assert json.loads(chunks[1].split(b"data: ")[1])["account"] == "alice"
+    assert not app.state.event_broker.subscribers
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+
+from extract_grades import (
+    PARSER_BS4,
+    PARSER_LXML,
+    extract_rows,
+    get_parser_backend,
+    parse_html,
+    parse_rows,
+)
+
+SNAPSHOT = Path(__file__).resolve().parents[1] / "src" / "data" / "new_grades.json"
+
+
+def row(libelle: str, ponderation: str = "", coefficient: str = "", note: str = "", classes: str = "") -> str:
+    class_attr = f' class="{classes}"' if classes else ""
+    return (
+        f"<tr{class_attr}><td>&nbsp;{libelle} </td><td>{ponderation}</td>"
+        f"<td> {coefficient}</td><td><span>{note}</span></td></tr>"
+    )
+
+
+def render_portal(years: list[dict]) -> str:
+    """Render parsed years back into a note_ajax.php-like page."""
+    rows = []
+    for year in years:
+        rows.append(row(year["year_name"], classes="master"))
+        for semester in year["semesters"]:
+            rows.append(row(f"{semester['semester_name'].title()} / Semester", classes="slave"))
+            for module in semester["semester_modules"]:
+                rows.append(row(module["module_name"], classes="slave odd"))
+                for course in module["module_courses"]:
+                    ponderation = f"{course['course_ponderation']:.2f}".replace(".", ",")
+                    rows.append(row(course["course_name"], ponderation=ponderation))
+                    for grade_type in course["course_grades_type"]:
+                        grades = grade_type["grades"]
+                        if not grades:
+                            note = "- (%)"
+                        elif len(grades) == 1 and grades[0]["coef"] == "100.0":
+                            note = grades[0]["grade"].replace(".", ",")
+                        else:
+                            note = " - ".join(
+                                f"{g['grade'].replace('.', ',')} ({g['coef']}%)"
+                                for g in grades
+                            )
+                        rows.append(
+                            row(
+                                grade_type["grade_type"],
+                                coefficient=f"{grade_type['coefficient']:g}%",
+                                note=note,
+                            )
+                        )
+
+    return (
+        "<html><head><meta charset='utf-8'><title>Notes</title></head><body>"
+        "<table><thead><tr><th>Libellé</th></tr></thead><tbody>"
+        + "\n".join(rows)
+        + "</tbody></table><table><tbody><tr><td>footer</td></tr></tbody></table>"
+        "</body></html>"
+    )
+
+
+@pytest.fixture
+def portal_page() -> str:
+    years = json.loads(SNAPSHOT.read_text(encoding="utf-8"))
+    return render_portal(years)
+
+
+def test_lxml_backend_matches_parse_rows(portal_page: str) -> None:
+    pytest.importorskip("lxml")
+
+    expected = parse_rows(extract_rows(portal_page))
+
+    assert len(expected)
+    assert parse_html(portal_page, backend=PARSER_LXML) == expected
+    assert parse_html(portal_page.encode("utf-8"), backend=PARSER_LXML) == expected
+
+
+@pytest.mark.parametrize("backend", [PARSER_BS4, PARSER_LXML])
+def test_page_without_table_is_refused(backend: str) -> None:
+    if backend == PARSER_LXML:
+        pytest.importorskip("lxml")
+    login_page = "<html><body><form><input name='login'></form></body></html>"
+
+    with pytest.raises(ValueError, match="No grades table"):
+        parse_html(login_page, backend=backend)
+
+
+def test_parsed_page_matches_snapshot(portal_page: str) -> None:
+    years = json.loads(SNAPSHOT.read_text(encoding="utf-8"))
+
+    assert parse_html(portal_page, backend=PARSER_BS4).to_years() == years
+
+
+def test_parser_backend_from_env(monkeypatch: pytest.MonkeyPatch) -> None:
+    pytest.importorskip("lxml")
+    monkeypatch.setenv("GRADES_PARSER", PARSER_LXML)
+
+    assert get_parser_backend() == PARSER_LXML
+    assert get_parser_backend(PARSER_BS4) == PARSER_BS4
+
+
+def test_unknown_parser_backend() -> None:
+    with pytest.raises(ValueError):
+        get_parser_backend("regex")
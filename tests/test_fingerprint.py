@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from fingerprint import FingerprintStage, StageCounters, fingerprint
+
+PAGE = """<html><head><script>var token = "{token}";</script></head>
+<body><table><tbody>
+  <tr class="master"><td>{year}</td><td></td><td></td><td></td></tr>
+</tbody></table></body></html>"""
+
+
+def test_fingerprint_ignores_content_outside_tbody() -> None:
+    first = fingerprint(PAGE.format(token="abc", year="Y1"))
+    second = fingerprint(PAGE.format(token="xyz", year="Y1"))
+    changed = fingerprint(PAGE.format(token="abc", year="Y2"))
+
+    assert first == second
+    assert first != changed
+
+
+def test_fingerprint_ignores_whitespace() -> None:
+    page = PAGE.format(token="abc", year="Y1")
+
+    assert fingerprint(page) == fingerprint(page.replace("\n", "\n\n    "))
+
+
+def test_stage_persists_digest_and_counts(tmp_path: Path) -> None:
+    path = tmp_path / "fingerprint.txt"
+    stats = StageCounters()
+    page = PAGE.format(token="abc", year="Y1")
+
+    stage = FingerprintStage(str(path), stats=stats)
+    unchanged, digest = stage.check(page)
+    assert not unchanged
+    stage.commit(digest)
+
+    restarted = FingerprintStage(str(path), stats=stats)
+    unchanged, _ = restarted.check(page)
+
+    assert unchanged
+    assert stats.snapshot() == {"hits": 1, "misses": 1}
+
+
+def test_stage_without_commit_keeps_missing(tmp_path: Path) -> None:
+    stage = FingerprintStage(str(tmp_path / "fingerprint.txt"), stats=StageCounters())
+    page = PAGE.format(token="abc", year="Y1")
+
+    stage.check(page)
+    unchanged, _ = stage.check(page)
+
+    assert not unchanged
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import copy
+import json
+from pathlib import Path
+
+import pytest
+
+import main
+from get_new_grades import GradeIndex, compare_grades, format_grades
+from grade_model import GradeSheet
+from notifier import Outbox
+from tree_diff import ADDED, CHANGED, REMOVED, SuspectPageError, diff_sheets
+
+SNAPSHOT = Path(__file__).resolve().parents[1] / "src" / "data" / "new_grades.json"
+
+
+def load_snapshot() -> list[dict]:
+    return json.loads(SNAPSHOT.read_text(encoding="utf-8"))
+
+
+def first_grades(years: list[dict]) -> list[dict]:
+    return years[0]["semesters"][0]["semester_modules"][0]["module_courses"][0][
+        "course_grades_type"
+    ][0]["grades"]
+
+
+def add_grade(years: list[dict], value: str) -> list[dict]:
+    years = copy.deepcopy(years)
+    first_grades(years).append({"grade": value, "coef": "50"})
+    return years
+
+
+def test_index_diff_matches_compare_grades(tmp_path: Path) -> None:
+    old = load_snapshot()
+    new = add_grade(old, "17.5")
+    old_path = tmp_path / "old_grades.json"
+    old_path.write_text(json.dumps(old), encoding="utf-8")
+
+    index = GradeIndex.from_snapshot(str(old_path))
+    events, _ = index.diff(new)
+
+    assert format_grades(events) == compare_grades(old, new)
+    assert [(event.kind, event.new) for event in events] == [(ADDED, ("17.5", "50"))]
+
+
+def test_index_commit_is_kept_across_cycles() -> None:
+    old = load_snapshot()
+    index = GradeIndex()
+    events, current = index.diff(old)
+    assert [event.slot for event in events] == list(current)
+
+    index.commit(current)
+    assert index.diff(old)[0] == []
+
+    events, current = index.diff(add_grade(old, "11"))
+    assert [event.new[0] for event in events] == ["11"]
+
+
+def test_index_from_missing_snapshot(tmp_path: Path) -> None:
+    index = GradeIndex.from_snapshot(str(tmp_path / "missing.json"))
+
+    assert len(index) == 0
+
+
+def test_diff_reports_corrections_and_removals() -> None:
+    old = add_grade(add_grade(load_snapshot(), "12"), "12")
+    new = copy.deepcopy(old)
+    # Two equal marks are two grades: correct the first, remove the second
+    first_grades(new)[-2]["grade"] = "14"
+    del first_grades(new)[-1]
+
+    events = diff_sheets(old, new)
+
+    assert [(event.kind, event.old, event.new) for event in events] == [
+        (CHANGED, ("12", "50"), ("14", "50")),
+        (REMOVED, ("12", "50"), None),
+    ]
+    assert events[0].slot.slot + 1 == events[1].slot.slot
+    changed, removed = format_grades(events)
+    assert changed["details"] == "14 - 50% (was 12)"
+    assert changed["change"] == CHANGED
+    assert removed["details"] == "12 - 50% removed"
+
+
+def test_page_removing_most_grades_is_ignored(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    old = load_snapshot()
+    old_path = tmp_path / "old_grades.json"
+    old_path.write_text(json.dumps(old), encoding="utf-8")
+    outbox = Outbox(str(tmp_path / "outbox.json"))
+    monkeypatch.setattr(main, "_outbox", outbox)
+    monkeypatch.setattr(main, "_grade_indexes", {})
+    monkeypatch.setattr(main, "publish_event", lambda event: None)
+
+    def compare(data) -> list[dict]:
+        return main.compare_and_upgrade_grades(
+            str(old_path), str(tmp_path / "new_grades.json"), data, None, "topic"
+        )
+
+    for page in (GradeSheet(), []):
+        with pytest.raises(SuspectPageError):
+            compare(page)
+    assert json.loads(old_path.read_text(encoding="utf-8")) == old
+    assert len(outbox) == 0
+
+    # A real correction still goes through
+    assert [grade["details"] for grade in compare(add_grade(old, "9"))] == ["9 - 50%"]
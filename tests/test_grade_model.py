@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+
+from grade_model import COURSE, GRADE, YEAR, GradeSheet, GradeSheetBuilder
+from tree_diff import grade_slots
+
+SNAPSHOT = Path(__file__).resolve().parents[1] / "src" / "data" / "new_grades.json"
+
+
+def test_snapshot_round_trip() -> None:
+    years = json.loads(SNAPSHOT.read_text(encoding="utf-8"))
+
+    sheet = GradeSheet.from_years(years)
+
+    assert sheet.to_years() == years
+    assert GradeSheet.from_years(sheet.to_years()) == sheet
+
+
+def test_childless_nodes_are_kept() -> None:
+    years = [
+        {"year_name": "ING1", "semesters": []},
+        {
+            "year_name": "ING2",
+            "semesters": [
+                {"semester_name": "semestre 1", "semester_modules": []},
+                {
+                    "semester_name": "semestre 2",
+                    "semester_modules": [
+                        {
+                            "module_name": "Maths",
+                            "module_courses": [
+                                {
+                                    "course_name": "Analyse",
+                                    "course_ponderation": 2.0,
+                                    "course_grades_type": [
+                                        {"grade_type": "DE", "coefficient": 60.0, "grades": []}
+                                    ],
+                                }
+                            ],
+                        }
+                    ],
+                },
+            ],
+        },
+    ]
+
+    sheet = GradeSheet.from_years(years)
+
+    assert [row.level for row in sheet] == [YEAR, 1, 4]
+    assert sheet.to_years() == years
+    assert grade_slots(sheet) == {}
+
+
+def test_builder_matches_from_years() -> None:
+    builder = GradeSheetBuilder()
+    builder.year("ING4")
+    builder.semester("semestre 1")
+    builder.module("Réseaux")
+    builder.course("Cloud / Cloud", 1.5)
+    builder.grade_type("CC", 40.0, [("12.5", "50"), ("Validé", "50")])
+    builder.grade_type("DE", 60.0, [])
+    builder.course("Sécurité", 2.0)
+    sheet = builder.build()
+
+    assert [row.opens for row in sheet] == [YEAR, GRADE, 4, COURSE]
+    assert GradeSheet.from_years(sheet.to_years()) == sheet
+    assert grade_slots(sheet) == {
+        ("ING4", "semestre 1", "Réseaux", "Cloud / Cloud", "CC", 0): ("12.5", "50")
+    }
+
+
+def test_names_are_interned() -> None:
+    years = json.loads(SNAPSHOT.read_text(encoding="utf-8"))
+
+    first, second = GradeSheet.from_years(years), GradeSheet.from_years(years)
+
+    assert first.rows[0].year is second.rows[0].year
+
+
+def test_builder_rejects_orphan_rows() -> None:
+    with pytest.raises(ValueError):
+        GradeSheetBuilder().module("Maths")
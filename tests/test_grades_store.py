@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from grades_store import GradesStore
+
+SNAPSHOT = Path(__file__).resolve().parents[1] / "src" / "data" / "new_grades.json"
+
+
+@pytest.fixture
+def store(tmp_path: Path):
+    store = GradesStore(str(tmp_path / "grades.db"))
+    yield store
+    store.close()
+
+
+def load_snapshot() -> list[dict]:
+    return json.loads(SNAPSHOT.read_text(encoding="utf-8"))
+
+
+def test_record_cycle_tracks_first_and_last_seen(store: GradesStore) -> None:
+    years = load_snapshot()
+
+    written = store.record_cycle("alice", years, seen_at="2025-01-01T00:00:00+00:00")
+    store.record_cycle("alice", years, seen_at="2025-01-02T00:00:00+00:00")
+
+    rows = store.history(account="alice")
+    assert written >= len(rows) == store.count("alice") > 0
+    assert {row["first_seen"] for row in rows} == {"2025-01-01T00:00:00+00:00"}
+    assert {row["last_seen"] for row in rows} == {"2025-01-02T00:00:00+00:00"}
+    assert store.count("bob") == 0
+
+
+def test_history_filters(store: GradesStore) -> None:
+    years = load_snapshot()
+    store.record_cycle("alice", years)
+    store.record_cycle("bob", years)
+
+    first = store.history(account="alice")[0]
+    rows = store.history(year=first["year"], semester=first["semester"], module=first["module"])
+
+    assert rows
+    assert {row["account"] for row in rows} == {"alice", "bob"}
+    assert {row["module"] for row in rows} == {first["module"]}
+
+
+def test_wal_mode_and_indexes(store: GradesStore) -> None:
+    reader = sqlite3.connect(store.path)
+    try:
+        assert reader.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        indexes = {row[1] for row in reader.execute("PRAGMA index_list(grades)")}
+    finally:
+        reader.close()
+
+    assert {"idx_grades_account", "idx_grades_year_semester_module"} <= indexes
+
+
+def test_migrate_from_json(store: GradesStore, tmp_path: Path) -> None:
+    path = tmp_path / "old_grades.json"
+    path.write_text(json.dumps(load_snapshot()), encoding="utf-8")
+
+    imported = store.migrate_from_json("alice", str(path))
+
+    assert imported >= store.count("alice") > 0
+    assert store.migrate_from_json("alice", str(tmp_path / "missing.json")) == 0
+
+
+def equal_marks(*values: str) -> list[dict]:
+    return [
+        {
+            "year_name": "ING2",
+            "semesters": [
+                {
+                    "semester_name": "S1",
+                    "semester_modules": [
+                        {
+                            "module_name": "Maths",
+                            "module_courses": [
+                                {
+                                    "course_name": "Analyse",
+                                    "course_ponderation": 2.0,
+                                    "course_grades_type": [
+                                        {
+                                            "grade_type": "CC",
+                                            "coefficient": 40.0,
+                                            "grades": [{"grade": value, "coef": "50"} for value in values],
+                                        }
+                                    ],
+                                }
+                            ],
+                        }
+                    ],
+                }
+            ],
+        }
+    ]
+
+
+def test_equal_marks_are_two_grades(store: GradesStore) -> None:
+    assert store.record_cycle("alice", equal_marks("12", "12")) == 2
+    assert store.count("alice") == 2
+
+    # A correction keeps the first value as its own observation
+    store.record_cycle("alice", equal_marks("12", "14"))
+    assert [(row["slot"], row["value"]) for row in store.history(account="alice")] == [
+        (0, "12"),
+        (1, "12"),
+        (1, "14"),
+    ]
+
+
+def test_touch_bumps_the_grades_still_on_the_page(store: GradesStore) -> None:
+    store.record_cycle("alice", equal_marks("12", "12"), seen_at="2025-01-01T00:00:00+00:00")
+    store.record_cycle("alice", equal_marks("12"), seen_at="2025-01-02T00:00:00+00:00")
+
+    assert store.touch("alice", seen_at="2025-01-03T00:00:00+00:00") == 1
+    assert [row["last_seen"][:10] for row in store.history(account="alice")] == [
+        "2025-01-03",
+        "2025-01-01",
+    ]
+    assert store.touch("bob") == 0
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import time
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from metrics import Registry, flush_periodically, merge_snapshots, read_snapshots, render_prometheus
+
+
+def test_histogram_buckets_are_cumulative() -> None:
+    registry = Registry()
+    latency = registry.histogram("request_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value, host="portal")
+
+    text = render_prometheus(merge_snapshots([registry.snapshot()]))
+
+    assert 'request_seconds_bucket{host="portal",le="0.1"} 2' in text
+    assert 'request_seconds_bucket{host="portal",le="1.0"} 3' in text
+    assert 'request_seconds_bucket{host="portal",le="+Inf"} 4' in text
+    assert 'request_seconds_count{host="portal"} 4' in text
+    assert 'request_seconds_sum{host="portal"} 3.65' in text
+
+
+def test_time_records_failures() -> None:
+    registry = Registry()
+    latency = registry.histogram("parse_seconds", "Parse time")
+
+    with pytest.raises(RuntimeError):
+        with latency.time(backend="lxml"):
+            raise RuntimeError
+
+    assert latency.count(backend="lxml") == 1
+
+
+def test_registry_rejects_type_conflicts() -> None:
+    registry = Registry()
+    assert registry.counter("events_total", "Events") is registry.counter("events_total", "Events")
+
+    with pytest.raises(ValueError):
+        registry.histogram("events_total", "Events")
+
+
+def test_snapshots_from_several_processes_are_summed(tmp_path: Path) -> None:
+    for name, amount in (("scraper", 2), ("worker", 5)):
+        registry = Registry()
+        registry.counter("grades_new_total", "New grades").inc(amount)
+        registry.histogram("compare_seconds", "Diff time").observe(0.02)
+        registry.write(str(tmp_path / f"{name}.json"))
+    (tmp_path / "broken.json").write_text("{", encoding="utf-8")
+
+    merged = merge_snapshots(read_snapshots(str(tmp_path)))
+
+    assert merged["grades_new_total"]["samples"] == {"": 7}
+    assert sum(merged["compare_seconds"]["samples"][""][:-1]) == 2
+
+    # A worker gone for good stops being counted
+    later = time.time() + 3600
+    assert len(read_snapshots(str(tmp_path), max_age=60, now=later)) == 0
+    assert len(read_snapshots(str(tmp_path), max_age=7200, now=later)) == 2
+
+
+def test_flush_periodically_writes_on_cancel(tmp_path: Path) -> None:
+    registry = Registry()
+    registry.counter("polls_total", "Polls").inc()
+    path = tmp_path / "scraper.json"
+
+    async def run() -> None:
+        task = asyncio.create_task(flush_periodically(str(path), interval=60, registry=registry))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+
+    assert read_snapshots(str(tmp_path))[0]["polls_total"]["samples"] == {"": 1}
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from pathlib import Path
+
+import httpx
+
+from notifier import Dispatcher, Outbox, build_notification
+
+GRADES = [
+    {"title": "Maths - Examen", "details": "15.5 - 100%"},
+    {"title": "Physique - Projet", "details": "12 - 50%"},
+]
+
+
+def make_dispatcher(tmp_path: Path, outbox: Outbox, handler, **kwargs) -> Dispatcher:
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return Dispatcher(
+        outbox,
+        client=client,
+        base_delay=0,
+        dead_letter_path=str(tmp_path / "dead.ndjson"),
+        ntfy_url="https://ntfy.test",
+        **kwargs,
+    )
+
+
+def test_build_notification_coalesces() -> None:
+    single = build_notification(GRADES[:1], "topic", "https://click")
+    many = build_notification(GRADES, "topic", None)
+
+    assert single["title"] == "Maths - Examen"
+    assert single["click"] == "https://click"
+    assert many["title"] == "2 new grades"
+    assert "Physique - Projet: 12 - 50%" in many["message"]
+    assert "click" not in many
+    changes = GRADES + [dict(GRADES[0], change="changed"), dict(GRADES[1], change="removed")]
+    assert build_notification(changes, "topic", None)["title"] == "2 new, 1 changed, 1 removed grades"
+
+
+def test_outbox_survives_restart(tmp_path: Path) -> None:
+    path = tmp_path / "outbox.json"
+    Outbox(str(path)).enqueue("topic", GRADES, "https://click")
+
+    restored = Outbox(str(path))
+
+    assert len(restored) == 2
+    assert list(restored.due()) == [("topic", "https://click")]
+
+
+def test_dispatcher_sends_one_message_per_topic(tmp_path: Path) -> None:
+    requests: list[dict] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(json.loads(request.content))
+        return httpx.Response(200)
+
+    outbox = Outbox(str(tmp_path / "outbox.json"))
+    outbox.enqueue("alice", GRADES, "https://click")
+    outbox.enqueue("bob", GRADES[:1], "https://click")
+    dispatcher = make_dispatcher(tmp_path, outbox, handler)
+
+    asyncio.run(dispatcher.flush())
+
+    assert sorted(request["topic"] for request in requests) == ["alice", "bob"]
+    assert len(outbox) == 0
+    assert dispatcher.sent == 2
+
+
+def test_dispatcher_retries_then_dead_letters(tmp_path: Path) -> None:
+    calls = 0
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal calls
+        calls += 1
+        return httpx.Response(503)
+
+    outbox = Outbox(str(tmp_path / "outbox.json"))
+    outbox.enqueue("alice", GRADES, None)
+    dispatcher = make_dispatcher(tmp_path, outbox, handler, max_attempts=3)
+
+    async def scenario() -> None:
+        await dispatcher.flush()
+        assert len(outbox) == 2
+        assert outbox.due()[("alice", None)][0]["attempts"] == 1
+        await dispatcher.flush()
+        await dispatcher.flush()
+
+    asyncio.run(scenario())
+
+    dead = (tmp_path / "dead.ndjson").read_text(encoding="utf-8").splitlines()
+    assert calls == 3
+    assert len(outbox) == 0
+    assert len(dead) == 2
+    assert "503" in json.loads(dead[0])["error"]
+
+
+def test_dispatcher_wakes_up_on_enqueue(tmp_path: Path) -> None:
+    sent = asyncio.Event()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.set()
+        return httpx.Response(200)
+
+    outbox = Outbox(str(tmp_path / "outbox.json"))
+    dispatcher = make_dispatcher(tmp_path, outbox, handler, coalesce_delay=0)
+
+    async def scenario() -> None:
+        task = asyncio.create_task(dispatcher.run())
+        await asyncio.sleep(0.01)
+        await asyncio.to_thread(outbox.enqueue, "alice", GRADES, None)
+        await asyncio.wait_for(sent.wait(), 1)
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert dispatcher.sent == 1
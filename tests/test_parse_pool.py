@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import pytest
+
+from benchmarks.portal import generate_years, render_portal
+from extract_grades import parse_html, parse_seconds, parsed_rows_total
+from grade_model import GradeSheet
+from parse_pool import ParsePool, default_workers, parse_to_bytes
+
+
+@pytest.fixture(scope="module")
+def pages() -> list[str]:
+    return [render_portal(generate_years(1, modules=3, seed=seed)) for seed in range(4)]
+
+
+def test_worker_result_round_trips(pages: list[str]) -> None:
+    sheet = parse_html(pages[0])
+
+    data, backend, seconds, rows = parse_to_bytes(pages[0].encode("utf-8"))
+
+    assert GradeSheet.loads(data) == sheet
+    assert seconds > 0
+    assert rows > len(sheet.rows) / 2
+
+
+def test_pool_matches_in_process_parsing(pages: list[str]) -> None:
+    expected = [parse_html(page) for page in pages]
+    rows = parsed_rows_total.value()
+    parses = parse_seconds.count(backend="lxml") + parse_seconds.count(backend="html.parser")
+
+    pool = ParsePool(workers=2)
+    try:
+        assert pool.parse(pages[0]) == expected[0]
+        assert list(pool.map(pages, window=1)) == expected
+    finally:
+        pool.close()
+
+    # Recorded in this process, not lost in the workers' registries
+    assert parse_seconds.count(backend="lxml") + parse_seconds.count(backend="html.parser") == parses + 5
+    assert parsed_rows_total.value() - rows > 0
+
+
+def test_map_can_return_parse_errors(pages: list[str]) -> None:
+    for workers in (1, 2):
+        pool = ParsePool(workers=workers)
+        try:
+            first, broken, last = pool.map(
+                [pages[0], "<p>maintenance</p>", pages[1]], return_exceptions=True
+            )
+            with pytest.raises(ValueError):
+                list(pool.map(["<p>maintenance</p>"]))
+        finally:
+            pool.close()
+
+        assert first == parse_html(pages[0])
+        assert isinstance(broken, ValueError)
+        assert last == parse_html(pages[1])
+
+
+def test_single_worker_parses_in_process(pages: list[str]) -> None:
+    pool = ParsePool(workers=1)
+
+    assert pool.in_process
+    assert pool.parse(pages[1]) == parse_html(pages[1])
+    assert pool._executor is None
+
+
+def test_default_workers_leave_a_core(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr("os.cpu_count", lambda: 4)
+
+    assert default_workers(1) == 1
+    assert default_workers(10) == 3
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import time
+from pathlib import Path
+
+import poll_scheduler
+from accounts import Account
+from poll_scheduler import AdaptiveScheduler
+from utils import save_json
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+
+
+def at(weekday: int, hour: int, minute: int = 0) -> time.struct_time:
+    # 2025-01-06 is a Monday (tm_wday == 0)
+    return time.struct_time((2025, 1, 6 + weekday, hour, minute, 0, weekday, 6 + weekday, 0))
+
+
+def make_scheduler(**kwargs) -> AdaptiveScheduler:
+    options = {"min_interval": 5 * MINUTE, "max_interval": 6 * HOUR, "jitter": 0}
+    options.update(kwargs)
+    return AdaptiveScheduler(**options)
+
+
+def test_prior_hours_are_polled_at_the_floor() -> None:
+    scheduler = make_scheduler(prior_hours=[1, 2])
+
+    assert scheduler.next_delay(at(0, 1, 30)) == 5 * MINUTE
+
+
+def test_idle_polls_back_off_until_the_next_likely_hour() -> None:
+    scheduler = make_scheduler(prior_hours=[1, 2])
+    delays = []
+    for _ in range(4):
+        scheduler.record(new_grades=0, now=at(0, 10))
+        delays.append(scheduler.next_delay(at(0, 10)))
+
+    assert delays == [10 * MINUTE, 20 * MINUTE, 40 * MINUTE, 80 * MINUTE]
+
+    for _ in range(10):
+        scheduler.record(new_grades=0, now=at(0, 23))
+    # Capped so the 1 AM slot is not missed
+    assert scheduler.next_delay(at(0, 23, 30)) == 90 * MINUTE
+
+
+def test_learned_publication_slots_win_over_the_prior() -> None:
+    scheduler = make_scheduler(prior_hours=[1, 2])
+    for _ in range(3):
+        scheduler.record(new_grades=2, now=at(2, 14))
+    scheduler.record(new_grades=0, now=at(2, 15))
+
+    assert scheduler.is_likely(2, 14)
+    assert not scheduler.is_likely(0, 1)
+    assert scheduler.next_delay(at(2, 14, 10)) == 5 * MINUTE
+
+
+def test_failures_back_off_to_the_ceiling() -> None:
+    scheduler = make_scheduler(prior_hours=range(24))
+    for _ in range(20):
+        scheduler.record(failed=True)
+
+    assert scheduler.next_delay(at(0, 1)) == 6 * HOUR
+
+    scheduler.record(new_grades=0)
+    assert scheduler.next_delay(at(0, 1)) == 5 * MINUTE
+
+
+def test_jitter_stays_within_bounds() -> None:
+    scheduler = make_scheduler(jitter=0.5, prior_hours=range(24))
+    for _ in range(5):
+        scheduler.record(failed=True)
+
+    delays = {scheduler.next_delay(at(0, 1)) for _ in range(50)}
+
+    assert len(delays) > 1
+    assert all(5 * MINUTE <= delay <= 6 * HOUR for delay in delays)
+
+    # Still spread out at the ceiling
+    for _ in range(20):
+        scheduler.record(failed=True)
+    delays = {scheduler.next_delay(at(0, 1)) for _ in range(50)}
+    assert len(delays) > 1
+    assert all(1.5 * HOUR <= delay <= 4.5 * HOUR for delay in delays)
+
+
+def test_state_is_persisted_per_account(tmp_path: Path, monkeypatch) -> None:
+    monkeypatch.setenv("POLL_MIN_INTERVAL", "60")
+    account = Account("alice", "https://x.test", "t", start_hour=1, end_hour=3, data_dir=str(tmp_path))
+
+    saves: list[dict] = []
+
+    def save(data, *args, **kwargs) -> None:
+        saves.append(data)
+        save_json(data, *args, **kwargs)
+
+    monkeypatch.setattr(poll_scheduler, "save_json", save)
+
+    scheduler = AdaptiveScheduler.for_account(account)
+    scheduler.record(new_grades=1, now=at(4, 18))
+    # Only learned slots are written, not the streaks of every idle or failed poll
+    scheduler.record(new_grades=0, now=at(4, 19))
+    scheduler.record(failed=True, now=at(4, 20))
+    assert saves == [{"publications": {"4-18": 1}}]
+
+    restored = AdaptiveScheduler.for_account(account)
+    assert restored.min_interval == 60
+    assert restored.prior_hours == {1, 2}
+    assert restored.is_likely(4, 18)
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import json
+import time
+import asyncio
+import threading
+from pathlib import Path
+
+import pytest
+
+from accounts import Account, load_accounts
+from poller import Poller
+
+
+def make_account(name: str, host: str = "portal.test") -> Account:
+    return Account(name=name, grades_url=f"https://{host}/note_ajax.php", topic=name)
+
+
+def test_load_accounts_from_file(tmp_path: Path) -> None:
+    accounts_file = tmp_path / "accounts.json"
+    accounts_file.write_text(
+        json.dumps(
+            [
+                {"name": "alice", "grades_url": "https://a.test/x", "topic": "t1"},
+                {
+                    "name": "bob",
+                    "grades_url": "https://b.test/x",
+                    "topic": "t2",
+                    "window": [1, 3],
+                },
+            ]
+        ),
+        encoding="utf-8",
+    )
+
+    accounts = load_accounts(accounts_file, data_root=str(tmp_path))
+
+    assert [account.name for account in accounts] == ["alice", "bob"]
+    assert accounts[0].data_dir == str(tmp_path / "accounts" / "alice")
+    assert not accounts[0].has_window
+    assert accounts[1].in_window(2)
+    assert not accounts[1].in_window(3)
+
+
+def test_load_accounts_from_env(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv("ACCOUNTS_FILE", raising=False)
+    monkeypatch.setenv("GRADES_URL", "https://portal.test/note_ajax.php")
+    monkeypatch.setenv("NTFY_TOPIC", "topic")
+
+    (account,) = load_accounts(default_window=(1, 3), data_root="data")
+
+    assert account.topic == "topic"
+    assert account.host == "portal.test"
+    assert account.new_grades_path.endswith("new_grades.json")
+    assert (account.start_hour, account.end_hour) == (1, 3)
+
+
+def test_poller_bounds_concurrency_and_survives_failures() -> None:
+    accounts = [make_account(f"acc-{i}", host=f"h{i}.test") for i in range(10)]
+    lock = threading.Lock()
+    running = 0
+    peak = 0
+    seen: list[str] = []
+
+    def cycle(account: Account) -> None:
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.02)
+        with lock:
+            running -= 1
+            seen.append(account.name)
+        if account.name == "acc-3":
+            raise RuntimeError("portal down")
+
+    poller = Poller(accounts, cycle, max_concurrency=3)
+
+    async def scenario() -> None:
+        task = asyncio.create_task(poller.run())
+        await asyncio.sleep(0.3)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+
+    assert sorted(seen) == sorted(account.name for account in accounts)
+    assert peak <= 3
+    assert poller.schedulers["acc-3"].failures == 1
+    assert poller.schedulers["acc-0"].idle_streak == 1
+
+
+def test_poller_pauses_hosts_with_an_open_breaker() -> None:
+    from scraper import CircuitBreaker, HostRegistry
+
+    breakers = HostRegistry(lambda host: CircuitBreaker(host, failure_threshold=1))
+    breakers.get("down.test").record_failure()
+    seen: list[str] = []
+    poller = Poller(
+        [make_account("a", host="down.test"), make_account("b", host="up.test")],
+        lambda account: seen.append(account.name),
+        breakers=breakers,
+    )
+
+    async def scenario() -> list[float]:
+        poller._semaphore = asyncio.Semaphore(1)
+        return [await poller.poll_once(account) for account in poller.accounts]
+
+    delays = asyncio.run(scenario())
+
+    assert seen == ["b"]
+    assert 0 < delays[0] <= 60
+    assert "a" not in poller.schedulers
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+import pytest
+
+import scraper
+from scraper import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    PageCache,
+    TokenBucket,
+    fetch_page,
+    get_response,
+)
+
+
+class PortalHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    body = b"<table><tbody><tr><td>Y1</td></tr></tbody></table>"
+    etag: str | None = '"v1"'
+    peers: set = set()
+    # Number of next requests answered with a 503
+    failures = 0
+
+    def do_GET(self) -> None:
+        type(self).peers.add(self.client_address)
+        if type(self).failures:
+            type(self).failures -= 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.etag and self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        if self.etag:
+            self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def portal() -> Iterator[type[PortalHandler]]:
+    handler = type("Handler", (PortalHandler,), {"peers": set()})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    handler.url = f"http://127.0.0.1:{server.server_port}/note_ajax.php"
+    yield handler
+    server.shutdown()
+    server.server_close()
+    scraper.close_sessions()
+
+
+def test_fetch_page_uses_etag(portal: type[PortalHandler]) -> None:
+    cache = PageCache()
+
+    first = fetch_page(portal.url, cache=cache)
+    assert first.changed
+    assert "Y1" in first.text
+    cache.store(first)
+
+    second = fetch_page(portal.url, cache=cache)
+    assert second.status_code == 304
+    assert not second.changed
+    assert second.text is None
+
+
+def test_fetch_page_falls_back_to_body_hash(portal: type[PortalHandler]) -> None:
+    portal.etag = None
+    cache = PageCache()
+
+    cache.store(fetch_page(portal.url, cache=cache))
+    unchanged = fetch_page(portal.url, cache=cache)
+    assert unchanged.status_code == 200
+    assert not unchanged.changed
+
+    portal.body = b"<table><tbody><tr><td>Y2</td></tr></tbody></table>"
+    changed = fetch_page(portal.url, cache=cache)
+    assert changed.changed
+    assert "Y2" in changed.text
+
+
+def test_unprocessed_page_is_fetched_again(portal: type[PortalHandler]) -> None:
+    cache = PageCache()
+
+    fetch_page(portal.url, cache=cache)
+    again = fetch_page(portal.url, cache=cache)
+
+    assert again.changed
+
+
+def test_session_reuses_connection(portal: type[PortalHandler]) -> None:
+    cache = PageCache()
+    for _ in range(3):
+        fetch_page(portal.url, cache=cache)
+
+    assert len(portal.peers) == 1
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def test_token_bucket_allows_bursts_then_paces() -> None:
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=3, clock=clock, sleep=clock.sleep)
+
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+    assert bucket.acquire() == 0.5
+    assert bucket.acquire() == 0.5
+    clock.now += 10
+    assert bucket.acquire() == 0
+
+
+def test_circuit_breaker_opens_then_probes() -> None:
+    clock = FakeClock()
+    breaker = CircuitBreaker("portal.test", failure_threshold=2, reset_timeout=30, clock=clock)
+
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.retry_after() == 30
+
+    clock.now += 30
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    # A single probe at a time
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+class FailingSession:
+    def __init__(self, error: Exception) -> None:
+        self.error = error
+
+    def get(self, *args, **kwargs):
+        raise self.error
+
+
+def test_half_open_probe_ends_on_any_error(monkeypatch: pytest.MonkeyPatch) -> None:
+    import requests
+
+    clock = FakeClock()
+    breaker = CircuitBreaker("portal.test", failure_threshold=1, reset_timeout=30, clock=clock)
+    monkeypatch.setattr(scraper.breakers, "_items", {"portal.test": breaker})
+    bucket = TokenBucket(rate=1, burst=10, clock=clock, sleep=clock.sleep)
+    monkeypatch.setattr(scraper.buckets, "_items", {"portal.test": bucket})
+    url = "https://portal.test/note_ajax.php"
+    breaker.record_failure()
+
+    # A refused connection is a failure of the host: open again
+    clock.now += 30
+    refused = requests.ConnectionError("Connection refused")
+    monkeypatch.setattr(scraper, "get_session", lambda url: FailingSession(refused))
+    with pytest.raises(RuntimeError):
+        get_response(url, max_retries=1)
+    assert breaker.state == OPEN
+    assert breaker.retry_after() == 30
+
+    # DNS and other request errors say nothing about the host: probe again
+    clock.now += 30
+    for error in (requests.ConnectionError("Failed to resolve 'portal.test'"), requests.TooManyRedirects()):
+        monkeypatch.setattr(scraper, "get_session", lambda url: FailingSession(error))
+        with pytest.raises(RuntimeError):
+            get_response(url, max_retries=1)
+        assert breaker.state == HALF_OPEN
+        assert breaker.allow()
+        breaker.release()
+
+
+def test_get_response_retries_server_errors(portal: type[PortalHandler]) -> None:
+    portal.failures = 2
+
+    response = get_response(portal.url, base_delay=0)
+
+    assert response.status_code == 200
+    assert scraper.breakers.get(scraper.urlparse(portal.url).netloc).state == CLOSED
+
+
+def test_get_response_fails_fast_once_the_breaker_is_open(
+    portal: type[PortalHandler], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    host = scraper.urlparse(portal.url).netloc
+    breaker = CircuitBreaker(host, failure_threshold=2, reset_timeout=60)
+    monkeypatch.setattr(scraper.breakers, "_items", {host: breaker})
+    portal.failures = 10
+
+    with pytest.raises(CircuitOpenError):
+        get_response(portal.url, max_retries=5, base_delay=0)
+    assert portal.failures == 8
+    with pytest.raises(CircuitOpenError) as error:
+        get_response(portal.url, base_delay=0)
+    assert error.value.retry_after > 0
+    assert portal.failures == 8
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from accounts import Account
+from main import adopt_orphaned_outboxes
+from notifier import Outbox
+from poller import Poller
+from sharding import HashRing, ShardMember, WorkQueue
+
+
+def make_account(name: str) -> Account:
+    return Account(name=name, grades_url="https://portal.test/note_ajax.php", topic=name)
+
+
+def test_ring_only_moves_the_keys_of_a_new_worker() -> None:
+    keys = [f"account-{i}" for i in range(300)]
+    before = HashRing(["w1", "w2", "w3"])
+    after = HashRing(["w1", "w2", "w3", "w4"])
+
+    moved = [key for key in keys if before.owner(key) != after.owner(key)]
+
+    assert all(after.owner(key) == "w4" for key in moved)
+    assert 0 < len(moved) < len(keys) / 2
+    assert all(len(shard) > 30 for shard in before.assignment(keys).values())
+    assert HashRing().owner("account-0") is None
+
+
+def test_lease_blocks_other_workers_until_due(tmp_path: Path) -> None:
+    queue = WorkQueue(str(tmp_path / "shards.db"))
+
+    assert queue.acquire("alice", "w1", ttl=60, now=100)
+    assert not queue.acquire("alice", "w2", ttl=60, now=110)
+
+    # Polled by w1: nobody polls it again before the next poll time
+    queue.release("alice", "w1", next_poll=200)
+    assert not queue.acquire("alice", "w2", ttl=60, now=150)
+    assert queue.acquire("alice", "w2", ttl=60, now=200)
+
+    # A lease left by a crashed worker expires
+    assert queue.acquire("alice", "w1", ttl=60, now=261)
+
+
+def test_dead_workers_leave_the_ring(tmp_path: Path) -> None:
+    queue = WorkQueue(str(tmp_path / "shards.db"))
+    queue.heartbeat("w1", now=100)
+    queue.heartbeat("w2", now=100)
+    queue.acquire("alice", "w2", ttl=600, now=100)
+
+    queue.heartbeat("w1", now=140)
+    # Read-only view, as shown by the command line
+    assert queue.workers(ttl=30, now=140) == ["w1"]
+    assert queue.leases()["alice"][0] == "w2"
+
+    assert queue.live_workers(ttl=30, now=140) == ["w1"]
+    assert queue.leases()["alice"][0] is None
+
+
+def test_accounts_gained_again_are_forgotten(tmp_path: Path) -> None:
+    queue = WorkQueue(str(tmp_path / "shards.db"))
+    gained: list[str] = []
+    member = ShardMember(queue, worker_id="w0", on_gain=lambda account: gained.append(account.name))
+    member.beat()
+    # An account that moves to w1 when it joins
+    account = next(
+        make_account(f"account-{i}")
+        for i in range(100)
+        if HashRing(["w0", "w1"]).owner(f"account-{i}") == "w1"
+    )
+
+    assert member.claim(account)
+    member.release(account, 0)
+    assert member.claim(account)
+    assert gained == [account.name]
+    member.release(account, 0)
+
+    queue.heartbeat("w1")
+    member.beat()
+    assert not member.claim(account)
+
+    # Back after w1 left: its cached state is stale
+    queue.leave("w1")
+    member.beat()
+    assert member.claim(account)
+    assert gained == [account.name, account.name]
+
+
+def test_workers_split_accounts_without_double_polls(tmp_path: Path) -> None:
+    accounts = [make_account(f"account-{i}") for i in range(12)]
+    queue = WorkQueue(str(tmp_path / "shards.db"))
+    members = [ShardMember(queue, worker_id=f"w{i}", heartbeat_interval=0.05) for i in range(2)]
+    for member in members + members:
+        member.beat()
+    # w1 has not seen w0 join yet and believes it owns every account
+    members[1].ring = HashRing(["w1"])
+    polled: dict[str, list[str]] = {account.name: [] for account in accounts}
+
+    def make_poller(member: ShardMember) -> Poller:
+        def cycle(account: Account) -> int:
+            polled[account.name].append(member.worker_id)
+            return 0
+
+        return Poller(accounts, cycle, shard=member)
+
+    async def scenario() -> None:
+        tasks = [asyncio.create_task(make_poller(member).run()) for member in members]
+        await asyncio.sleep(0.3)
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    asyncio.run(scenario())
+
+    assert all(len(workers) == 1 for workers in polled.values())
+    assert {workers[0] for workers in polled.values()} == {"w0", "w1"}
+
+
+def test_outboxes_of_departed_workers_are_adopted(tmp_path: Path) -> None:
+    queue = WorkQueue(str(tmp_path / "shards.db"))
+    member = ShardMember(queue, worker_id="w1")
+    member.beat()
+    queue.heartbeat("w2")
+    for worker in ("w2", "w3"):
+        Outbox(str(tmp_path / f"outbox-{worker}.json")).enqueue(
+            "topic", [{"title": worker, "details": "12 - 50%"}], None
+        )
+    outbox = Outbox(str(tmp_path / "outbox-w1.json"))
+
+    assert adopt_orphaned_outboxes(outbox, member) == 1
+
+    assert [item["message"]["title"] for item in outbox.due()[("topic", None)]] == ["w3"]
+    assert sorted(path.name for path in tmp_path.glob("outbox-*")) == ["outbox-w1.json", "outbox-w2.json"]
+    assert adopt_orphaned_outboxes(outbox, member) == 0
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+
+# Loaded on first use only: importing the entry points must not pull them in
+LAZY_MODULES = ("bs4", "requests", "lxml", "httpx", "dotenv", "numpy")
+
+
+def imported_modules(statement: str, cwd: Path) -> set[str]:
+    """Run `statement` in a fresh interpreter and list what -X importtime saw."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            name = line.rsplit("|", 1)[1].strip()
+            if name != "imported package":
+                modules.add(name)
+    return modules
+
+
+@pytest.mark.parametrize(
+    ("statement", "cwd"),
+    [
+        ("import main", ROOT_DIR / "src"),
+        ("import src.web.api", ROOT_DIR),
+    ],
+)
+def test_entry_points_import_lazily(statement: str, cwd: Path) -> None:
+    modules = imported_modules(statement, cwd)
+
+    assert not [
+        module
+        for module in modules
+        if module.split(".")[0] in LAZY_MODULES
+    ]
+
+
+def test_importing_main_has_no_side_effects() -> None:
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import logging, main; print(len(logging.getLogger().handlers))",
+        ],
+        cwd=ROOT_DIR / "src",
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert result.stdout.strip() == "0"
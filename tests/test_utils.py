@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+import utils
+from utils import atomic_write, fsync_batch, load_json, save_json
+
+
+def test_save_json_round_trip(tmp_path: Path) -> None:
+    path = tmp_path / "grades.json"
+    data = [{"year_name": "ING4", "grade": "Validé"}]
+
+    save_json(data, str(path))
+    assert load_json(str(path)) == data
+    assert "\n    " in path.read_text(encoding="utf-8")
+
+    save_json(data, str(path), compact=True)
+    assert load_json(str(path)) == data
+    assert "\n" not in path.read_text(encoding="utf-8")
+
+
+def test_unchanged_content_is_not_rewritten(tmp_path: Path) -> None:
+    path = tmp_path / "grades.json"
+
+    assert atomic_write(b"[1]", str(path))
+    inode = path.stat().st_ino
+    assert not atomic_write(b"[1]", str(path))
+    assert path.stat().st_ino == inode
+
+    assert atomic_write(b"[2]", str(path))
+    assert path.read_bytes() == b"[2]"
+
+    # Rewritten by another worker: the file on disk is what counts
+    path.write_bytes(b"[3]")
+    assert atomic_write(b"[2]", str(path))
+    assert path.read_bytes() == b"[2]"
+
+
+def test_failed_write_keeps_previous_file(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    path = tmp_path / "old_grades.json"
+    save_json([{"year_name": "Y1"}], str(path))
+
+    def crash(*args) -> None:
+        raise OSError("power loss")
+
+    monkeypatch.setattr(utils.os, "replace", crash)
+    save_json([{"year_name": "Y2"}], str(path))
+
+    assert json.loads(path.read_text(encoding="utf-8")) == [{"year_name": "Y1"}]
+    assert os.listdir(tmp_path) == ["old_grades.json"]
+
+
+def test_fsync_batch_syncs_each_directory_once(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    synced: list[str] = []
+    monkeypatch.setattr(utils, "_fsync_directory", synced.append)
+
+    with fsync_batch():
+        for index in range(3):
+            save_json([index], str(tmp_path / f"file{index}.json"))
+        save_json([0], str(tmp_path / "outbox.json"), durable=True)
+        assert synced == [str(tmp_path)]
+
+    assert synced == [str(tmp_path), str(tmp_path)]